@@ -0,0 +1,273 @@
+import argparse
+import os
+import time
+import numpy as np
+import settings
+from gallery import ENCODING_DIM, GalleryIndex
+
+KMEANS_ITERATIONS = 12
+# Training points per cluster; the k-means sample is capped at nlist * this value
+KMEANS_POINTS_PER_CLUSTER = 64
+ASSIGN_BLOCK_SIZE = 65536
+
+
+def default_nlist(size):
+    return max(1, int(np.sqrt(size)))
+
+
+def _nearest_centroid(vectors, centroids):
+    """Index of the nearest centroid for every vector, computed in blocks"""
+    c_norms = np.einsum("ij,ij->i", centroids, centroids)
+    labels = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_SIZE):
+        block = vectors[start:start + ASSIGN_BLOCK_SIZE]
+        # ||v||^2 is the same for every centroid, so it can be left out of the argmin
+        scores = block @ centroids.T
+        scores *= -2.0
+        scores += c_norms[None, :]
+        labels[start:start + len(block)] = np.argmin(scores, axis=1)
+    return labels
+
+
+def _centroid_scores(queries, centroids):
+    c_norms = np.einsum("ij,ij->i", centroids, centroids)
+    return c_norms[None, :] - 2.0 * (queries @ centroids.T)
+
+
+def train_centroids(vectors, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """Plain Lloyd k-means on a random sample of the gallery"""
+    rng = np.random.default_rng(seed)
+    nlist = min(nlist, len(vectors))
+    sample_size = min(len(vectors), nlist * KMEANS_POINTS_PER_CLUSTER)
+    sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+
+    for _ in range(iterations):
+        labels = _nearest_centroid(sample, centroids)
+        counts = np.bincount(labels, minlength=nlist)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, sample)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters with random sample points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+    return centroids
+
+
+class IVFIndex(GalleryIndex):
+    """Inverted-file index: k-means clusters over the gallery, only nprobe clusters are scanned per query.
+
+    Rows are stored sorted by cluster, so every inverted list is a contiguous slice of
+    the encodings matrix and is scored with the same matrix product as GalleryIndex.
+    Identities added after the build go to an unclustered tail that every query scans;
+    `python3 ann_index.py build` or a restart folds them into the lists again.
+    """
+
+    def __init__(self, ids, names, encodings, centroids=None, nlist=None, nprobe=None):
+        encodings = np.ascontiguousarray(encodings, dtype=np.float32).reshape(len(ids), ENCODING_DIM)
+        if centroids is None:
+            centroids = train_centroids(encodings, nlist or default_nlist(len(ids)))
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.nprobe = nprobe or settings.IVF_NPROBE
+
+        labels = _nearest_centroid(encodings, self.centroids)
+        order = np.argsort(labels, kind="stable")
+        ids = list(ids)
+        names = list(names)
+        super().__init__([ids[i] for i in order], [names[i] for i in order], encodings[order])
+        counts = np.bincount(labels, minlength=len(self.centroids))
+        offsets = np.concatenate([[0], np.cumsum(counts)])
+        # List l is rows starts[l]:ends[l]; a removal shrinks its list and leaves an unused row
+        self.starts = offsets[:-1].copy()
+        self.ends = offsets[1:].copy()
+        self.tail_start = len(self.ids)
+        self.holes = 0
+
+    def __len__(self):
+        return len(self.ids) - self.holes
+
+    @property
+    def nlist(self):
+        return len(self.centroids)
+
+    def add(self, user_id, name, encoding):
+        # A changed encoding may belong to another list, so it is moved to the tail
+        self.remove(user_id)
+        super().add(user_id, name, encoding)
+
+    def remove(self, user_id):
+        rows = self._rows()
+        row = rows.get(user_id)
+        if row is None:
+            return False
+        if row >= self.tail_start:
+            return super().remove(user_id)
+        del rows[user_id]
+        lst = int(np.searchsorted(self.starts, row, side="right")) - 1
+        last = self.ends[lst] - 1
+        if row != last:
+            self.ids[row], self.names[row] = self.ids[last], self.names[last]
+            self._buffer[row] = self._buffer[last]
+            self._norm_buffer[row] = self._norm_buffer[last]
+            rows[self.ids[row]] = row
+        self.ends[lst] = last
+        self.ids[last] = self.names[last] = None
+        self._norm_buffer[last] = np.inf
+        self.holes += 1
+        return True
+
+    def search(self, queries, k=1, nprobe=None):
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        if nprobe >= self.nlist:
+            return super().search(queries, k)
+
+        indices = np.full((len(queries), k), -1, dtype=np.int64)
+        distances = np.full((len(queries), k), np.inf, dtype=np.float32)
+        probes = np.argsort(_centroid_scores(queries, self.centroids), axis=1)[:, :nprobe]
+        tail = (self.tail_start, len(self.ids))
+        for qi, (query, lists) in enumerate(zip(queries, probes)):
+            q_norm = float(query @ query)
+            cand_idx = []
+            cand_sq = []
+            for start, end in [(self.starts[lst], self.ends[lst]) for lst in lists] + [tail]:
+                if start == end:
+                    continue
+                sq = self.encodings[start:end] @ query
+                sq *= -2.0
+                sq += self.sq_norms[start:end]
+                sq += q_norm
+                cand_idx.append(np.arange(start, end))
+                cand_sq.append(sq)
+            if not cand_idx:
+                continue
+            cand_idx = np.concatenate(cand_idx)
+            cand_sq = np.concatenate(cand_sq)
+            kq = min(k, len(cand_sq))
+            top = np.argpartition(cand_sq, kq - 1)[:kq]
+            top = top[np.argsort(cand_sq[top])]
+            indices[qi, :kq] = cand_idx[top]
+            distances[qi, :kq] = np.sqrt(np.maximum(cand_sq[top], 0.0))
+        return indices, distances
+
+    def save(self, path):
+        np.savez(path, centroids=self.centroids, nprobe=self.nprobe)
+
+    @classmethod
+    def load(cls, path, ids, names, encodings, nprobe=None):
+        """Reuse trained centroids from path and assign the current gallery to them"""
+        data = np.load(path)
+        return cls(ids, names, encodings, centroids=data["centroids"], nprobe=nprobe or int(data["nprobe"]))
+
+
+def load_or_build(ids, names, encodings, path=None):
+    """Open the IVF index for the given gallery, training and saving centroids if none exist yet"""
+    path = path or settings.IVF_INDEX_PATH
+    if os.path.exists(path):
+        try:
+            return IVFIndex.load(path, ids, names, encodings)
+        except Exception as e:
+            print(f"Could not load IVF index {path}, rebuilding: {e}")
+    index = IVFIndex(ids, names, encodings, nlist=settings.IVF_NLIST or None)
+    index.save(path)
+    return index
+
+
+def build(nlist=None, path=None):
+    """Retrain the IVF centroids on the current gallery from the database"""
+    from db_config import SessionLocal
+    from embeddings import load_gallery
+
+    db = SessionLocal()
+    try:
+        ids, names, encodings = load_gallery(db)
+    finally:
+        db.close()
+    if not ids:
+        print("В базе нет сохранённых векторов лиц")
+        return None
+
+    started = time.perf_counter()
+    index = IVFIndex(ids, names, encodings, nlist=nlist or settings.IVF_NLIST or None)
+    index.save(path or settings.IVF_INDEX_PATH)
+    print(f"IVF index: {len(index)} vectors, {index.nlist} lists, "
+          f"built in {time.perf_counter() - started:.1f}s -> {path or settings.IVF_INDEX_PATH}")
+    return index
+
+
+def synthetic_gallery(size, seed=0, identities_per_cluster=50):
+    """Clustered vectors with face-encoding-like distances (~0.8 within a cluster, ~1.2 across)"""
+    rng = np.random.default_rng(seed)
+    n_clusters = max(1, size // identities_per_cluster)
+    centers = rng.normal(scale=0.06, size=(n_clusters, ENCODING_DIM)).astype(np.float32)
+    vectors = centers[rng.integers(n_clusters, size=size)]
+    vectors += rng.normal(scale=0.05, size=(size, ENCODING_DIM)).astype(np.float32)
+    return vectors
+
+
+def synthetic_queries(gallery, count, seed=1, noise=0.3):
+    """Noisy copies of random gallery rows: the same identity photographed again"""
+    rng = np.random.default_rng(seed)
+    rows = rng.choice(len(gallery), count, replace=False)
+    noise_vec = rng.normal(size=(count, ENCODING_DIM)).astype(np.float32)
+    noise_vec *= noise / np.linalg.norm(noise_vec, axis=1, keepdims=True)
+    return gallery[rows] + noise_vec
+
+
+def benchmark(sizes, nprobes, queries=1000, nlist=None):
+    """Report recall@1 and per-query latency of IVF against exact search"""
+    results = []
+    for size in sizes:
+        vectors = synthetic_gallery(size)
+        ids = np.arange(size)
+        names = [""] * size
+        query_vectors = synthetic_queries(vectors, queries)
+
+        exact = GalleryIndex(ids, names, vectors)
+        started = time.perf_counter()
+        exact_idx, _ = exact.search(query_vectors, k=1)
+        exact_ms = (time.perf_counter() - started) * 1000 / queries
+        truth = np.asarray(exact.ids)[exact_idx[:, 0]]
+
+        started = time.perf_counter()
+        ivf = IVFIndex(ids, names, vectors, nlist=nlist)
+        build_s = time.perf_counter() - started
+        print(f"\nsize={size} nlist={ivf.nlist} build={build_s:.1f}s exact={exact_ms:.3f} ms/query")
+        for nprobe in nprobes:
+            started = time.perf_counter()
+            ivf_idx, _ = ivf.search(query_vectors, k=1, nprobe=nprobe)
+            ivf_ms = (time.perf_counter() - started) * 1000 / queries
+            found = np.where(ivf_idx[:, 0] >= 0, np.asarray(ivf.ids)[ivf_idx[:, 0]], -1)
+            recall = float(np.mean(found == truth))
+            print(f"  nprobe={nprobe:4d} recall@1={recall:.4f} {ivf_ms:.3f} ms/query "
+                  f"speedup={exact_ms / ivf_ms:.1f}x")
+            results.append({"size": size, "nlist": ivf.nlist, "nprobe": nprobe, "recall_at_1": recall,
+                            "ivf_ms_per_query": ivf_ms, "exact_ms_per_query": exact_ms})
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Approximate (IVF) index over stored face encodings")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = sub.add_parser("build", help="(re)train the index on the current gallery")
+    build_parser.add_argument("--nlist", type=int, help="number of clusters (default sqrt(n))")
+    build_parser.add_argument("--path", help=f"output file (default {settings.IVF_INDEX_PATH})")
+
+    bench_parser = sub.add_parser("bench", help="recall@1 against exact search on synthetic galleries")
+    bench_parser.add_argument("--sizes", type=int, nargs="+", default=[100000, 1000000])
+    bench_parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 4, 8, 16, 32, 64])
+    bench_parser.add_argument("--queries", type=int, default=1000)
+    bench_parser.add_argument("--nlist", type=int)
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build(nlist=args.nlist, path=args.path)
+    else:
+        benchmark(args.sizes, args.nprobe, queries=args.queries, nlist=args.nlist)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import bisect
+from PyQt6.QtCore import Qt, QAbstractTableModel, QModelIndex
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import SQLAlchemyError
+from models import Attendance, User
+from attendance_queries import display_name, format_ts, local_time, range_conditions
+
+PAGE_SIZE = 200
+
+
+class AttendanceTableModel(QAbstractTableModel):
+    """Attendance rows fetched lazily in pages, sorted and filtered by the database.
+
+    Pages are read with keyset pagination on (sort column, id), so scrolling deep into
+    history costs the same as reading the first page.
+    """
+
+    HEADERS = ["ID", "Имя", "Дата", "Время"]
+    # Stored row layout is (id, name, ts); both date and time columns sort by ts
+    SORT_FIELDS = [0, 1, 2, 2]
+    SORT_COLUMNS = [Attendance.id, display_name, Attendance.ts]
+
+    def __init__(self, db, page_size=PAGE_SIZE, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.page_size = page_size
+        self.rows = []
+        self.has_more = True
+        self.sort_column = 0
+        self.descending = True  # newest first
+        self.date_from = None
+        self.date_to = None
+        self.name_filter = ""
+
+    # Qt model interface
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.HEADERS)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid() or role != Qt.ItemDataRole.DisplayRole:
+            return None
+        row_id, name, ts = self.rows[index.row()]
+        column = index.column()
+        if column == 0:
+            return str(row_id)
+        if column == 1:
+            return name
+        return format_ts(ts)[column - 2]
+
+    def headerData(self, section, orientation, role=Qt.ItemDataRole.DisplayRole):
+        if orientation == Qt.Orientation.Horizontal and role == Qt.ItemDataRole.DisplayRole:
+            return self.HEADERS[section]
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.has_more
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or not self.has_more:
+            return
+        try:
+            page = self._query_page(self.rows[-1] if self.rows else None)
+        except SQLAlchemyError as e:
+            # Central database unreachable (offline kiosk): show what is loaded
+            self.db.rollback()
+            self.has_more = False
+            print(f"Could not load attendance: {e}")
+            return
+        self.has_more = len(page) == self.page_size
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            self.rows.extend(page)
+            self.endInsertRows()
+
+    def sort(self, column, order=Qt.SortOrder.AscendingOrder):
+        self.sort_column = column
+        self.descending = order == Qt.SortOrder.DescendingOrder
+        self.refresh()
+
+    # Queries
+
+    def set_filter(self, date_from=None, date_to=None, name=""):
+        """Filter by an inclusive local date range ('YYYY-MM-DD') and a name substring"""
+        self.date_from = date_from
+        self.date_to = date_to
+        self.name_filter = name.strip()
+        self.refresh()
+
+    def refresh(self):
+        """Drop loaded rows and read the first page again"""
+        self.beginResetModel()
+        self.rows = []
+        self.has_more = True
+        self.endResetModel()
+        self.fetchMore()
+
+    def _conditions(self):
+        conditions = range_conditions(self.date_from, self.date_to)
+        if self.name_filter:
+            conditions.append(display_name.ilike(f"%{self.name_filter}%"))
+        return conditions
+
+    def _query_page(self, after=None):
+        field = self.SORT_FIELDS[self.sort_column]
+        sort_col = self.SORT_COLUMNS[field]
+        conditions = self._conditions()
+        if after is not None:
+            value, last_id = after[field], after[0]
+            if self.descending:
+                conditions.append(or_(sort_col < value, and_(sort_col == value, Attendance.id < last_id)))
+            else:
+                conditions.append(or_(sort_col > value, and_(sort_col == value, Attendance.id > last_id)))
+        if self.descending:
+            order = [sort_col.desc(), Attendance.id.desc()]
+        else:
+            order = [sort_col.asc(), Attendance.id.asc()]
+        stmt = (
+            select(Attendance.id, display_name, Attendance.ts)
+            .outerjoin(User, Attendance.user_id == User.id)
+            .where(*conditions)
+            .order_by(*order)
+            .limit(self.page_size)
+        )
+        return [tuple(row) for row in self.db.execute(stmt)]
+
+    # Incremental updates
+
+    def _matches_filter(self, row):
+        _, name, ts = row
+        date = format_ts(ts)[0]
+        if self.date_from and date < self.date_from:
+            return False
+        if self.date_to and date > self.date_to:
+            return False
+        return not self.name_filter or self.name_filter.lower() in name.lower()
+
+    def _sort_key(self, row):
+        value = row[self.SORT_FIELDS[self.sort_column]]
+        if self.SORT_FIELDS[self.sort_column] == 2:
+            value = local_time(value).replace(tzinfo=None)
+        return (value, row[0])
+
+    def append_records(self, records):
+        """Insert newly written rows (dicts with the Attendance columns) without re-querying.
+
+        A row is placed only where it belongs in the current sort order; rows that fall
+        past the loaded pages will show up when those pages are fetched.
+        """
+        keys = None
+        for record in records:
+            row = (record["id"], record["name"], record["ts"])
+            if not self._matches_filter(row):
+                continue
+            if keys is None:
+                # Sort keys of the loaded rows in ascending order, built once per batch and kept
+                # in step with self.rows below
+                keys = [self._sort_key(r) for r in self.rows]
+                if self.descending:
+                    keys.reverse()
+            key = self._sort_key(row)
+            if self.descending:
+                at = bisect.bisect_left(keys, key)
+                position = len(keys) - at
+            else:
+                at = position = bisect.bisect_right(keys, key)
+            if position == len(self.rows) and self.has_more:
+                continue
+            keys.insert(at, key)
+            self.beginInsertRows(QModelIndex(), position, position)
+            self.rows.insert(position, row)
+            self.endInsertRows()
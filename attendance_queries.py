@@ -0,0 +1,48 @@
+from datetime import datetime, time, timedelta
+from sqlalchemy import func, select
+from models import Attendance, User
+
+# Current user name, or the name stored at capture time once the user was deleted
+display_name = func.coalesce(User.name, Attendance.name)
+
+
+def day_start(day):
+    """Local midnight of a date (or 'YYYY-MM-DD' string) as an aware datetime"""
+    if isinstance(day, str):
+        day = datetime.strptime(day, "%Y-%m-%d").date()
+    return datetime.combine(day, time.min).astimezone()
+
+
+def range_conditions(date_from=None, date_to=None, user_id=None):
+    """Index-friendly conditions on (user_id, ts) for an inclusive local date range"""
+    conditions = []
+    if user_id is not None:
+        conditions.append(Attendance.user_id == user_id)
+    if date_from:
+        conditions.append(Attendance.ts >= day_start(date_from))
+    if date_to:
+        conditions.append(Attendance.ts < day_start(date_to) + timedelta(days=1))
+    return conditions
+
+
+def attendance_select(date_from=None, date_to=None, user_id=None, name=None):
+    """SELECT id, name, ts of attendance rows in range, oldest first"""
+    stmt = (
+        select(Attendance.id, display_name.label("name"), Attendance.ts)
+        .outerjoin(User, Attendance.user_id == User.id)
+        .where(*range_conditions(date_from, date_to, user_id))
+    )
+    if name:
+        stmt = stmt.where(display_name.ilike(f"%{name}%"))
+    return stmt.order_by(Attendance.ts, Attendance.id)
+
+
+def local_time(ts):
+    """Stored timestamps in local time (SQLite returns them naive, already local)"""
+    return ts.astimezone() if ts.tzinfo is not None else ts
+
+
+def format_ts(ts):
+    """(date, time) strings as the tables and exports show them"""
+    ts = local_time(ts)
+    return ts.strftime("%Y-%m-%d"), ts.strftime("%H:%M:%S")
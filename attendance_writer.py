@@ -0,0 +1,214 @@
+import json
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import insert
+import settings
+from db_config import SessionLocal
+from models import Attendance
+from metrics import metrics
+from reports import upsert_daily
+
+
+def _spool_line(row):
+    return json.dumps({**row, "ts": row["ts"].isoformat()}, ensure_ascii=False) + "\n"
+
+
+def _parse_spool_line(line):
+    row = json.loads(line)
+    if "ts" not in row:
+        # Spooled before the user_id/ts schema: local date and time strings
+        row = {
+            "user_id": None,
+            "name": row["name"],
+            "ts": datetime.strptime(f"{row['date']} {row['time']}", "%Y-%m-%d %H:%M:%S").astimezone(),
+        }
+    else:
+        row["ts"] = datetime.fromisoformat(row["ts"])
+    return row
+
+
+def read_spool(path):
+    """(rows, bad lines) of a spool file; a line cut short by a crash mid-append is a bad line
+    instead of failing the whole spool"""
+    rows = []
+    bad = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                rows.append(_parse_spool_line(line))
+            except (ValueError, KeyError, TypeError):
+                bad.append(line if line.endswith("\n") else line + "\n")
+    return rows, bad
+
+
+class AttendanceWriter(threading.Thread):
+    """Write-behind sink for attendance events.
+
+    submit() only queues the event with its capture time. A background thread flushes
+    queued events as one bulk insert when batch_size events are waiting or flush_interval
+    has passed, retrying with backoff. If the database stays unreachable the batch is
+    appended to a local JSONL spool file, which is replayed once the database is back.
+    """
+
+    def __init__(self, session_factory=SessionLocal, batch_size=None, flush_interval=None,
+                 spool_path=None, max_retries=None, on_flush=None):
+        super().__init__(name="attendance-writer", daemon=True)
+        self.session_factory = session_factory
+        self.batch_size = settings.ATTENDANCE_BATCH_SIZE if batch_size is None else batch_size
+        self.flush_interval = settings.ATTENDANCE_FLUSH_INTERVAL if flush_interval is None else flush_interval
+        self.spool_path = spool_path or settings.ATTENDANCE_SPOOL_PATH
+        self.max_retries = settings.ATTENDANCE_MAX_RETRIES if max_retries is None else max_retries
+        # Called from the writer thread with the stored rows (dicts including the new ids)
+        self.on_flush = on_flush
+        self.queue = queue.Queue()
+        self._stopping = threading.Event()
+        self._spool_lock = threading.Lock()
+        self._next_replay = 0.0
+        self.written = 0
+        self.spooled = 0
+        self.failed_flushes = 0
+
+    def submit(self, user_id, name, when=None):
+        """Queue an attendance event; when defaults to now (the capture time, not the flush time)"""
+        when = (when or datetime.now()).astimezone()
+        self.queue.put({"user_id": user_id, "name": name, "ts": when})
+
+    @property
+    def pending(self):
+        return self.queue.qsize()
+
+    def stop(self, timeout=10):
+        """Flush whatever is queued and stop the thread"""
+        self._stopping.set()
+        if self.is_alive():
+            self.join(timeout)
+
+    def run(self):
+        self._replay_spool_safely()
+        while True:
+            batch = self._collect()
+            if batch:
+                self.flush(batch)
+            if self._stopping.is_set() and self.queue.empty():
+                break
+            if time.monotonic() >= self._next_replay and os.path.exists(self.spool_path):
+                self._replay_spool_safely()
+
+    def _replay_spool_safely(self):
+        """Replay without ever ending the thread: a spool problem must not drop new events"""
+        try:
+            self.replay_spool()
+        except Exception as e:
+            print(f"Spool replay failed: {e}")
+            self._next_replay = time.monotonic() + settings.ATTENDANCE_SPOOL_RETRY_INTERVAL
+
+    def _collect(self):
+        """Wait for the first event, then gather more until the batch is full or the interval ends"""
+        batch = []
+        try:
+            batch.append(self.queue.get(timeout=0.5))
+        except queue.Empty:
+            return batch
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                if timeout <= 0 or self._stopping.is_set():
+                    batch.append(self.queue.get_nowait())
+                else:
+                    batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _insert(self, rows):
+        """Bulk insert, updating the daily summaries in the same transaction; returns the
+        stored rows including their new ids"""
+        db = self.session_factory()
+        try:
+            with metrics.timer("db_commit"):
+                stmt = insert(Attendance).returning(Attendance.id, Attendance.user_id, Attendance.name, Attendance.ts)
+                stored = [dict(row._mapping) for row in db.execute(stmt, rows)]
+                upsert_daily(db, rows)
+                db.commit()
+            return stored
+        finally:
+            db.close()
+
+    def flush(self, rows):
+        """Bulk-insert rows, spooling them to disk if every retry fails. Returns True if written."""
+        delay = 0.5
+        for attempt in range(self.max_retries + 1):
+            try:
+                stored = self._insert(rows)
+            except Exception as e:
+                print(f"Attendance flush failed (attempt {attempt + 1}): {e}")
+                if attempt < self.max_retries and not self._stopping.is_set():
+                    time.sleep(delay)
+                    delay *= 2
+                continue
+            self.written += len(rows)
+            metrics.incr("attendance_written", len(rows))
+            metrics.set_gauge("attendance_queue_depth", self.pending)
+            if self.on_flush:
+                self.on_flush(stored)
+            return True
+
+        self.failed_flushes += 1
+        self._spool(rows)
+        return False
+
+    def _spool(self, rows):
+        with self._spool_lock:
+            with open(self.spool_path, "a", encoding="utf-8") as f:
+                for row in rows:
+                    f.write(_spool_line(row))
+                f.flush()
+                os.fsync(f.fileno())
+        self.spooled += len(rows)
+        metrics.incr("attendance_spooled", len(rows))
+        self._next_replay = time.monotonic() + settings.ATTENDANCE_SPOOL_RETRY_INTERVAL
+        print(f"Database unavailable, {len(rows)} attendance events spooled to {self.spool_path}")
+
+    def replay_spool(self):
+        """Insert spooled events in batches; whatever cannot be written stays in the spool"""
+        with self._spool_lock:
+            if not os.path.exists(self.spool_path):
+                return
+            rows, bad = read_spool(self.spool_path)
+            if bad:
+                # Kept for inspection; the rest of the spool is replayed as usual
+                with open(self.spool_path + ".bad", "a", encoding="utf-8") as f:
+                    f.writelines(bad)
+                metrics.incr("attendance_spool_bad_lines", len(bad))
+                print(f"{len(bad)} unreadable spooled events moved to {self.spool_path}.bad")
+            written = 0
+            try:
+                for start in range(0, len(rows), self.batch_size):
+                    chunk = rows[start:start + self.batch_size]
+                    stored = self._insert(chunk)
+                    written += len(chunk)
+                    if self.on_flush:
+                        self.on_flush(stored)
+            except Exception as e:
+                print(f"Spool replay failed, {len(rows) - written} events kept: {e}")
+                self._next_replay = time.monotonic() + settings.ATTENDANCE_SPOOL_RETRY_INTERVAL
+            remaining = rows[written:]
+            if remaining:
+                tmp_path = self.spool_path + ".tmp"
+                with open(tmp_path, "w", encoding="utf-8") as f:
+                    for row in remaining:
+                        f.write(_spool_line(row))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(tmp_path, self.spool_path)
+            else:
+                os.remove(self.spool_path)
+            self.written += written
+            if written:
+                print(f"Replayed {written} spooled attendance events")
@@ -0,0 +1,279 @@
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+import settings
+from db_config import Base
+from models import User
+from gallery import GalleryIndex
+from ann_index import IVFIndex, synthetic_gallery, synthetic_queries
+
+SEED = 0
+MATCH_SIZES = [100, 1000, 10000, 100000, 1000000]
+LOAD_SIZES = [1000, 10000, 100000]
+FACES_PER_FRAME = 4
+FRAME_SIZE = (480, 640)
+# Slower by more than this fraction of the baseline counts as a regression
+REGRESSION_THRESHOLD = 0.15
+
+
+def time_calls(func, repeat, warmup=1):
+    """Median and p95 wall time of func() in milliseconds"""
+    for _ in range(warmup):
+        func()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return {"median_ms": float(np.median(samples)), "p95_ms": float(np.percentile(samples, 95)),
+            "repeat": repeat}
+
+
+def result(name, params, timing, **extra):
+    return {"name": name, "params": params, **timing, **extra}
+
+
+def sqlite_database(directory, name):
+    engine = create_engine(f"sqlite:///{os.path.join(directory, name)}")
+    Base.metadata.create_all(engine)
+    return engine
+
+
+def seed_users(engine, count, batch_size=10000):
+    """Users with synthetic encodings tagged with the current model, so nothing is re-encoded"""
+    from embeddings import ENCODING_MODEL, encoding_to_bytes
+    vectors = synthetic_gallery(count, seed=SEED)
+    with engine.begin() as conn:
+        for start in range(0, count, batch_size):
+            conn.execute(insert(User), [
+                {"name": f"user{i}", "photo": b"", "encoding": encoding_to_bytes(vectors[i]),
+                 "encoding_model": ENCODING_MODEL}
+                for i in range(start, min(start + batch_size, count))
+            ])
+
+
+def bench_gallery_load(directory, sizes, repeat):
+    """load_known_faces path: bulk read of stored encodings plus index build"""
+    from templates import load_index
+    results = []
+    for size in sizes:
+        engine = sqlite_database(directory, f"gallery_{size}.db")
+        seed_users(engine, size)
+        session = sessionmaker(bind=engine)()
+        try:
+            timing = time_calls(lambda: load_index(session), repeat)
+        finally:
+            session.close()
+            engine.dispose()
+        results.append(result("gallery_load", {"size": size}, timing))
+        print(f"gallery_load size={size}: {timing['median_ms']:.1f} ms")
+    return results
+
+
+def synthetic_frames(count, frames_dir=None):
+    """Images from frames_dir if given, else seeded noise frames of FRAME_SIZE"""
+    import cv2
+    if frames_dir:
+        names = sorted(n for n in os.listdir(frames_dir) if n.lower().endswith((".jpg", ".jpeg", ".png")))
+        frames = [cv2.cvtColor(cv2.imread(os.path.join(frames_dir, n)), cv2.COLOR_BGR2RGB) for n in names]
+        return frames[:count] or synthetic_frames(count)
+    rng = np.random.default_rng(SEED)
+    return [rng.integers(0, 256, size=(*FRAME_SIZE, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def bench_detection(repeat, frames_dir=None):
+    """HOG detection per frame and encoding per face; without bundled frames the encoder
+    runs on fixed boxes, which costs the same as on real faces"""
+    from detection import FaceDetector
+    frames = synthetic_frames(8, frames_dir)
+    detector = FaceDetector(time_budget_ms=float("inf"))
+    counter = itertools.count()
+    detect_timing = time_calls(lambda: detector.detect(frames[next(counter) % len(frames)]), repeat)
+    height, width = frames[0].shape[:2]
+    side = min(height, width) // 3
+    top, left = height // 3, width // 3
+    boxes = [(top, left + side, top + side, left)]
+    encode_timing = time_calls(lambda: detector.encode(frames[0], boxes), repeat)
+    print(f"detect: {detect_timing['median_ms']:.1f} ms/frame, encode: {encode_timing['median_ms']:.1f} ms/face")
+    return [
+        result("detect", {"frame": f"{width}x{height}", "scale": detector.scale}, detect_timing,
+               per_second=1000 / detect_timing["median_ms"]),
+        result("encode", {"face": side}, encode_timing, per_second=1000 / encode_timing["median_ms"]),
+    ]
+
+
+def bench_frame_path(repeat, sizes=((640, 480), (1280, 720))):
+    """Camera tab per-frame work: recognition frame into a pooled buffer plus the display
+    image, with the bytes newly allocated per frame (0 once the buffers exist)"""
+    import tracemalloc
+    from display import FramePipeline
+    rng = np.random.default_rng(SEED)
+    results = []
+    for width, height in sizes:
+        frame = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        pipeline = FramePipeline()
+        out = np.empty((pipeline.recognition_size[1], pipeline.recognition_size[0], 3), dtype=np.uint8)
+
+        def step():
+            pipeline.recognition_frame(frame, out)
+            pipeline.display_image(frame, (800, 600))
+
+        timing = time_calls(step, repeat)
+        tracemalloc.start()
+        step()
+        allocated = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        results.append(result("frame_path", {"frame": f"{width}x{height}", "display": "800x600"}, timing,
+                              allocated_bytes=allocated))
+        print(f"frame_path {width}x{height}: {timing['median_ms']:.2f} ms/frame, {allocated} bytes allocated")
+    return results
+
+
+def bench_matching(sizes, repeat, faces=FACES_PER_FRAME):
+    """Per-frame matching latency of the exact and IVF matchers on synthetic galleries"""
+    results = []
+    for size in sizes:
+        vectors = synthetic_gallery(size, seed=SEED)
+        ids = np.arange(size)
+        names = [""] * size
+        queries = synthetic_queries(vectors, min(faces, size), seed=SEED + 1)
+        exact = GalleryIndex(ids, names, vectors)
+        timing = time_calls(lambda: exact.match(queries), repeat)
+        results.append(result("match.exact", {"size": size, "faces": len(queries)}, timing))
+        print(f"match.exact size={size}: {timing['median_ms']:.2f} ms/frame")
+        if size >= settings.IVF_MIN_GALLERY_SIZE:
+            ivf = IVFIndex(ids, names, vectors)
+            timing = time_calls(lambda: ivf.match(queries), repeat)
+            results.append(result("match.ivf", {"size": size, "faces": len(queries), "nprobe": ivf.nprobe},
+                                  timing))
+            print(f"match.ivf size={size}: {timing['median_ms']:.2f} ms/frame")
+        del vectors, exact
+    return results
+
+
+def bench_attendance_writes(directory, events, batch_size=None):
+    """Events per second through the write-behind AttendanceWriter into SQLite"""
+    from attendance_writer import AttendanceWriter
+    engine = sqlite_database(directory, "attendance.db")
+    writer = AttendanceWriter(session_factory=sessionmaker(bind=engine), batch_size=batch_size,
+                              flush_interval=0.05, spool_path=os.path.join(directory, "spool.jsonl"))
+    writer.start()
+    started = time.perf_counter()
+    for i in range(events):
+        writer.submit(None, f"user{i % 100}")
+    writer.stop(timeout=600)
+    elapsed = time.perf_counter() - started
+    engine.dispose()
+    rate = writer.written / elapsed
+    print(f"attendance_write: {rate:.0f} events/s")
+    return [result("attendance_write", {"events": events, "batch_size": writer.batch_size},
+                   {"median_ms": elapsed * 1000 / max(writer.written, 1), "repeat": 1}, per_second=rate)]
+
+
+def metadata():
+    return {
+        "timestamp": datetime.now().astimezone().isoformat(),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "seed": SEED,
+        "matcher": settings.MATCHER,
+        "ivf_nprobe": settings.IVF_NPROBE,
+    }
+
+
+def run(args):
+    results = []
+    with tempfile.TemporaryDirectory(prefix="faceid-bench-") as directory:
+        if "load" in args.only:
+            results += bench_gallery_load(directory, args.load_sizes, args.repeat)
+        if "detect" in args.only:
+            results += bench_detection(args.repeat, args.frames)
+        if "display" in args.only:
+            results += bench_frame_path(args.repeat)
+        if "match" in args.only:
+            results += bench_matching(args.sizes, args.repeat)
+        if "write" in args.only:
+            results += bench_attendance_writes(directory, args.events)
+    return {"meta": metadata(), "results": results}
+
+
+def result_key(item):
+    return item["name"] + json.dumps(item["params"], sort_keys=True)
+
+
+def compare(current, baseline, threshold=REGRESSION_THRESHOLD):
+    """Print median time changes against the baseline; returns the regressed entries"""
+    previous = {result_key(item): item for item in baseline["results"]}
+    regressions = []
+    for item in current["results"]:
+        old = previous.get(result_key(item))
+        if old is None:
+            continue
+        change = item["median_ms"] / old["median_ms"] - 1 if old["median_ms"] else 0.0
+        flag = ""
+        if change > threshold:
+            flag = "  REGRESSION"
+            regressions.append(item)
+        print(f"{item['name']:<18} {json.dumps(item['params'], sort_keys=True):<45} "
+              f"{old['median_ms']:10.3f} -> {item['median_ms']:10.3f} ms ({change:+.1%}){flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks of the recognition pipeline")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = sub.add_parser("run", help="run the benchmarks and write JSON results")
+    run_parser.add_argument("--output", default="benchmark_results.json")
+    run_parser.add_argument("--only", nargs="+", choices=["load", "detect", "display", "match", "write"],
+                            default=["load", "detect", "display", "match", "write"])
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=MATCH_SIZES, help="matching gallery sizes")
+    run_parser.add_argument("--load-sizes", type=int, nargs="+", default=LOAD_SIZES,
+                            help="users stored in SQLite for the gallery load benchmark")
+    run_parser.add_argument("--events", type=int, default=20000, help="attendance events written")
+    run_parser.add_argument("--repeat", type=int, default=20)
+    run_parser.add_argument("--frames", help="directory of frames to use instead of synthetic ones")
+    run_parser.add_argument("--baseline", help="compare with this results file after the run")
+    run_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+
+    compare_parser = sub.add_parser("compare", help="compare two results files")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD)
+
+    args = parser.parse_args()
+    if args.command == "run":
+        current = run(args)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(current, f, indent=2)
+        print(f"Results written to {args.output}")
+        baseline_path = args.baseline
+    else:
+        with open(args.current, encoding="utf-8") as f:
+            current = json.load(f)
+        baseline_path = args.baseline
+
+    if baseline_path:
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(current, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s) over {args.threshold:.0%}")
+            sys.exit(1)
+        print("No regressions")
+
+
+if __name__ == "__main__":
+    main()
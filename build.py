@@ -25,13 +25,12 @@ def build_executable():
         '--hidden-import=face_recognition',
         '--hidden-import=cv2',
         '--hidden-import=numpy',
-        '--hidden-import=pandas',
         '--hidden-import=sqlalchemy',
         '--hidden-import=psycopg2',
         '--hidden-import=PIL',
         '--hidden-import=openpyxl',
-        '--hidden-import=docx',
-        '--hidden-import=fpdf',
+        '--hidden-import=pyarrow',  # Imported lazily by the Parquet export
+        '--hidden-import=pyarrow.parquet',
         '--noconfirm',  # Replace existing build
         'gui.py'  # Main script
     ]
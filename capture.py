@@ -0,0 +1,187 @@
+import collections
+import sys
+import threading
+import time
+from typing import NamedTuple
+import cv2
+import numpy as np
+import settings
+from metrics import metrics
+
+BACKENDS = {
+    "any": cv2.CAP_ANY,
+    "v4l2": cv2.CAP_V4L2,
+    "ffmpeg": cv2.CAP_FFMPEG,
+    "gstreamer": cv2.CAP_GSTREAMER,
+    "avfoundation": cv2.CAP_AVFOUNDATION,
+    "dshow": cv2.CAP_DSHOW,
+    "msmf": cv2.CAP_MSMF,
+}
+# A live source is given up after this many failed reads in a row (about a second)
+MAX_CONSECUTIVE_FAILURES = 100
+
+
+class Frame(NamedTuple):
+    index: int
+    timestamp: float  # time.time() when the frame was read
+    image: np.ndarray  # BGR
+
+
+def parse_source(source):
+    """Camera index for digit strings, otherwise a file path or stream URL"""
+    if isinstance(source, str) and source.isdigit():
+        return int(source)
+    return source
+
+
+def default_backend(source):
+    if not isinstance(source, int):
+        return "ffmpeg"
+    if sys.platform == "darwin":
+        return "avfoundation"
+    if sys.platform.startswith("win"):
+        return "msmf"
+    if sys.platform.startswith("linux"):
+        return "v4l2"
+    return "any"
+
+
+def open_video_capture(source, backend="auto", width=None, height=None, fps=None):
+    """Open a cv2.VideoCapture with the configured backend, falling back to CAP_ANY"""
+    source = parse_source(source)
+    if backend == "auto":
+        backend = default_backend(source)
+    cap = cv2.VideoCapture(source, BACKENDS[backend])
+    if not cap.isOpened() and backend != "any":
+        print(f"Backend {backend} could not open {source!r}, falling back to CAP_ANY")
+        cap = cv2.VideoCapture(source, cv2.CAP_ANY)
+    if cap.isOpened() and isinstance(source, int):
+        if width:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps:
+            cap.set(cv2.CAP_PROP_FPS, fps)
+        cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Minimize driver-side buffering
+        cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))  # Use MJPEG for better performance
+    return cap
+
+
+class CaptureThread(threading.Thread):
+    """Reads frames at the device's native rate into a small timestamped ring buffer.
+
+    Consumers call latest() to get the most recent frame without blocking, or
+    wait_for(index) to block until a frame newer than index arrives. Video files are
+    paced to their own frame rate so they can stand in for a live camera.
+    """
+
+    def __init__(self, source=None, backend=None, buffer_size=None, width=None, height=None,
+                 fps=None, loop=False, realtime=True):
+        super().__init__(name="capture", daemon=True)
+        self.source = parse_source(settings.CAMERA_SOURCE if source is None else source)
+        self.backend = backend or settings.CAMERA_BACKEND
+        self.width = width or settings.CAMERA_WIDTH
+        self.height = height or settings.CAMERA_HEIGHT
+        self.fps = fps or settings.CAMERA_FPS
+        self.loop = loop
+        self.realtime = realtime
+        self.buffer = collections.deque(maxlen=buffer_size or settings.CAPTURE_BUFFER_SIZE)
+        self._cond = threading.Condition()
+        self._running = False
+        self.cap = None
+        self.frames_read = 0
+        self.read_failures = 0
+        self.finished = False
+
+    @property
+    def is_file(self):
+        return isinstance(self.source, str) and "://" not in self.source
+
+    def open(self):
+        """Open the device; returns False if it cannot be opened"""
+        self.cap = open_video_capture(self.source, self.backend, self.width, self.height, self.fps)
+        return self.cap.isOpened()
+
+    def start(self):
+        if self.cap is None and not self.open():
+            raise IOError(f"Could not open video source {self.source!r}")
+        self._running = True
+        super().start()
+
+    def run(self):
+        frame_interval = 0.0
+        if self.is_file and self.realtime:
+            file_fps = self.cap.get(cv2.CAP_PROP_FPS)
+            frame_interval = 1.0 / file_fps if file_fps > 0 else 1.0 / 30
+        next_due = time.perf_counter()
+        rewound = False
+        failures_in_row = 0
+
+        while self._running:
+            started = time.perf_counter()
+            ret, image = self.cap.read()
+            metrics.observe("capture_read", (time.perf_counter() - started) * 1000)
+            if not ret:
+                if self.is_file and self.loop and not rewound:
+                    # Rewind once; a file that yields no frame even from the start ends the loop
+                    self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    rewound = True
+                    continue
+                self.read_failures += 1
+                failures_in_row += 1
+                if self.is_file or failures_in_row > MAX_CONSECUTIVE_FAILURES:
+                    break
+                time.sleep(0.01)
+                continue
+            rewound = False
+            failures_in_row = 0
+
+            with self._cond:
+                self.frames_read += 1
+                self.buffer.append(Frame(self.frames_read, time.time(), image))
+                self._cond.notify_all()
+
+            if frame_interval:
+                next_due += frame_interval
+                delay = next_due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    next_due = time.perf_counter()
+
+        with self._cond:
+            self.finished = True
+            self._cond.notify_all()
+        self.cap.release()
+
+    def latest(self):
+        """Most recent frame or None; never blocks on the device"""
+        with self._cond:
+            return self.buffer[-1] if self.buffer else None
+
+    @property
+    def measured_fps(self):
+        """Capture rate over the frames currently in the ring buffer"""
+        with self._cond:
+            if len(self.buffer) < 2:
+                return 0.0
+            span = self.buffer[-1].timestamp - self.buffer[0].timestamp
+            return (len(self.buffer) - 1) / span if span > 0 else 0.0
+
+    def wait_for(self, after_index=0, timeout=None):
+        """Block until a frame newer than after_index is available (None on timeout or end of stream)"""
+        with self._cond:
+            self._cond.wait_for(
+                lambda: (self.buffer and self.buffer[-1].index > after_index) or self.finished,
+                timeout,
+            )
+            if self.buffer and self.buffer[-1].index > after_index:
+                return self.buffer[-1]
+            return None
+
+    def stop(self):
+        self._running = False
+        if self.is_alive():
+            self.join(timeout=2)
+        elif self.cap is not None:
+            self.cap.release()
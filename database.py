@@ -1,7 +1,6 @@
-from db_config import engine, Base
-from models import User, Attendance
+from migrations import upgrade
 
-# Create all tables
-Base.metadata.create_all(bind=engine)
+# Create all tables and add columns introduced by newer versions
+upgrade()
 
 print("База данных создана!")
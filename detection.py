@@ -0,0 +1,108 @@
+import time
+import cv2
+import face_recognition
+import numpy as np
+import settings
+
+# Smallest face dlib's HOG detector finds without upsampling (its sliding window is 80x80)
+HOG_MIN_FACE = 80
+# Faces narrower than this are upscaled before encoding; dlib aligns to a 150x150 chip
+ENCODE_MIN_FACE = 100
+# Extra context kept around the box when cropping for encoding, as a fraction of its size
+CROP_MARGIN = 0.3
+# Weight of the newest sample in the detection time moving average
+LOAD_SMOOTHING = 0.2
+
+
+class FaceDetector:
+    """HOG detection on a downscaled frame, with the scale chosen from the smallest expected
+    face and lowered further while detection runs over its time budget.
+
+    Boxes are returned in full-resolution (top, right, bottom, left) coordinates.
+    """
+
+    def __init__(self, min_face_size=None, time_budget_ms=None, min_scale=None, max_scale=None):
+        self.min_face_size = settings.MIN_FACE_SIZE if min_face_size is None else min_face_size
+        self.time_budget_ms = settings.DETECTION_TIME_BUDGET_MS if time_budget_ms is None else time_budget_ms
+        self.min_scale = settings.MIN_DETECTION_SCALE if min_scale is None else min_scale
+        self.max_scale = settings.MAX_DETECTION_SCALE if max_scale is None else max_scale
+        # Scale at which the smallest expected face is just large enough for the HOG window
+        self.target_scale = float(np.clip(HOG_MIN_FACE / self.min_face_size, self.min_scale, self.max_scale))
+        self.scale = self.target_scale
+        self.avg_detect_ms = 0.0
+        self.last_detect_ms = 0.0
+        self.last_encode_ms = 0.0
+
+    def _adapt(self, detect_ms):
+        self.last_detect_ms = detect_ms
+        if self.avg_detect_ms == 0.0:
+            self.avg_detect_ms = detect_ms
+        else:
+            self.avg_detect_ms += LOAD_SMOOTHING * (detect_ms - self.avg_detect_ms)
+        # Trade the smallest detectable faces for speed when over budget, recover when well under it
+        if self.avg_detect_ms > self.time_budget_ms:
+            self.scale = max(self.min_scale, self.scale * 0.9)
+        elif self.avg_detect_ms < self.time_budget_ms * 0.5:
+            self.scale = min(self.target_scale, self.scale / 0.9)
+
+    def detect(self, rgb_frame):
+        started = time.perf_counter()
+        scale = self.scale
+        if abs(scale - 1.0) > 1e-3:
+            interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_LINEAR
+            small = cv2.resize(rgb_frame, (0, 0), fx=scale, fy=scale, interpolation=interpolation)
+        else:
+            small = rgb_frame
+        locations = face_recognition.face_locations(small, number_of_times_to_upsample=0, model="hog")
+
+        height, width = rgb_frame.shape[:2]
+        boxes = []
+        for top, right, bottom, left in locations:
+            boxes.append((
+                max(0, int(top / scale)),
+                min(width, int(right / scale)),
+                min(height, int(bottom / scale)),
+                max(0, int(left / scale)),
+            ))
+        self._adapt((time.perf_counter() - started) * 1000)
+        return boxes
+
+    def encode(self, rgb_frame, boxes):
+        """Encodings for boxes, each computed on a tight crop around the face"""
+        started = time.perf_counter()
+        encodings = [encode_on_crop(rgb_frame, box) for box in boxes]
+        self.last_encode_ms = (time.perf_counter() - started) * 1000
+        return encodings
+
+    def stats(self):
+        return {
+            "scale": self.scale,
+            "detect_ms": self.last_detect_ms,
+            "avg_detect_ms": self.avg_detect_ms,
+            "encode_ms": self.last_encode_ms,
+        }
+
+
+def crop_face(rgb_frame, box, margin=CROP_MARGIN, min_face=ENCODE_MIN_FACE):
+    """Crop around box with a margin, upscaling only faces smaller than min_face.
+    Returns the crop and the box in crop coordinates."""
+    top, right, bottom, left = box
+    height, width = rgb_frame.shape[:2]
+    face_w, face_h = right - left, bottom - top
+    pad_x, pad_y = int(face_w * margin), int(face_h * margin)
+    x0, y0 = max(0, left - pad_x), max(0, top - pad_y)
+    x1, y1 = min(width, right + pad_x), min(height, bottom + pad_y)
+    crop = rgb_frame[y0:y1, x0:x1]
+    local = (top - y0, right - x0, bottom - y0, left - x0)
+
+    if 0 < face_w < min_face:
+        factor = min_face / face_w
+        crop = cv2.resize(crop, (0, 0), fx=factor, fy=factor, interpolation=cv2.INTER_LINEAR)
+        local = tuple(int(v * factor) for v in local)
+    return np.ascontiguousarray(crop), local
+
+
+def encode_on_crop(rgb_frame, box):
+    crop, local = crop_face(rgb_frame, box)
+    encodings = face_recognition.face_encodings(crop, [local])
+    return encodings[0]
@@ -0,0 +1,186 @@
+import cv2
+import numpy as np
+from PyQt6.QtCore import QPoint, QRect, Qt
+from PyQt6.QtGui import QColor, QFont, QFontMetrics, QImage, QPainter, QPen, QPixmap
+from PyQt6.QtWidgets import QWidget
+from metrics import metrics
+
+# Frames handed to the recognition worker; face boxes come back in these coordinates
+RECOGNITION_SIZE = (640, 480)
+
+
+def mirror_scale_matrix(src_size, dst_size):
+    """Affine matrix for cv2.warpAffine that scales src_size to dst_size and mirrors it
+    horizontally in the same pass (pixel centres map like cv2.resize)"""
+    (src_w, src_h), (dst_w, dst_h) = src_size, dst_size
+    sx, sy = dst_w / src_w, dst_h / src_h
+    return np.array([
+        [-sx, 0.0, dst_w - 0.5 - 0.5 * sx],
+        [0.0, sy, 0.5 * sy - 0.5],
+    ], dtype=np.float64)
+
+
+def fit_size(size, bounds):
+    """Largest size with the aspect ratio of size that fits in bounds"""
+    scale = min(bounds[0] / size[0], bounds[1] / size[1])
+    return max(1, int(size[0] * scale)), max(1, int(size[1] * scale))
+
+
+class FramePipeline:
+    """Per-frame work of the camera tab on preallocated buffers.
+
+    Every OpenCV call writes into a reused output (dst=), so once the sizes are stable no
+    frame-sized array is allocated. The recognition frame is resized with cv2.resize
+    (bilinear, as the detector expects) and mirrored in place. The displayed frame is
+    mirrored and scaled in a single nearest-neighbour warp, the same quality as the fast
+    pixmap scaling it replaces, into a 32-bit BGRX buffer that QImage.Format_RGB32 wraps
+    without a copy and Qt paints without a format conversion.
+    """
+
+    def __init__(self, recognition_size=RECOGNITION_SIZE):
+        self.recognition_size = recognition_size
+        self._matrices = {}
+        self._small = None
+        self._display_bgr = None
+        self._display = None
+        self.image = None
+
+    def _matrix(self, src_size, dst_size):
+        key = (src_size, dst_size)
+        matrix = self._matrices.get(key)
+        if matrix is None:
+            if len(self._matrices) > 8:
+                self._matrices.clear()
+            matrix = self._matrices[key] = mirror_scale_matrix(src_size, dst_size)
+        return matrix
+
+    @staticmethod
+    def _buffer(buffer, shape):
+        return buffer if buffer is not None and buffer.shape == shape else np.empty(shape, dtype=np.uint8)
+
+    def recognition_frame(self, bgr, out):
+        """Mirrored RGB frame of recognition_size written into out (h, w, 3)"""
+        width, height = self.recognition_size
+        self._small = self._buffer(self._small, (height, width, 3))
+        cv2.resize(bgr, self.recognition_size, dst=self._small)
+        cv2.cvtColor(self._small, cv2.COLOR_BGR2RGB, dst=out)
+        cv2.flip(out, 1, dst=out)
+        return out
+
+    def display_image(self, bgr, size):
+        """Mirrored frame scaled to size as a QImage that shares the pipeline's buffer.
+        The image is valid until the next call."""
+        width, height = size
+        self._display_bgr = self._buffer(self._display_bgr, (height, width, 3))
+        self._display = self._buffer(self._display, (height, width, 4))
+        cv2.warpAffine(bgr, self._matrix((bgr.shape[1], bgr.shape[0]), size), size,
+                       dst=self._display_bgr, flags=cv2.INTER_NEAREST, borderMode=cv2.BORDER_REPLICATE)
+        cv2.cvtColor(self._display_bgr, cv2.COLOR_BGR2BGRA, dst=self._display)
+        if self.image is None or self.image.width() != width or self.image.height() != height:
+            # Wraps the numpy buffer; rebuilt only when the display size changes
+            self.image = QImage(self._display.data, width, height, width * 4, QImage.Format.Format_RGB32)
+        return self.image
+
+
+class VideoWidget(QWidget):
+    """Shows the camera frame with face boxes and the stats overlay on top.
+
+    The frame is blitted as is; the overlays are rendered into cached pixmaps only when
+    their contents change, and each frame repaints just the image area.
+    """
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.image = None
+        self.image_rect = QRect()
+        self.faces = []
+        self.face_scale = 1.0
+        self.overlay_lines = []
+        self._faces_layer = None
+        self._overlay_layer = None
+
+    def display_size(self, frame_size=RECOGNITION_SIZE):
+        """Size the frame is shown at: fitted into the widget, aspect ratio kept"""
+        return fit_size(frame_size, (self.width(), self.height()))
+
+    def set_image(self, image):
+        size = image.size()
+        rect = QRect(QPoint((self.width() - size.width()) // 2, (self.height() - size.height()) // 2), size)
+        self.image = image
+        if rect != self.image_rect:
+            # Size or position changed: the letterbox and the face layer must be redrawn too
+            if rect.size() != self.image_rect.size():
+                self.face_scale = size.width() / RECOGNITION_SIZE[0]
+                self._faces_layer = None
+            self.image_rect = rect
+            self.update()
+        else:
+            self.update(self.image_rect)
+
+    def set_faces(self, faces):
+        """Face results with boxes in RECOGNITION_SIZE coordinates"""
+        if faces != self.faces:
+            self.faces = faces
+            self._faces_layer = None
+
+    def set_overlay_lines(self, lines):
+        if lines != self.overlay_lines:
+            self.overlay_lines = lines
+            self._overlay_layer = None
+
+    def clear(self):
+        self.image = None
+        self.faces = []
+        self._faces_layer = None
+        self.update()
+
+    def _render_faces(self):
+        layer = QPixmap(self.image_rect.size())
+        layer.fill(Qt.GlobalColor.transparent)
+        painter = QPainter(layer)
+        painter.setFont(QFont("Inter", 14, QFont.Weight.Bold))
+        s = self.face_scale
+        for result in self.faces:
+            top, right, bottom, left = (int(v * s) for v in result.box)
+            if not result.identified:
+                # Not encoded yet: neither a match nor a stranger
+                color, label = QColor("#9E9E9E"), "Проверка..."
+            elif result.name:
+                color, label = QColor("#4CAF50"), f"{result.name} ({result.distance:.2f})"
+            else:
+                color, label = QColor("#F44336"), "Неизвестный"
+            painter.setPen(QPen(color, 2))
+            painter.drawRect(left, top, right - left, bottom - top)
+            painter.drawText(left, max(top - 8, 14), label)
+        painter.end()
+        return layer
+
+    def _render_overlay(self):
+        font = QFont("Monospace", 8)
+        line_height = QFontMetrics(font).height()
+        height = line_height * len(self.overlay_lines) + 8
+        layer = QPixmap(260, height)
+        layer.fill(QColor(0, 0, 0, 160))
+        painter = QPainter(layer)
+        painter.setFont(font)
+        painter.setPen(QColor("#FFFFFF"))
+        for i, line in enumerate(self.overlay_lines):
+            painter.drawText(4, line_height * (i + 1), line)
+        painter.end()
+        return layer
+
+    def paintEvent(self, event):
+        with metrics.timer("paint"):
+            painter = QPainter(self)
+            painter.fillRect(event.rect(), QColor("#000"))
+            if self.image is not None:
+                painter.drawImage(self.image_rect.topLeft(), self.image)
+                if self.faces:
+                    if self._faces_layer is None:
+                        self._faces_layer = self._render_faces()
+                    painter.drawPixmap(self.image_rect.topLeft(), self._faces_layer)
+                if self.overlay_lines:
+                    if self._overlay_layer is None:
+                        self._overlay_layer = self._render_overlay()
+                    painter.drawPixmap(self.image_rect.topLeft() + QPoint(4, 4), self._overlay_layer)
+            painter.end()
@@ -0,0 +1,187 @@
+import argparse
+import hashlib
+import cv2
+import face_recognition
+import numpy as np
+from sqlalchemy import or_, select
+from sqlalchemy.orm import undefer
+from db_config import SessionLocal
+from models import User, UserEmbedding
+from gallery import ENCODING_DIM
+
+# Tag stored next to every vector. Bump it whenever the encoder or its parameters
+# change so that stored encodings are recomputed on the next gallery load.
+ENCODING_MODEL = "dlib_resnet_v1/face_recognition-1.3.0/jitters=1"
+BACKFILL_BATCH_SIZE = 50
+
+
+def photo_hash(photo):
+    """SHA-256 of the raw photo bytes"""
+    return hashlib.sha256(photo).hexdigest()
+
+
+def encoding_to_bytes(encoding):
+    return np.asarray(encoding, dtype="<f4").tobytes()
+
+
+def encoding_from_bytes(data):
+    return np.frombuffer(data, dtype="<f4")
+
+
+def encode_photo(photo):
+    """Decode a stored photo and return the encoding of its first face (or None)"""
+    np_array = np.frombuffer(photo, dtype=np.uint8)
+    image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    rgb_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    encodings = face_recognition.face_encodings(rgb_image)
+    return encodings[0] if encodings else None
+
+
+def is_stale(user, digest=None):
+    """True when the stored encoding was made by another model or from another photo"""
+    if user.encoding_model != ENCODING_MODEL:
+        return True
+    return digest is not None and user.photo_hash != digest
+
+
+def update_user_encoding(user, force=False):
+    """Recompute the user's encoding if the photo or the model changed. Returns True if recomputed.
+
+    A photo without a detectable face is stored with an empty encoding but a current
+    tag and hash, so it is not retried on every load.
+    """
+    digest = photo_hash(user.photo)
+    if not force and not is_stale(user, digest):
+        return False
+    encoding = encode_photo(user.photo)
+    user.encoding = encoding_to_bytes(encoding) if encoding is not None else None
+    user.encoding_model = ENCODING_MODEL
+    user.photo_hash = digest
+    return True
+
+
+def reencode_stale_users(db):
+    """Re-encode users whose encoding was made by another model. Returns how many."""
+    stale_users = db.query(User).options(undefer(User.photo)).filter(
+        or_(User.encoding_model.is_(None), User.encoding_model != ENCODING_MODEL)
+    ).all()
+    for user in stale_users:
+        try:
+            update_user_encoding(user)
+        except Exception as e:
+            print(f"Error encoding photo for {user.name}: {e}")
+    if stale_users:
+        db.commit()
+    return len(stale_users)
+
+
+def load_gallery(db):
+    """Bulk-read stored encodings as (ids, names, float32 matrix of shape (n, 128))"""
+    reencode_stale_users(db)
+    rows = db.execute(
+        select(User.id, User.name, User.encoding)
+        .where(User.encoding.isnot(None), User.encoding_model == ENCODING_MODEL)
+        .order_by(User.id)
+    ).all()
+    ids = [row.id for row in rows]
+    names = [row.name for row in rows]
+    matrix = np.empty((len(rows), ENCODING_DIM), dtype=np.float32)
+    for i, row in enumerate(rows):
+        matrix[i] = encoding_from_bytes(row.encoding)
+    return ids, names, matrix
+
+
+def reencode_stale_templates(db):
+    """Re-encode additional photos whose encoding was made by another model. Returns how many."""
+    stale = db.query(UserEmbedding).options(undefer(UserEmbedding.photo)).filter(
+        or_(UserEmbedding.encoding_model.is_(None), UserEmbedding.encoding_model != ENCODING_MODEL)
+    ).all()
+    for template in stale:
+        try:
+            update_user_encoding(template)
+        except Exception as e:
+            print(f"Error encoding template photo {template.id}: {e}")
+    if stale:
+        db.commit()
+    return len(stale)
+
+
+def load_templates(db):
+    """Bulk-read additional enrollment encodings as (user_ids, float32 matrix of shape (n, 128))"""
+    reencode_stale_templates(db)
+    rows = db.execute(
+        select(UserEmbedding.user_id, UserEmbedding.encoding)
+        .where(UserEmbedding.encoding.isnot(None), UserEmbedding.encoding_model == ENCODING_MODEL)
+        .order_by(UserEmbedding.user_id, UserEmbedding.id)
+    ).all()
+    matrix = np.empty((len(rows), ENCODING_DIM), dtype=np.float32)
+    for i, row in enumerate(rows):
+        matrix[i] = encoding_from_bytes(row.encoding)
+    return [row.user_id for row in rows], matrix
+
+
+def user_encodings(db, user_id):
+    """All current encodings of one user as a (n, 128) matrix, the primary photo first"""
+    primary = db.execute(
+        select(User.encoding)
+        .where(User.id == user_id, User.encoding.isnot(None), User.encoding_model == ENCODING_MODEL)
+    ).scalars().all()
+    if not primary:
+        return np.empty((0, ENCODING_DIM), dtype=np.float32)
+    extra = db.execute(
+        select(UserEmbedding.encoding)
+        .where(UserEmbedding.user_id == user_id, UserEmbedding.encoding.isnot(None),
+               UserEmbedding.encoding_model == ENCODING_MODEL)
+        .order_by(UserEmbedding.id)
+    ).scalars().all()
+    return np.array([encoding_from_bytes(data) for data in primary + extra], dtype=np.float32)
+
+
+def backfill(force=False):
+    """Encode every user whose photo or model tag changed, in small batches"""
+    db = SessionLocal()
+    try:
+        last_id = 0
+        checked = updated = 0
+        while True:
+            users = (
+                db.query(User)
+                .options(undefer(User.photo))
+                .filter(User.id > last_id)
+                .order_by(User.id)
+                .limit(BACKFILL_BATCH_SIZE)
+                .all()
+            )
+            if not users:
+                break
+            for user in users:
+                try:
+                    if update_user_encoding(user, force=force):
+                        updated += 1
+                except Exception as e:
+                    print(f"Ошибка кодирования фото для {user.name}: {e}")
+            db.commit()
+            checked += len(users)
+            last_id = users[-1].id
+            db.expunge_all()
+            print(f"Проверено: {checked}, обновлено: {updated}")
+        return checked, updated
+    finally:
+        db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill stored face encodings")
+    parser.add_argument("--force", action="store_true", help="re-encode every photo")
+    args = parser.parse_args()
+
+    from migrations import upgrade
+    upgrade()
+    checked, updated = backfill(force=args.force)
+    print(f"Готово: проверено {checked}, перекодировано {updated}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,263 @@
+import argparse
+import csv
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+import face_recognition
+import numpy as np
+from sqlalchemy import insert, select
+from db_config import SessionLocal
+from models import User, UserEmbedding
+from embeddings import ENCODING_MODEL, encoding_to_bytes, load_gallery, photo_hash
+from gallery import GalleryIndex
+from thumbnails import make_thumbnail
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png"}
+# Users inserted per transaction
+ENROLL_BATCH_SIZE = 200
+# Identities closer than this are reported as possible duplicates (recognition uses 0.6)
+DUPLICATE_DISTANCE = 0.4
+# Photos are downscaled to this longest side before detection; the stored photo is untouched
+MAX_DETECTION_SIDE = 1024
+# Images handed to a worker process at a time
+WORKER_CHUNK_SIZE = 4
+
+
+def name_from_path(path, root):
+    """'root/Ivan Petrov/1.jpg' -> 'Ivan Petrov', 'root/Ivan_Petrov.jpg' -> 'Ivan Petrov'"""
+    relative = os.path.relpath(path, root)
+    parent = os.path.dirname(relative)
+    stem = parent.split(os.sep)[0] if parent else os.path.splitext(relative)[0]
+    return stem.replace("_", " ").strip()
+
+
+def scan_directory(root):
+    """(name, path) for every image under root, in a stable order"""
+    items = []
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in IMAGE_EXTENSIONS:
+                path = os.path.join(dirpath, filename)
+                items.append((name_from_path(path, root), path))
+    return items
+
+
+def read_manifest(path):
+    """(name, path) rows of a CSV with 'name' and 'path' columns; paths are relative to the CSV"""
+    base = os.path.dirname(os.path.abspath(path))
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        return [
+            (row["name"].strip(), os.path.join(base, row["path"].strip()))
+            for row in csv.DictReader(f)
+        ]
+
+
+def process_image(item):
+    """Runs in a worker process: validate one photo and compute everything stored for it"""
+    name, path = item
+    result = {"name": name, "path": path, "error": None}
+    try:
+        with open(path, "rb") as f:
+            photo = f.read()
+        image = cv2.imdecode(np.frombuffer(photo, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            result["error"] = "не удалось прочитать изображение"
+            return result
+        scale = MAX_DETECTION_SIDE / max(image.shape[:2])
+        if scale < 1.0:
+            image = cv2.resize(image, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        locations = face_recognition.face_locations(rgb)
+        if len(locations) != 1:
+            result["error"] = "лицо не найдено" if not locations else "на фото несколько лиц"
+            return result
+        result.update(
+            photo=photo,
+            photo_hash=photo_hash(photo),
+            encoding=face_recognition.face_encodings(rgb, locations)[0].astype(np.float32),
+            thumbnail=make_thumbnail(photo),
+        )
+    except Exception as e:
+        result["error"] = str(e)
+    return result
+
+
+class DuplicateChecker:
+    """Nearest other enrolled identity, including the ones added earlier in this run.
+    Photos of a user with the same name are that user's extra templates, not duplicates."""
+
+    def __init__(self, gallery, threshold=DUPLICATE_DISTANCE):
+        self.gallery = gallery
+        self.threshold = threshold
+        self.new_names = []
+        self.new_encodings = []
+
+    def check(self, name, encoding):
+        """(name, distance) of a near-duplicate with another name, or None"""
+        best = None
+        if len(self.gallery):
+            match = self.gallery.match([encoding], tolerance=self.threshold, k=2)[0]
+            for other, distance in ((c[1], c[2]) for c in match.candidates):
+                if other != name and distance <= self.threshold:
+                    best = (other, distance)
+                    break
+        if self.new_encodings:
+            distances = np.linalg.norm(np.asarray(self.new_encodings) - encoding, axis=1)
+            distances[np.asarray(self.new_names) == name] = np.inf
+            i = int(np.argmin(distances))
+            if distances[i] <= self.threshold and (best is None or distances[i] < best[1]):
+                best = (self.new_names[i], float(distances[i]))
+        return best
+
+    def add(self, name, encoding):
+        self.new_names.append(name)
+        self.new_encodings.append(encoding)
+
+
+def insert_users(db, results, user_ids):
+    """Insert a batch in one transaction. The first photo of a new name becomes a user,
+    further photos of a known name become that user's extra templates.
+    user_ids maps names to ids and is updated with the new users."""
+    new_users = []
+    for r in results:
+        if r["name"] not in user_ids and all(u["name"] != r["name"] for u in new_users):
+            new_users.append(r)
+    templates = [r for r in results if not any(r is u for u in new_users)]
+
+    if new_users:
+        stmt = insert(User).returning(User.id, sort_by_parameter_order=True)
+        new_ids = db.execute(stmt, [
+            {
+                "name": r["name"],
+                "photo": r["photo"],
+                "photo_hash": r["photo_hash"],
+                "thumbnail": r["thumbnail"],
+                "encoding": encoding_to_bytes(r["encoding"]),
+                "encoding_model": ENCODING_MODEL,
+            }
+            for r in new_users
+        ]).scalars().all()
+        user_ids.update(zip((r["name"] for r in new_users), new_ids))
+    if templates:
+        db.execute(insert(UserEmbedding), [
+            {
+                "user_id": user_ids[r["name"]],
+                "photo": r["photo"],
+                "photo_hash": r["photo_hash"],
+                "encoding": encoding_to_bytes(r["encoding"]),
+                "encoding_model": ENCODING_MODEL,
+            }
+            for r in templates
+        ])
+    db.commit()
+    return len(new_users), len(templates)
+
+
+def enroll(items, workers=None, batch_size=ENROLL_BATCH_SIZE, skip_duplicates=False, report_path=None):
+    """Enroll (name, path) items in parallel. Photos already in the database (same SHA-256)
+    are skipped, so an interrupted import can simply be run again. Several photos with the
+    same name are stored as one user with extra templates."""
+    db = SessionLocal()
+    stats = Counter()
+    problems = []
+    try:
+        enrolled_hashes = set(db.execute(select(User.photo_hash).where(User.photo_hash.isnot(None))).scalars())
+        enrolled_hashes.update(db.execute(
+            select(UserEmbedding.photo_hash).where(UserEmbedding.photo_hash.isnot(None))
+        ).scalars())
+        # Oldest user wins when several share a name
+        user_ids = {name: user_id for user_id, name in db.execute(select(User.id, User.name).order_by(User.id.desc()))}
+        checker = DuplicateChecker(GalleryIndex(*load_gallery(db)))
+
+        pending = []
+        for name, path in items:
+            if any(char.isdigit() for char in name) or not name:
+                problems.append((path, name, "имя не должно содержать цифр"))
+                stats["rejected"] += 1
+                continue
+            try:
+                with open(path, "rb") as f:
+                    digest = photo_hash(f.read())
+            except OSError as e:
+                problems.append((path, name, str(e)))
+                stats["failed"] += 1
+                continue
+            if digest in enrolled_hashes:
+                stats["skipped"] += 1
+            else:
+                enrolled_hashes.add(digest)
+                pending.append((name, path))
+        print(f"К обработке: {len(pending)}, уже в базе: {stats['skipped']}")
+
+        started = time.perf_counter()
+        batch = []
+        with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+            for done, result in enumerate(pool.map(process_image, pending, chunksize=WORKER_CHUNK_SIZE), 1):
+                if result["error"]:
+                    problems.append((result["path"], result["name"], result["error"]))
+                    stats["rejected"] += 1
+                else:
+                    duplicate = checker.check(result["name"], result["encoding"])
+                    if duplicate:
+                        other, distance = duplicate
+                        problems.append((result["path"], result["name"],
+                                         f"похож на {other} (расстояние {distance:.3f})"))
+                        stats["duplicates"] += 1
+                    if not (duplicate and skip_duplicates):
+                        checker.add(result["name"], result["encoding"])
+                        batch.append(result)
+                if len(batch) >= batch_size:
+                    users, templates = insert_users(db, batch, user_ids)
+                    stats["enrolled"] += users
+                    stats["templates"] += templates
+                    batch = []
+                if done % 100 == 0:
+                    rate = done / (time.perf_counter() - started)
+                    print(f"Обработано {done}/{len(pending)} ({rate:.1f} фото/с)")
+            if batch:
+                users, templates = insert_users(db, batch, user_ids)
+                stats["enrolled"] += users
+                stats["templates"] += templates
+        elapsed = time.perf_counter() - started
+    finally:
+        db.close()
+
+    if report_path and problems:
+        with open(report_path, "w", newline="", encoding="utf-8-sig") as f:
+            writer = csv.writer(f)
+            writer.writerow(["path", "name", "problem"])
+            writer.writerows(problems)
+    stats["images_per_second"] = len(pending) / elapsed if elapsed > 0 else 0.0
+    return stats, problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enroll users from a photo directory or CSV manifest")
+    parser.add_argument("source", help="directory of photos (file or subdirectory name is the user name) "
+                                       "or a CSV file with name,path columns")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--batch-size", type=int, default=ENROLL_BATCH_SIZE, help="users per transaction")
+    parser.add_argument("--skip-duplicates", action="store_true",
+                        help="do not enroll photos that look like an already enrolled person")
+    parser.add_argument("--report", default="enroll_report.csv", help="CSV of rejected and flagged photos")
+    args = parser.parse_args()
+
+    from migrations import upgrade
+    upgrade()
+    items = read_manifest(args.source) if os.path.isfile(args.source) else scan_directory(args.source)
+    stats, problems = enroll(items, args.workers, args.batch_size, args.skip_duplicates, args.report)
+    print(
+        f"Готово: добавлено {stats['enrolled']}, дополнительных фото {stats['templates']}, "
+        f"уже в базе {stats['skipped']}, "
+        f"отклонено {stats['rejected']}, ошибок {stats['failed']}, возможных дубликатов {stats['duplicates']}, "
+        f"{stats['images_per_second']:.1f} фото/с"
+    )
+    if problems:
+        print(f"Подробности в {args.report}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,441 @@
+import csv
+import os
+import re
+import struct
+import zipfile
+import zlib
+from xml.sax.saxutils import escape
+from sqlalchemy import func, select
+from PyQt6.QtCore import QThread, pyqtSignal
+import settings
+from db_config import engine
+from attendance_queries import attendance_select, format_ts, local_time
+
+EXPORT_CHUNK_SIZE = 5000
+HEADERS = ["ID", "Имя", "Дата", "Время"]
+TITLE = "История посещений"
+
+
+def iter_attendance_chunks(date_from=None, date_to=None, user_id=None, chunk_size=EXPORT_CHUNK_SIZE, bind=engine):
+    """Yield lists of (id, name, ts) rows read through a server-side cursor"""
+    stmt = attendance_select(date_from, date_to, user_id)
+    with bind.connect() as conn:
+        result = conn.execution_options(stream_results=True, yield_per=chunk_size).execute(stmt)
+        for partition in result.partitions(chunk_size):
+            yield [tuple(row) for row in partition]
+
+
+def count_attendance(date_from=None, date_to=None, user_id=None, bind=engine):
+    stmt = select(func.count()).select_from(attendance_select(date_from, date_to, user_id).order_by(None).subquery())
+    with bind.connect() as conn:
+        return conn.execute(stmt).scalar()
+
+
+def display_row(row):
+    record_id, name, ts = row
+    return (record_id, name, *format_ts(ts))
+
+
+class CsvExporter:
+    extension = "csv"
+
+    def __init__(self, path):
+        # utf-8-sig so Excel opens Cyrillic names correctly
+        self.file = open(path, "w", newline="", encoding="utf-8-sig")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(HEADERS)
+
+    def write(self, rows):
+        self.writer.writerows(display_row(row) for row in rows)
+
+    def close(self):
+        self.file.close()
+
+
+class ExcelExporter:
+    """openpyxl write-only workbook: rows are streamed to disk instead of kept as cells"""
+    extension = "xlsx"
+    MAX_ROWS = 1048576  # per sheet, including the header
+
+    def __init__(self, path):
+        from openpyxl import Workbook
+        self.path = path
+        self.workbook = Workbook(write_only=True)
+        self.sheet = None
+        self.sheet_rows = 0
+        self._new_sheet()
+
+    def _new_sheet(self):
+        index = len(self.workbook.worksheets) + 1
+        self.sheet = self.workbook.create_sheet(TITLE[:25] if index == 1 else f"{TITLE[:25]} {index}")
+        self.sheet.append(HEADERS)
+        self.sheet_rows = 1
+
+    def write(self, rows):
+        for row in rows:
+            if self.sheet_rows >= self.MAX_ROWS:
+                self._new_sheet()
+            self.sheet.append(display_row(row))
+            self.sheet_rows += 1
+
+    def close(self):
+        self.workbook.save(self.path)
+
+
+class WordExporter:
+    """Writes the .docx package directly, streaming document.xml into the zip entry"""
+    extension = "docx"
+
+    CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/word/document.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml"/>'
+        '</Types>'
+    )
+    RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="word/document.xml"/>'
+        '</Relationships>'
+    )
+    DOCUMENT_START = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+    )
+    DOCUMENT_END = (
+        '<w:sectPr><w:pgSz w:w="11906" w:h="16838"/>'
+        '<w:pgMar w:top="1134" w:right="850" w:bottom="1134" w:left="1701"/></w:sectPr>'
+        '</w:body></w:document>'
+    )
+
+    def __init__(self, path):
+        self.zip = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+        self.zip.writestr("[Content_Types].xml", self.CONTENT_TYPES)
+        self.zip.writestr("_rels/.rels", self.RELS)
+        self.document = self.zip.open("word/document.xml", "w", force_zip64=True)
+        self._write(self.DOCUMENT_START)
+        self._write(f'<w:p><w:r><w:rPr><w:b/><w:sz w:val="32"/></w:rPr><w:t>{escape(TITLE)}</w:t></w:r></w:p>')
+
+    def _write(self, text):
+        self.document.write(text.encode("utf-8"))
+
+    def write(self, rows):
+        parts = []
+        for row in rows:
+            record_id, name, date, time = display_row(row)
+            text = f"ID: {record_id}, Имя: {name}, Дата: {date}, Время: {time}"
+            parts.append(f'<w:p><w:r><w:t xml:space="preserve">{escape(text)}</w:t></w:r></w:p>')
+        self._write("".join(parts))
+
+    def close(self):
+        self._write(self.DOCUMENT_END)
+        self.document.close()
+        self.zip.close()
+
+
+# Unicode TrueType fonts tried for PDF export when FACEID_PDF_FONT_PATH is not set
+PDF_FONT_CANDIDATES = [
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "fonts", "DejaVuSans.ttf"),
+    "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+    "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+    "/Library/Fonts/Arial Unicode.ttf",
+    "/System/Library/Fonts/Supplemental/Arial.ttf",
+    os.path.join(os.environ.get("WINDIR", r"C:\Windows"), "Fonts", "arial.ttf"),
+]
+
+
+def find_pdf_font():
+    for path in [settings.PDF_FONT_PATH] + PDF_FONT_CANDIDATES:
+        if path and os.path.exists(path):
+            return path
+    raise FileNotFoundError("Не найден шрифт TrueType с кириллицей для PDF, укажите его в FACEID_PDF_FONT_PATH")
+
+
+class TrueTypeFont:
+    """Just enough of a TrueType file to embed it in a PDF: glyph ids, advance widths and metrics"""
+
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.data = data = f.read()
+        tables = {}
+        for i in range(struct.unpack(">H", data[4:6])[0]):
+            tag, _, offset, _ = struct.unpack(">4sIII", data[12 + 16 * i:28 + 16 * i])
+            tables[tag] = offset
+        head, hhea = tables[b"head"], tables[b"hhea"]
+        self.units_per_em = struct.unpack(">H", data[head + 18:head + 20])[0]
+        self.bbox = [self.scale(v) for v in struct.unpack(">4h", data[head + 36:head + 44])]
+        ascent, descent = struct.unpack(">2h", data[hhea + 4:hhea + 8])
+        self.ascent, self.descent = self.scale(ascent), self.scale(descent)
+        metrics_count = struct.unpack(">H", data[hhea + 34:hhea + 36])[0]
+        self.advances = struct.unpack(f">{metrics_count * 2}H", data[tables[b"hmtx"]:tables[b"hmtx"] + 4 * metrics_count])[::2]
+        self.glyphs = self._read_cmap(tables[b"cmap"])
+        self.name = re.sub(r"[^A-Za-z0-9-]", "", os.path.splitext(os.path.basename(path))[0]) or "Font"
+
+    def scale(self, value):
+        return int(round(value * 1000 / self.units_per_em))
+
+    def width(self, glyph):
+        return self.scale(self.advances[min(glyph, len(self.advances) - 1)])
+
+    def _read_cmap(self, cmap):
+        data = self.data
+        subtables = {}
+        for i in range(struct.unpack(">H", data[cmap + 2:cmap + 4])[0]):
+            platform, encoding, offset = struct.unpack(">HHI", data[cmap + 4 + 8 * i:cmap + 12 + 8 * i])
+            subtables[(platform, encoding)] = cmap + offset
+        glyphs = {}
+        if (3, 10) in subtables:  # format 12, full Unicode
+            table = subtables[(3, 10)]
+            for i in range(struct.unpack(">I", data[table + 12:table + 16])[0]):
+                first, last, glyph = struct.unpack(">3I", data[table + 16 + 12 * i:table + 28 + 12 * i])
+                for code in range(first, last + 1):
+                    glyphs[code] = glyph + code - first
+            return glyphs
+        table = subtables.get((3, 1), subtables.get((0, 3)))
+        if table is None:
+            raise ValueError("Шрифт для PDF не содержит таблицу символов Unicode")
+        # Format 4: segments of the Basic Multilingual Plane
+        segments = struct.unpack(">H", data[table + 6:table + 8])[0] // 2
+        ends = table + 14
+        starts = ends + 2 * segments + 2
+        deltas = starts + 2 * segments
+        range_offsets = deltas + 2 * segments
+        for i in range(segments):
+            end, start = (struct.unpack(">H", data[a + 2 * i:a + 2 * i + 2])[0] for a in (ends, starts))
+            delta = struct.unpack(">h", data[deltas + 2 * i:deltas + 2 * i + 2])[0]
+            range_offset = struct.unpack(">H", data[range_offsets + 2 * i:range_offsets + 2 * i + 2])[0]
+            for code in range(start, min(end, 0xFFFE) + 1):
+                if range_offset == 0:
+                    glyph = (code + delta) & 0xFFFF
+                else:
+                    at = range_offsets + 2 * i + range_offset + 2 * (code - start)
+                    glyph = struct.unpack(">H", data[at:at + 2])[0]
+                    glyph = (glyph + delta) & 0xFFFF if glyph else 0
+                if glyph:
+                    glyphs[code] = glyph
+        return glyphs
+
+
+class PdfExporter:
+    """Minimal PDF writer that flushes every page as soon as it is full.
+
+    Only object offsets, page ids and the glyphs used stay in memory, unlike FPDF which
+    keeps the whole document until output(). Text is set in an embedded Unicode TrueType
+    font (DejaVuSans or FACEID_PDF_FONT_PATH), so names are written as entered.
+    """
+    extension = "pdf"
+    PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+    MARGIN = 40
+    FONT_SIZE = 10
+    LINE_HEIGHT = 14
+    # 1 catalog, 2 page tree, 3 Type0 font, 4 CID font, 5 font descriptor, 6 font file, 7 ToUnicode map
+    FIRST_PAGE_OBJECT = 8
+
+    def __init__(self, path):
+        self.font = TrueTypeFont(find_pdf_font())
+        self.used_glyphs = {}  # glyph id -> character, for the widths and the ToUnicode map
+        self.file = open(path, "wb")
+        self.offsets = {}
+        self.page_ids = []
+        self.next_id = self.FIRST_PAGE_OBJECT
+        self.lines = [(self._encode(TITLE), 14)]
+        self.lines_per_page = (self.PAGE_HEIGHT - 2 * self.MARGIN) // self.LINE_HEIGHT
+        self.file.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        font = self.font
+        font_file = zlib.compress(font.data)
+        self._object(6, f"<< /Length {len(font_file)} /Length1 {len(font.data)} /Filter /FlateDecode >>\nstream\n"
+                     .encode() + font_file + b"\nendstream")
+        self._object(5, (
+            f"<< /Type /FontDescriptor /FontName /{font.name} /Flags 32 /FontBBox [{' '.join(map(str, font.bbox))}] "
+            f"/ItalicAngle 0 /Ascent {font.ascent} /Descent {font.descent} /CapHeight {font.ascent} /StemV 80 "
+            f"/FontFile2 6 0 R >>"
+        ).encode())
+
+    def _encode(self, text):
+        """Hex string of glyph ids for the Identity-H encoding"""
+        glyphs = []
+        for char in text:
+            glyph = self.font.glyphs.get(ord(char), 0)
+            self.used_glyphs.setdefault(glyph, char)
+            glyphs.append(f"{glyph:04X}")
+        return "".join(glyphs)
+
+    def _object(self, obj_id, body):
+        self.offsets[obj_id] = self.file.tell()
+        self.file.write(f"{obj_id} 0 obj\n".encode() + body + b"\nendobj\n")
+
+    def _flush_page(self):
+        content = ["BT"]
+        y = self.PAGE_HEIGHT - self.MARGIN
+        for text, size in self.lines:
+            content.append(f"/F1 {size} Tf 1 0 0 1 {self.MARGIN} {y} Tm <{text}> Tj")
+            y -= self.LINE_HEIGHT
+        content.append("ET")
+        stream = "\n".join(content).encode("ascii")
+        content_id, page_id = self.next_id, self.next_id + 1
+        self.next_id += 2
+        self._object(content_id, f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+        self._object(page_id, (
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {self.PAGE_WIDTH} {self.PAGE_HEIGHT}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {content_id} 0 R >>"
+        ).encode())
+        self.page_ids.append(page_id)
+        self.lines = []
+
+    def _write_font(self):
+        glyphs = sorted(self.used_glyphs)
+        widths = " ".join(f"{glyph} [{self.font.width(glyph)}]" for glyph in glyphs)
+        self._object(4, (
+            f"<< /Type /Font /Subtype /CIDFontType2 /BaseFont /{self.font.name} "
+            f"/CIDSystemInfo << /Registry (Adobe) /Ordering (Identity) /Supplement 0 >> "
+            f"/FontDescriptor 5 0 R /CIDToGIDMap /Identity /W [{widths}] >>"
+        ).encode())
+        self._object(3, (
+            f"<< /Type /Font /Subtype /Type0 /BaseFont /{self.font.name} /Encoding /Identity-H "
+            f"/DescendantFonts [4 0 R] /ToUnicode 7 0 R >>"
+        ).encode())
+        cmap = [
+            "/CIDInit /ProcSet findresource begin 12 dict begin begincmap",
+            "/CIDSystemInfo << /Registry (Adobe) /Ordering (UCS) /Supplement 0 >> def",
+            "/CMapName /Adobe-Identity-UCS def /CMapType 2 def",
+            "1 begincodespacerange <0000> <FFFF> endcodespacerange",
+        ]
+        for start in range(0, len(glyphs), 100):
+            block = glyphs[start:start + 100]
+            cmap.append(f"{len(block)} beginbfchar")
+            cmap.extend(f"<{glyph:04X}> <{self.used_glyphs[glyph].encode('utf-16-be').hex().upper()}>"
+                        for glyph in block)
+            cmap.append("endbfchar")
+        cmap.append("endcmap CMapName currentdict /CMap defineresource pop end end")
+        stream = "\n".join(cmap).encode("ascii")
+        self._object(7, f"<< /Length {len(stream)} >>\nstream\n".encode() + stream + b"\nendstream")
+
+    def write(self, rows):
+        for row in rows:
+            record_id, name, date, time = display_row(row)
+            self.lines.append((self._encode(f"ID: {record_id}, Имя: {name}, Дата: {date}, Время: {time}"),
+                               self.FONT_SIZE))
+            if len(self.lines) >= self.lines_per_page:
+                self._flush_page()
+
+    def close(self):
+        if self.lines or not self.page_ids:
+            self._flush_page()
+        self._write_font()
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._object(2, f"<< /Type /Pages /Kids [{kids}] /Count {len(self.page_ids)} >>".encode())
+        self._object(1, b"<< /Type /Catalog /Pages 2 0 R >>")
+        xref_offset = self.file.tell()
+        size = self.next_id
+        self.file.write(f"xref\n0 {size}\n0000000000 65535 f \n".encode())
+        for obj_id in range(1, size):
+            self.file.write(f"{self.offsets[obj_id]:010d} 00000 n \n".encode())
+        self.file.write(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode())
+        self.file.close()
+
+
+class ParquetExporter:
+    """One Parquet row group per chunk (requires pyarrow)"""
+    extension = "parquet"
+
+    def __init__(self, path):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.pa = pa
+        self.schema = pa.schema([
+            ("id", pa.int64()),
+            ("name", pa.string()),
+            ("ts", pa.timestamp("us")),
+        ])
+        self.writer = pq.ParquetWriter(path, self.schema)
+
+    def write(self, rows):
+        columns = list(zip(*rows)) if rows else [[], [], []]
+        ids, names, stamps = columns
+        # Local wall-clock time, same as the other formats show
+        stamps = [local_time(ts).replace(tzinfo=None) for ts in stamps]
+        self.writer.write_table(self.pa.Table.from_arrays(
+            [self.pa.array(ids, self.pa.int64()), self.pa.array(names, self.pa.string()),
+             self.pa.array(stamps, self.pa.timestamp("us"))],
+            schema=self.schema,
+        ))
+
+    def close(self):
+        self.writer.close()
+
+
+EXPORTERS = {
+    "xlsx": ExcelExporter,
+    "docx": WordExporter,
+    "pdf": PdfExporter,
+    "csv": CsvExporter,
+    "parquet": ParquetExporter,
+}
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def export_attendance(path, fmt, date_from=None, date_to=None, user_id=None, progress=None,
+                      is_cancelled=None, bind=engine):
+    """Stream filtered attendance into path; memory stays bounded by the chunk size"""
+    total = count_attendance(date_from, date_to, user_id, bind=bind)
+    exporter = EXPORTERS[fmt](path)
+    done = 0
+    try:
+        for chunk in iter_attendance_chunks(date_from, date_to, user_id, bind=bind):
+            if is_cancelled and is_cancelled():
+                raise ExportCancelled()
+            exporter.write(chunk)
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+    except BaseException:
+        try:
+            exporter.close()
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+        raise
+    exporter.close()
+    return done
+
+
+class ExportWorker(QThread):
+    """Runs export_attendance off the UI thread with progress and cancel"""
+
+    progress = pyqtSignal(int, int)  # rows written, total rows
+    finished_export = pyqtSignal(str, int)  # path, rows written
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, path, fmt, date_from=None, date_to=None, user_id=None, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.fmt = fmt
+        self.date_from = date_from
+        self.date_to = date_to
+        self.user_id = user_id
+        self._cancel = False
+
+    def cancel(self):
+        self._cancel = True
+
+    def run(self):
+        try:
+            rows = export_attendance(
+                self.path, self.fmt, self.date_from, self.date_to, self.user_id,
+                progress=self.progress.emit, is_cancelled=lambda: self._cancel,
+            )
+        except ExportCancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            self.failed.emit(str(e))
+        else:
+            self.finished_export.emit(self.path, rows)
@@ -1,84 +1,71 @@
 import cv2
-import face_recognition
-import numpy as np
 import datetime
 from db_config import SessionLocal
-from models import User, Attendance
+from gallery_cache import open_gallery
+from capture import CaptureThread
+from detection import FaceDetector
+from attendance_writer import AttendanceWriter
 
 def load_known_faces():
-    """ Загружает известных пользователей из базы данных """
+    """ Загружает сохранённые векторы лиц пользователей из базы данных """
     db = SessionLocal()
     try:
-        users = db.query(User).all()
-        known_face_encodings = []
-        known_face_names = []
-
-        for user in users:
-            try:
-                np_array = np.frombuffer(user.photo, dtype=np.uint8)
-                face_image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-                face_encoding = face_recognition.face_encodings(face_image)
-
-                if face_encoding:
-                    known_face_encodings.append(face_encoding[0])
-                    known_face_names.append(user.name)
-            except Exception as e:
-                print(f"Ошибка загрузки изображения для {user.name}: {e}")
-
-        return known_face_encodings, known_face_names
+        # Synced from the central database when it is reachable, else the local cache as is
+        return open_gallery(db)
     finally:
         db.close()
 
 def recognize_face():
     """ Включает камеру и проверяет лицо по базе """
-    known_face_encodings, known_face_names = load_known_faces()
+    gallery = load_known_faces()
+    detector = FaceDetector()
 
-    cap = cv2.VideoCapture(0)
+    capture = CaptureThread()
+    capture.start()
+    last_index = 0
 
     while True:
-        ret, frame = cap.read()
-        if not ret:
+        captured = capture.wait_for(last_index, timeout=5)
+        if captured is None:
             break
+        last_index = captured.index
+        frame = captured.image
 
-        small_frame = cv2.resize(frame, (0, 0), fx=0.25, fy=0.25)
-        rgb_small_frame = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-        face_locations = face_recognition.face_locations(rgb_small_frame)
-        face_encodings = face_recognition.face_encodings(rgb_small_frame, face_locations)
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        face_locations = detector.detect(rgb_frame)
+        face_encodings = detector.encode(rgb_frame, face_locations)
 
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces(known_face_encodings, face_encoding)
+        for (top, right, bottom, left), match in zip(face_locations, gallery.match(face_encodings)):
             name = "Неизвестный"
+            if match.is_known:
+                name = match.name
+                mark_attendance(match.user_id, name, datetime.datetime.fromtimestamp(captured.timestamp))
 
-            face_distances = face_recognition.face_distance(known_face_encodings, face_encoding)
-            best_match_index = np.argmin(face_distances) if face_distances.size else None
-
-            if best_match_index is not None and matches[best_match_index]:
-                name = known_face_names[best_match_index]
-                mark_attendance(name)
-
-            for (top, right, bottom, left) in face_locations:
-                top, right, bottom, left = top * 4, right * 4, bottom * 4, left * 4
-                cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
-                cv2.putText(frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
+            cv2.rectangle(frame, (left, top), (right, bottom), (0, 255, 0), 2)
+            cv2.putText(frame, name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
 
         cv2.imshow("Face Recognition", frame)
 
         if cv2.waitKey(1) & 0xFF == ord('q'):
             break
 
-    cap.release()
+    capture.stop()
+    flush_attendance()
     cv2.destroyAllWindows()
 
-def mark_attendance(name):
-    """ Записывает факт прихода в базу данных """
-    db = SessionLocal()
-    try:
-        now = datetime.datetime.now()
-        date = now.strftime("%Y-%m-%d")
-        time = now.strftime("%H:%M:%S")
-
-        new_attendance = Attendance(name=name, date=date, time=time)
-        db.add(new_attendance)
-        db.commit()
-    finally:
-        db.close()
+_attendance_writer = None
+
+def mark_attendance(user_id, name, when=None):
+    """ Ставит факт прихода в очередь на запись в базу данных """
+    global _attendance_writer
+    if _attendance_writer is None:
+        _attendance_writer = AttendanceWriter()
+        _attendance_writer.start()
+    _attendance_writer.submit(user_id, name, when)
+
+def flush_attendance():
+    """ Дописывает накопленные записи и останавливает фоновую запись """
+    global _attendance_writer
+    if _attendance_writer is not None:
+        _attendance_writer.stop()
+        _attendance_writer = None
@@ -0,0 +1,145 @@
+from typing import List, NamedTuple, Optional
+import numpy as np
+import settings
+
+DEFAULT_TOLERANCE = 0.6
+ENCODING_DIM = 128
+# Gallery rows scored per matrix product; bounds the (faces x rows) scratch buffer
+SEARCH_BLOCK_SIZE = 65536
+
+
+class Match(NamedTuple):
+    user_id: Optional[int]
+    name: Optional[str]
+    distance: float
+    # (user_id, name, distance) of the k nearest identities, nearest first
+    candidates: list
+
+    @property
+    def is_known(self):
+        return self.user_id is not None
+
+
+class GalleryIndex:
+    """Known encodings in one contiguous float32 matrix with precomputed squared norms.
+
+    Distances are the same Euclidean distances as face_recognition.face_distance,
+    computed for every face of a frame in a single batched matrix product.
+    """
+
+    def __init__(self, ids, names, encodings):
+        self.ids = list(ids)
+        self.names = list(names)
+        # Owned copy: add/remove write into the buffer, never into the caller's matrix
+        self._buffer = np.array(encodings, dtype=np.float32, copy=True).reshape(len(self.ids), ENCODING_DIM)
+        self._norm_buffer = np.einsum("ij,ij->i", self._buffer, self._buffer)
+        self._resize_views()
+        self._row_of = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _resize_views(self):
+        # encodings / sq_norms are views of the first len(ids) rows of over-allocated buffers
+        self.encodings = self._buffer[:len(self.ids)]
+        self.sq_norms = self._norm_buffer[:len(self.ids)]
+
+    def _rows(self):
+        """user_id -> row, built on the first live update"""
+        if self._row_of is None:
+            self._row_of = {user_id: row for row, user_id in enumerate(self.ids) if user_id is not None}
+        return self._row_of
+
+    def add(self, user_id, name, encoding):
+        """Insert or replace one identity in place; amortised O(1)"""
+        encoding = np.asarray(encoding, dtype=np.float32).reshape(ENCODING_DIM)
+        rows = self._rows()
+        row = rows.get(user_id)
+        if row is None:
+            row = len(self.ids)
+            if row == len(self._buffer):
+                capacity = max(16, 2 * len(self._buffer))
+                self._buffer = np.resize(self._buffer, (capacity, ENCODING_DIM))
+                self._norm_buffer = np.resize(self._norm_buffer, capacity)
+            self.ids.append(user_id)
+            self.names.append(name)
+            rows[user_id] = row
+            self._resize_views()
+        self.names[row] = name
+        self._buffer[row] = encoding
+        self._norm_buffer[row] = encoding @ encoding
+
+    def remove(self, user_id):
+        """Drop one identity by moving the last row into its place; False if it is not here"""
+        rows = self._rows()
+        row = rows.pop(user_id, None)
+        if row is None:
+            return False
+        last = len(self.ids) - 1
+        if row != last:
+            self.ids[row], self.names[row] = self.ids[last], self.names[last]
+            self._buffer[row] = self._buffer[last]
+            self._norm_buffer[row] = self._norm_buffer[last]
+            rows[self.ids[row]] = row
+        self.ids.pop()
+        self.names.pop()
+        self._resize_views()
+        return True
+
+    def search(self, queries, k=1):
+        """Return (indices, distances) of the k nearest gallery rows for each query, nearest first"""
+        queries = np.ascontiguousarray(queries, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        k = min(k, len(self.ids))
+        if k == 0 or len(queries) == 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+
+        q_norms = np.einsum("ij,ij->i", queries, queries)
+        best_idx = np.empty((len(queries), 0), dtype=np.int64)
+        best_sq = np.empty((len(queries), 0), dtype=np.float32)
+        for start in range(0, len(self.ids), SEARCH_BLOCK_SIZE):
+            block = slice(start, start + SEARCH_BLOCK_SIZE)
+            # ||q - g||^2 = ||q||^2 + ||g||^2 - 2 q.g
+            sq = queries @ self.encodings[block].T
+            sq *= -2.0
+            sq += q_norms[:, None]
+            sq += self.sq_norms[block][None, :]
+            kb = min(k, sq.shape[1])
+            part = np.argpartition(sq, kb - 1, axis=1)[:, :kb]
+            best_idx = np.concatenate([best_idx, part + start], axis=1)
+            best_sq = np.concatenate([best_sq, np.take_along_axis(sq, part, axis=1)], axis=1)
+            if best_idx.shape[1] > k:
+                keep = np.argpartition(best_sq, k - 1, axis=1)[:, :k]
+                best_idx = np.take_along_axis(best_idx, keep, axis=1)
+                best_sq = np.take_along_axis(best_sq, keep, axis=1)
+
+        order = np.argsort(best_sq, axis=1)
+        best_idx = np.take_along_axis(best_idx, order, axis=1)
+        distances = np.sqrt(np.maximum(np.take_along_axis(best_sq, order, axis=1), 0.0))
+        # Rows emptied by a removal (see IVFIndex.remove) have an infinite norm
+        best_idx[~np.isfinite(distances)] = -1
+        return best_idx, distances
+
+    def match(self, face_encodings, tolerance=DEFAULT_TOLERANCE, k=1) -> List[Match]:
+        """Match every face of a frame at once; the nearest identity wins if within tolerance"""
+        if len(face_encodings) == 0:
+            return []
+        indices, distances = self.search(np.asarray(face_encodings), k=max(k, 1))
+        results = []
+        for row_idx, row_dist in zip(indices, distances):
+            # Negative indices pad queries with fewer than k candidates (approximate indexes)
+            candidates = [(self.ids[i], self.names[i], float(d)) for i, d in zip(row_idx, row_dist) if i >= 0]
+            if candidates and candidates[0][2] <= tolerance:
+                user_id, name, distance = candidates[0]
+            else:
+                user_id, name = None, None
+                distance = candidates[0][2] if candidates else float("inf")
+            results.append(Match(user_id, name, distance, candidates[:k]))
+        return results
+
+
+def create_index(ids, names, encodings):
+    """Build the gallery matcher selected by settings.MATCHER"""
+    if settings.MATCHER == "ivf" and len(ids) >= settings.IVF_MIN_GALLERY_SIZE:
+        from ann_index import load_or_build
+        return load_or_build(ids, names, encodings)
+    return GalleryIndex(ids, names, encodings)
@@ -0,0 +1,285 @@
+from datetime import timedelta, timezone
+from typing import NamedTuple
+import numpy as np
+from sqlalchemy import (Column, DateTime, Integer, LargeBinary, MetaData, String, Table, create_engine,
+                        delete, func, select)
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.exc import SQLAlchemyError
+from PyQt6.QtCore import QThread, pyqtSignal
+import settings
+from db_config import SessionLocal, engine
+from models import User, UserEmbedding
+from gallery import ENCODING_DIM
+
+SYNC_BATCH_SIZE = 5000
+
+# Kept apart from Base.metadata: these tables live only in the local cache file
+cache_metadata = MetaData()
+
+cached_users = Table(
+    "cached_users", cache_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("name", String, nullable=False),
+    Column("encoding", LargeBinary),
+    Column("encoding_model", String),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+cached_templates = Table(
+    "cached_templates", cache_metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("user_id", Integer, nullable=False, index=True),
+    Column("encoding", LargeBinary),
+    Column("encoding_model", String),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+sync_state = Table(
+    "sync_state", cache_metadata,
+    Column("source", String, primary_key=True),
+    Column("updated_at", DateTime(timezone=True)),
+)
+
+_cache_engine = None
+
+
+def cache_engine(path=None):
+    """Engine of the local cache file, creating its tables on first use"""
+    global _cache_engine
+    if path is not None:
+        bind = create_engine(f"sqlite:///{path}")
+        cache_metadata.create_all(bind)
+        return bind
+    if _cache_engine is None:
+        _cache_engine = cache_engine(settings.GALLERY_CACHE_PATH)
+    return _cache_engine
+
+
+def _utc(value):
+    """value as an aware UTC datetime; naive values are UTC already (SQLite's CURRENT_TIMESTAMP)"""
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value.astimezone(timezone.utc)
+
+
+def _watermark(conn, source):
+    """Newest updated_at copied from source as an aware UTC datetime, or None before the first sync"""
+    value = conn.execute(select(sync_state.c.updated_at).where(sync_state.c.source == source)).scalar()
+    # SQLite drops the offset, so the watermark is stored as naive UTC
+    return None if value is None else value.replace(tzinfo=timezone.utc)
+
+
+def _set_watermark(conn, source, value):
+    value = _utc(value).replace(tzinfo=None)
+    stmt = sqlite_insert(sync_state).values(source=source, updated_at=value)
+    conn.execute(stmt.on_conflict_do_update(index_elements=["source"], set_={"updated_at": value}))
+
+
+def _sync_table(central, cache, model, cached, columns, source):
+    """Copy rows of model changed since the stored watermark into the cache table.
+    Returns the user ids of the rows that were new or different."""
+    with cache.connect() as conn:
+        watermark = _watermark(conn, source)
+    since = None
+    if watermark is not None:
+        # Re-read a window before the watermark: rows committed late with an earlier timestamp.
+        # One second more, since SQLite's CURRENT_TIMESTAMP text has no fraction and sorts
+        # before a bound of the same second
+        since = watermark - timedelta(seconds=settings.GALLERY_SYNC_OVERLAP + 1)
+
+    changed = set()
+    last_id = None
+    newest = None
+    owner = "user_id" if "user_id" in columns else "id"
+    source_columns = [getattr(model, name) for name in columns]
+    while True:
+        # Paged by id inside the updated_at window: timestamps are not unique (upgrade() stamps
+        # every existing row with one), so they cannot serve as a page key
+        stmt = select(*source_columns).order_by(model.id).limit(SYNC_BATCH_SIZE)
+        if since is not None:
+            stmt = stmt.where(model.updated_at >= since)
+        if last_id is not None:
+            stmt = stmt.where(model.id > last_id)
+        with central.connect() as conn:
+            rows = [dict(row._mapping) for row in conn.execute(stmt)]
+        if not rows:
+            break
+        last_id = rows[-1]["id"]
+        batch_newest = max(_utc(row["updated_at"]) for row in rows)
+        newest = batch_newest if newest is None else max(newest, batch_newest)
+
+        # Rows re-read from the overlap window are usually unchanged and are skipped
+        with cache.connect() as conn:
+            cached_rows = {row.id: row._mapping for row in conn.execute(
+                select(cached).where(cached.c.id.in_([row["id"] for row in rows]))
+            )}
+        rows = [row for row in rows if row["id"] not in cached_rows
+                or any(cached_rows[row["id"]][name] != row[name] for name in columns if name != "updated_at")]
+        if rows:
+            with cache.begin() as conn:
+                upsert = sqlite_insert(cached)
+                conn.execute(upsert.on_conflict_do_update(
+                    index_elements=["id"],
+                    set_={name: upsert.excluded[name] for name in columns if name != "id"},
+                ), rows)
+            changed.update(row[owner] for row in rows)
+
+    # Only after the whole pass, so an interrupted sync starts over from the old watermark
+    if newest is not None:
+        with cache.begin() as conn:
+            _set_watermark(conn, source, newest)
+    return changed
+
+
+def _drop_deleted(central, cache, model, cached):
+    """Remove cached rows whose id no longer exists centrally (deletes leave no updated_at behind).
+    Returns the user ids of the removed rows."""
+    owner = cached.c.user_id if "user_id" in cached.c else cached.c.id
+    # After _sync_table the cache holds every central row, so as long as the counts agree nothing
+    # was deleted and the central ids are not fetched over the network
+    with central.connect() as conn:
+        central_count = conn.execute(select(func.count()).select_from(model)).scalar()
+    with cache.connect() as conn:
+        cached_count = conn.execute(select(func.count()).select_from(cached)).scalar()
+    if cached_count == central_count:
+        return set()
+    with central.connect() as conn:
+        central_ids = set(conn.execute(select(model.id)).scalars())
+    with cache.connect() as conn:
+        stale = [(row_id, user_id) for row_id, user_id in conn.execute(select(cached.c.id, owner))
+                 if row_id not in central_ids]
+    with cache.begin() as conn:
+        for start in range(0, len(stale), SYNC_BATCH_SIZE):
+            batch = [row_id for row_id, _ in stale[start:start + SYNC_BATCH_SIZE]]
+            conn.execute(delete(cached).where(cached.c.id.in_(batch)))
+    return {user_id for _, user_id in stale}
+
+
+class SyncResult(NamedTuple):
+    # Users whose name or encodings changed (including new ones), and users deleted centrally
+    changed: set
+    removed: set
+
+
+def sync(central=engine, cache=None):
+    """Bring the local cache up to date with the central database.
+    Raises if the central database is unreachable."""
+    cache = cache or cache_engine()
+    changed = _sync_table(central, cache, User, cached_users,
+                          ["id", "name", "encoding", "encoding_model", "updated_at"], "users")
+    changed |= _sync_table(central, cache, UserEmbedding, cached_templates,
+                           ["id", "user_id", "encoding", "encoding_model", "updated_at"], "user_embeddings")
+    removed = _drop_deleted(central, cache, User, cached_users)
+    # Deleting a user cascades to its templates; other removed templates change their user
+    changed |= _drop_deleted(central, cache, UserEmbedding, cached_templates) - removed
+    return SyncResult(changed - removed, removed)
+
+
+def _matrix(rows):
+    matrix = np.empty((len(rows), ENCODING_DIM), dtype=np.float32)
+    for i, row in enumerate(rows):
+        matrix[i] = np.frombuffer(row.encoding, dtype="<f4")
+    return matrix
+
+
+def load_cached_gallery(cache=None):
+    """(ids, names, matrix, template user_ids, template matrix) from the local cache"""
+    from embeddings import ENCODING_MODEL
+    cache = cache or cache_engine()
+    with cache.connect() as conn:
+        users = conn.execute(
+            select(cached_users.c.id, cached_users.c.name, cached_users.c.encoding)
+            .where(cached_users.c.encoding.isnot(None), cached_users.c.encoding_model == ENCODING_MODEL)
+            .order_by(cached_users.c.id)
+        ).all()
+        templates = conn.execute(
+            select(cached_templates.c.user_id, cached_templates.c.encoding)
+            .where(cached_templates.c.encoding.isnot(None), cached_templates.c.encoding_model == ENCODING_MODEL)
+            .order_by(cached_templates.c.user_id, cached_templates.c.id)
+        ).all()
+    return ([row.id for row in users], [row.name for row in users], _matrix(users),
+            [row.user_id for row in templates], _matrix(templates))
+
+
+def load_cached_identities(user_ids, cache=None):
+    """{user_id: (name, encodings)} of the given users, primary encoding first; users without a
+    usable encoding are left out"""
+    from embeddings import ENCODING_MODEL
+    cache = cache or cache_engine()
+    user_ids = list(user_ids)
+    identities = {}
+    with cache.connect() as conn:
+        for start in range(0, len(user_ids), SYNC_BATCH_SIZE):
+            batch = user_ids[start:start + SYNC_BATCH_SIZE]
+            users = conn.execute(
+                select(cached_users.c.id, cached_users.c.name, cached_users.c.encoding)
+                .where(cached_users.c.id.in_(batch), cached_users.c.encoding.isnot(None),
+                       cached_users.c.encoding_model == ENCODING_MODEL)
+            ).all()
+            templates = conn.execute(
+                select(cached_templates.c.user_id, cached_templates.c.encoding)
+                .where(cached_templates.c.user_id.in_(batch), cached_templates.c.encoding.isnot(None),
+                       cached_templates.c.encoding_model == ENCODING_MODEL)
+                .order_by(cached_templates.c.id)
+            ).all()
+            extra = {}
+            for row in templates:
+                extra.setdefault(row.user_id, []).append(row)
+            for row in users:
+                identities[row.id] = (row.name, _matrix([row] + extra.get(row.id, [])))
+    return identities
+
+
+def cached_user_count(cache=None):
+    with (cache or cache_engine()).connect() as conn:
+        return conn.execute(select(func.count()).select_from(cached_users)).scalar()
+
+
+def refresh(db, cache=None):
+    """Re-encode stale rows centrally, then sync the cache. Returns the SyncResult, or None
+    when the central database is unreachable and the cache is left as it was."""
+    from embeddings import reencode_stale_templates, reencode_stale_users
+    try:
+        reencode_stale_users(db)
+        reencode_stale_templates(db)
+        result = sync(db.get_bind(), cache)
+    except SQLAlchemyError as e:
+        db.rollback()
+        print(f"Central database unavailable, using the local gallery cache: {e}")
+        return None
+    if result.changed or result.removed:
+        print(f"Gallery cache synced: {len(result.changed)} users changed, {len(result.removed)} removed")
+    return result
+
+
+def open_gallery(db, cache=None):
+    """Sync the local cache if the central database is reachable and build the matcher from it"""
+    from templates import create_gallery
+    refresh(db, cache)
+    return create_gallery(*load_cached_gallery(cache))
+
+
+def sync_changes(cache=None):
+    """Refresh the cache in a session of its own. Returns ({user_id: (name, encodings)} of
+    changed users, removed user ids including users left without a usable encoding), or None
+    when nothing changed or the central database is unreachable."""
+    db = SessionLocal()
+    try:
+        result = refresh(db, cache)
+    finally:
+        db.close()
+    if result is None or not (result.changed or result.removed):
+        return None
+    identities = load_cached_identities(result.changed, cache)
+    return identities, result.removed | (result.changed - identities.keys())
+
+
+class GallerySyncWorker(QThread):
+    """Syncs the cache in the background and hands over the identities that changed, so a
+    running matcher is updated in place instead of rebuilt"""
+
+    # See sync_changes
+    synced = pyqtSignal(dict, set)
+
+    def run(self):
+        changes = sync_changes()
+        if changes is not None:
+            self.synced.emit(*changes)
@@ -1,22 +1,36 @@
 import sys
-import pandas as pd
-import cv2
-import openpyxl
-import face_recognition
-import numpy as np
-from docx import Document
-from fpdf import FPDF
 from PyQt6.QtWidgets import (
     QApplication, QMainWindow, QWidget, QVBoxLayout, QPushButton, 
-    QTableWidget, QTableWidgetItem, QTabWidget, QFileDialog, QLabel, 
-    QLineEdit, QHBoxLayout, QMessageBox, QListWidget, QListWidgetItem, 
-    QInputDialog, QFrame, QScrollArea, QSizePolicy
+    QTableView, QTabWidget, QFileDialog, QLabel, 
+    QLineEdit, QHBoxLayout, QMessageBox, QListView, 
+    QInputDialog, QCheckBox, QDateEdit, QComboBox, QProgressBar, QSpinBox,
+    QTimeEdit
 )
-from PyQt6.QtGui import QPixmap, QImage, QIcon, QFont, QPalette, QColor
-from PyQt6.QtCore import Qt, QTimer, QSize
+from PyQt6.QtGui import QFont, QStandardItem, QStandardItemModel
+from PyQt6.QtCore import Qt, QTimer, QSize, QDate, QTime, pyqtSignal
+import time
 from datetime import datetime, timedelta
+import settings
 from db_config import SessionLocal
-from models import User, Attendance
+from models import User, UserEmbedding
+from embeddings import encoding_from_bytes, update_user_encoding, user_encodings
+from templates import create_gallery
+from gallery_cache import GallerySyncWorker, cached_user_count, load_cached_gallery, open_gallery
+from recognition_worker import RecognitionWorker
+from capture import CaptureThread
+from attendance_writer import AttendanceWriter
+from attendance_model import AttendanceTableModel
+from user_model import UserListModel
+from thumbnails import make_thumbnail
+from exporters import ExportWorker
+from metrics import MetricsExporter, metrics
+from display import FramePipeline, VideoWidget
+from unknown_faces import UnknownFaceClusterer, UnknownFacesPanel, enroll_cluster
+from maintenance import MaintenanceWorker, archive, purge, renumber_ids
+from migrations import upgrade
+from reports import absentees, format_clock, format_duration, late_arrivals, range_report
+from attendance_queries import format_ts
+from sqlalchemy.exc import SQLAlchemyError
 
 class ModernButton(QPushButton):
     def __init__(self, text, icon=None):
@@ -41,11 +55,11 @@ class ModernButton(QPushButton):
             }
         """)
 
-class ModernTable(QTableWidget):
+class ModernTable(QTableView):
     def __init__(self):
         super().__init__()
         self.setStyleSheet("""
-            QTableWidget {
+            QTableView {
                 background-color: white;
                 alternate-background-color: #f5f5f5;
                 border: 1px solid #ddd;
@@ -58,7 +72,7 @@ class ModernTable(QTableWidget):
                 border: none;
                 font-weight: bold;
             }
-            QTableWidget::item {
+            QTableView::item {
                 padding: 5px;
             }
         """)
@@ -66,27 +80,29 @@ class ModernTable(QTableWidget):
         self.horizontalHeader().setStretchLastSection(True)
         self.verticalHeader().setVisible(False)
 
-class ModernListWidget(QListWidget):
+class ModernListView(QListView):
     def __init__(self):
         super().__init__()
         self.setStyleSheet("""
-            QListWidget {
+            QListView {
                 background-color: white;
                 border: 1px solid #ddd;
                 border-radius: 5px;
                 padding: 5px;
             }
-            QListWidget::item {
+            QListView::item {
                 padding: 10px;
                 border-bottom: 1px solid #eee;
             }
-            QListWidget::item:selected {
+            QListView::item:selected {
                 background-color: #e3f2fd;
                 color: #1976D2;
             }
         """)
 
 class FaceIDApp(QMainWindow):
+    attendance_flushed = pyqtSignal(list)
+
     def __init__(self):
         super().__init__()
         self.setWindowTitle("Face ID Attendance System")
@@ -119,11 +135,29 @@ class FaceIDApp(QMainWindow):
         self.setCentralWidget(self.tabs)
         self.last_seen = {}
         self.last_recognized = {}
+        self.face_results = []
+        self.recognition_worker = None
+        self.gallery_sync_worker = None
+        self.gallery_poll_timer = QTimer(self)
+        self.gallery_poll_timer.timeout.connect(self.sync_gallery)
+        self.capture = None
+
+        # Attendance is written in the background; flushed batches come back via a signal
+        self.attendance_flushed.connect(self.on_attendance_flushed)
+        self.attendance_writer = AttendanceWriter(on_flush=self.attendance_flushed.emit)
+        self.attendance_writer.start()
+
+        # Stage latencies and counters are written to FACEID_METRICS_PATH when it is set
+        self.metrics_exporter = None
+        if settings.METRICS_PATH:
+            self.metrics_exporter = MetricsExporter(metrics)
+            self.metrics_exporter.start()
         
         self.create_database_tab()
         self.create_export_tab()
         self.create_user_management_tab()
         self.create_camera_tab()
+        self.create_reports_tab()
 
     def create_database_tab(self):
         self.db_tab = QWidget()
@@ -143,20 +177,65 @@ class FaceIDApp(QMainWindow):
         """)
         layout.addWidget(header)
 
-        # Table
+        # Filters
+        filter_layout = QHBoxLayout()
+        self.name_filter_edit = QLineEdit()
+        self.name_filter_edit.setPlaceholderText("Имя")
+        self.date_filter_check = QCheckBox("Дата с")
+        self.date_from_edit = QDateEdit(QDate.currentDate())
+        self.date_to_edit = QDateEdit(QDate.currentDate())
+        for date_edit in (self.date_from_edit, self.date_to_edit):
+            date_edit.setCalendarPopup(True)
+            date_edit.setDisplayFormat("yyyy-MM-dd")
+        self.apply_filter_button = ModernButton("🔍 Filter")
+        self.apply_filter_button.clicked.connect(self.apply_database_filter)
+        self.name_filter_edit.returnPressed.connect(self.apply_database_filter)
+        filter_layout.addWidget(self.name_filter_edit)
+        filter_layout.addWidget(self.date_filter_check)
+        filter_layout.addWidget(self.date_from_edit)
+        filter_layout.addWidget(QLabel("по"))
+        filter_layout.addWidget(self.date_to_edit)
+        filter_layout.addWidget(self.apply_filter_button)
+        layout.addLayout(filter_layout)
+
+        # Table: rows are fetched page by page while scrolling, sorted by the database
+        self.attendance_model = AttendanceTableModel(self.db)
         self.table = ModernTable()
+        self.table.setModel(self.attendance_model)
+        self.table.horizontalHeader().setSortIndicator(0, Qt.SortOrder.DescendingOrder)
+        self.table.setSortingEnabled(True)
         layout.addWidget(self.table)
 
         # Buttons
         button_layout = QHBoxLayout()
         self.clear_history_button = ModernButton("🗑 Clear History")
         self.reset_ids_button = ModernButton("🔄 Reset IDs")
+        self.archive_button = ModernButton("📦 Archive")
         self.clear_history_button.clicked.connect(self.clear_history)
         self.reset_ids_button.clicked.connect(self.reset_ids)
+        self.archive_button.clicked.connect(self.archive_history)
         button_layout.addWidget(self.clear_history_button)
         button_layout.addWidget(self.reset_ids_button)
+        button_layout.addWidget(self.archive_button)
         layout.addLayout(button_layout)
 
+        # Retention: months kept before archiving, and where archived months go
+        retention_layout = QHBoxLayout()
+        self.retention_months_spin = QSpinBox()
+        self.retention_months_spin.setRange(0, 120)
+        self.retention_months_spin.setValue(settings.RETENTION_MONTHS)
+        self.archive_target_combo = QComboBox()
+        self.archive_target_combo.addItem("Таблицы архива", "table")
+        self.archive_target_combo.addItem("Файлы .csv.gz", "file")
+        self.maintenance_status_label = QLabel("")
+        retention_layout.addWidget(QLabel("Хранить месяцев"))
+        retention_layout.addWidget(self.retention_months_spin)
+        retention_layout.addWidget(self.archive_target_combo)
+        retention_layout.addWidget(self.maintenance_status_label, 1)
+        layout.addLayout(retention_layout)
+        self.maintenance_buttons = [self.clear_history_button, self.reset_ids_button, self.archive_button]
+        self.maintenance_worker = None
+
         self.load_database()
         self.db_tab.setLayout(layout)
         self.tabs.addTab(self.db_tab, "📋 Database")
@@ -179,20 +258,55 @@ class FaceIDApp(QMainWindow):
         """)
         layout.addWidget(header)
 
+        # Filters
+        filter_layout = QHBoxLayout()
+        self.export_user_combo = QComboBox()
+        self.export_date_check = QCheckBox("Дата с")
+        self.export_date_from = QDateEdit(QDate.currentDate().addMonths(-1))
+        self.export_date_to = QDateEdit(QDate.currentDate())
+        for date_edit in (self.export_date_from, self.export_date_to):
+            date_edit.setCalendarPopup(True)
+            date_edit.setDisplayFormat("yyyy-MM-dd")
+        filter_layout.addWidget(QLabel("Пользователь"))
+        filter_layout.addWidget(self.export_user_combo)
+        filter_layout.addWidget(self.export_date_check)
+        filter_layout.addWidget(self.export_date_from)
+        filter_layout.addWidget(QLabel("по"))
+        filter_layout.addWidget(self.export_date_to)
+        layout.addLayout(filter_layout)
+
         # Export buttons
         self.export_excel_button = ModernButton("📊 Export to Excel")
         self.export_word_button = ModernButton("📄 Export to Word")
         self.export_pdf_button = ModernButton("📑 Export to PDF")
+        self.export_csv_button = ModernButton("🧾 Export to CSV")
+        self.export_parquet_button = ModernButton("🗄 Export to Parquet")
         
         self.export_excel_button.clicked.connect(self.export_to_excel)
         self.export_word_button.clicked.connect(self.export_to_word)
         self.export_pdf_button.clicked.connect(self.export_to_pdf)
-        
-        layout.addWidget(self.export_excel_button)
-        layout.addWidget(self.export_word_button)
-        layout.addWidget(self.export_pdf_button)
+        self.export_csv_button.clicked.connect(self.export_to_csv)
+        self.export_parquet_button.clicked.connect(self.export_to_parquet)
+        self.export_buttons = [
+            self.export_excel_button, self.export_word_button, self.export_pdf_button,
+            self.export_csv_button, self.export_parquet_button,
+        ]
+        for button in self.export_buttons:
+            layout.addWidget(button)
+
+        # Progress of the running export
+        progress_layout = QHBoxLayout()
+        self.export_progress = QProgressBar()
+        self.export_progress.setVisible(False)
+        self.cancel_export_button = ModernButton("✖ Cancel")
+        self.cancel_export_button.setVisible(False)
+        self.cancel_export_button.clicked.connect(self.cancel_export)
+        progress_layout.addWidget(self.export_progress)
+        progress_layout.addWidget(self.cancel_export_button)
+        layout.addLayout(progress_layout)
         layout.addStretch()
 
+        self.export_worker = None
         self.export_tab.setLayout(layout)
         self.tabs.addTab(self.export_tab, "📤 Export")
 
@@ -214,17 +328,24 @@ class FaceIDApp(QMainWindow):
         """)
         layout.addWidget(header)
 
-        # User list
-        self.user_list = ModernListWidget()
+        # User list: names are paged in while scrolling, icons come from stored thumbnails
+        self.user_model = UserListModel(self.db)
+        self.user_list = ModernListView()
+        self.user_list.setModel(self.user_model)
+        self.user_list.setIconSize(QSize(50, 50))
+        self.user_list.setUniformItemSizes(True)
         layout.addWidget(self.user_list)
 
         # Buttons
         button_layout = QHBoxLayout()
         self.add_user_button = ModernButton("➕ Add User")
+        self.add_photo_button = ModernButton("🖼 Add Photo")
         self.delete_user_button = ModernButton("❌ Delete User")
         self.add_user_button.clicked.connect(self.add_user)
+        self.add_photo_button.clicked.connect(self.add_user_photo)
         self.delete_user_button.clicked.connect(self.delete_user)
         button_layout.addWidget(self.add_user_button)
+        button_layout.addWidget(self.add_photo_button)
         button_layout.addWidget(self.delete_user_button)
         layout.addLayout(button_layout)
 
@@ -251,16 +372,21 @@ class FaceIDApp(QMainWindow):
         layout.addWidget(header)
 
         # Camera display
-        self.camera_label = QLabel()
-        self.camera_label.setMinimumSize(640, 480)
-        self.camera_label.setAlignment(Qt.AlignmentFlag.AlignCenter)
-        self.camera_label.setStyleSheet("""
-            QLabel {
-                background-color: #000;
-                border-radius: 10px;
-            }
-        """)
-        layout.addWidget(self.camera_label)
+        self.camera_view = VideoWidget()
+        self.camera_view.setMinimumSize(640, 480)
+        layout.addWidget(self.camera_view)
+        self.frame_pipeline = FramePipeline()
+
+        self.recognition_stats_label = QLabel()
+        self.recognition_stats_label.setStyleSheet("QLabel { color: #666; font-size: 12px; }")
+        layout.addWidget(self.recognition_stats_label)
+
+        # Strangers are listed here once each instead of interrupting the camera with a dialog
+        self.unknown_clusterer = UnknownFaceClusterer()
+        self.unknown_panel = UnknownFacesPanel()
+        self.unknown_panel.enroll_requested.connect(self.enroll_unknown_face)
+        self.unknown_panel.dismissed.connect(self.dismiss_unknown_face)
+        layout.addWidget(self.unknown_panel)
 
         # Camera controls
         button_layout = QHBoxLayout()
@@ -270,86 +396,246 @@ class FaceIDApp(QMainWindow):
         self.stop_camera_button.clicked.connect(self.stop_camera)
         button_layout.addWidget(self.start_camera_button)
         button_layout.addWidget(self.stop_camera_button)
+        self.metrics_overlay_check = QCheckBox("Stats overlay")
+        self.metrics_overlay_check.setChecked(settings.METRICS_OVERLAY)
+        button_layout.addWidget(self.metrics_overlay_check)
         layout.addLayout(button_layout)
+        self.overlay_updated = 0.0
 
         self.camera_tab.setLayout(layout)
         self.tabs.addTab(self.camera_tab, "📷 Camera")
 
+    def create_reports_tab(self):
+        self.reports_tab = QWidget()
+        layout = QVBoxLayout()
+        layout.setSpacing(20)
+        layout.setContentsMargins(20, 20, 20, 20)
+
+        # Header
+        header = QLabel("📈 Reports")
+        header.setStyleSheet("""
+            QLabel {
+                font-size: 24px;
+                font-weight: bold;
+                color: #1976D2;
+                margin-bottom: 20px;
+            }
+        """)
+        layout.addWidget(header)
+
+        # Report and period
+        filter_layout = QHBoxLayout()
+        self.report_combo = QComboBox()
+        self.report_combo.addItem("Посещаемость за период", "range")
+        self.report_combo.addItem("Опоздания", "late")
+        self.report_combo.addItem("Отсутствующие", "absent")
+        self.report_date_from = QDateEdit(QDate.currentDate().addDays(1 - QDate.currentDate().day()))
+        self.report_date_to = QDateEdit(QDate.currentDate())
+        for date_edit in (self.report_date_from, self.report_date_to):
+            date_edit.setCalendarPopup(True)
+            date_edit.setDisplayFormat("yyyy-MM-dd")
+        self.report_start_edit = QTimeEdit(QTime.fromString(settings.REPORT_WORKDAY_START, "HH:mm"))
+        self.report_start_edit.setDisplayFormat("HH:mm")
+        self.run_report_button = ModernButton("📈 Показать")
+        self.run_report_button.clicked.connect(self.run_report)
+        filter_layout.addWidget(self.report_combo)
+        filter_layout.addWidget(QLabel("с"))
+        filter_layout.addWidget(self.report_date_from)
+        filter_layout.addWidget(QLabel("по"))
+        filter_layout.addWidget(self.report_date_to)
+        filter_layout.addWidget(QLabel("Начало дня"))
+        filter_layout.addWidget(self.report_start_edit)
+        filter_layout.addWidget(self.run_report_button)
+        layout.addLayout(filter_layout)
+
+        # Reports read the daily summaries, so they stay fast however long the history is
+        self.report_model = QStandardItemModel()
+        self.report_table = ModernTable()
+        self.report_table.setModel(self.report_model)
+        layout.addWidget(self.report_table)
+        self.report_status_label = QLabel("")
+        self.report_status_label.setStyleSheet("QLabel { color: #666; font-size: 12px; }")
+        layout.addWidget(self.report_status_label)
+
+        self.reports_tab.setLayout(layout)
+        self.tabs.addTab(self.reports_tab, "📈 Reports")
+
+    def run_report(self):
+        report = self.report_combo.currentData()
+        date_from = self.report_date_from.date().toPyDate()
+        date_to = self.report_date_to.date().toPyDate()
+        started = time.perf_counter()
+        try:
+            if report == "range":
+                headers = ["Имя", "Дней", "Отметок", "Часов", "Средний приход"]
+                rows = [[row.name, row.days, row.visits, format_duration(row.seconds),
+                         format_clock(row.avg_first_seconds)]
+                        for row in range_report(self.db, date_from, date_to)]
+            elif report == "late":
+                start = self.report_start_edit.time().toString("HH:mm")
+                headers = ["Дата", "Имя", "Приход", "Опоздание"]
+                rows = [[f"{row.day:%Y-%m-%d}", row.name, format_ts(row.first_ts)[1], format_duration(row.late_seconds)]
+                        for row in late_arrivals(self.db, date_from, date_to, start)]
+            else:
+                headers = ["Имя", "Последний приход"]
+                rows = [[row.name, f"{row.last_day:%Y-%m-%d}" if row.last_day else "—"]
+                        for row in absentees(self.db, date_from, date_to)]
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            QMessageBox.warning(self, "Ошибка", f"Не удалось построить отчёт: {e}")
+            return
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        metrics.observe("report", elapsed_ms)
+
+        self.report_model.clear()
+        self.report_model.setHorizontalHeaderLabels(headers)
+        for row in rows:
+            items = [QStandardItem(str(value)) for value in row]
+            for item in items:
+                item.setEditable(False)
+            self.report_model.appendRow(items)
+        self.report_table.resizeColumnsToContents()
+        self.report_status_label.setText(f"Строк: {len(rows)}, {elapsed_ms:.0f} мс")
+
     def load_database(self):
-        records = self.db.query(Attendance).all()
-        self.table.setRowCount(len(records))
-        self.table.setColumnCount(4)
-        self.table.setHorizontalHeaderLabels(["ID", "Имя", "Дата", "Время"])
+        self.attendance_model.refresh()
 
-        for row_idx, record in enumerate(records):
-            self.table.setItem(row_idx, 0, QTableWidgetItem(str(record.id)))
-            self.table.setItem(row_idx, 1, QTableWidgetItem(record.name))
-            self.table.setItem(row_idx, 2, QTableWidgetItem(record.date))
-            self.table.setItem(row_idx, 3, QTableWidgetItem(record.time))
+    def apply_database_filter(self):
+        date_from = date_to = None
+        if self.date_filter_check.isChecked():
+            date_from = self.date_from_edit.date().toString("yyyy-MM-dd")
+            date_to = self.date_to_edit.date().toString("yyyy-MM-dd")
+        self.attendance_model.set_filter(date_from, date_to, self.name_filter_edit.text())
 
-    def clear_history(self):
-        self.db.query(Attendance).delete()
-        self.db.commit()
+    def run_maintenance(self, task, **kwargs):
+        if self.maintenance_worker is not None:
+            return
+        # Maintenance runs in SQL in short chunked transactions on a background thread
+        self.maintenance_worker = MaintenanceWorker(task, **kwargs)
+        self.maintenance_worker.message.connect(self.maintenance_status_label.setText)
+        self.maintenance_worker.finished_task.connect(self.on_maintenance_finished)
+        self.maintenance_worker.failed.connect(self.on_maintenance_failed)
+        for button in self.maintenance_buttons:
+            button.setEnabled(False)
+        self.maintenance_worker.start()
+
+    def finish_maintenance(self):
+        self.maintenance_worker.wait()
+        self.maintenance_worker = None
+        for button in self.maintenance_buttons:
+            button.setEnabled(True)
         self.load_database()
-        QMessageBox.information(self, "Очистка", "История успешно очищена!")
+
+    def on_maintenance_finished(self, rows):
+        self.finish_maintenance()
+        self.maintenance_status_label.setText(f"Готово, записей: {rows}")
+
+    def on_maintenance_failed(self, error):
+        self.finish_maintenance()
+        self.maintenance_status_label.setText("")
+        QMessageBox.warning(self, "Ошибка", f"Операция не выполнена: {error}")
+
+    def clear_history(self):
+        answer = QMessageBox.question(self, "Очистка", "Удалить всю историю посещений?")
+        if answer == QMessageBox.StandardButton.Yes:
+            self.run_maintenance(purge)
 
     def reset_ids(self):
-        records = self.db.query(Attendance).order_by(Attendance.id).all()
-        self.db.query(Attendance).delete()
-        for idx, record in enumerate(records, start=1):
-            new_record = Attendance(
-                id=idx,
-                name=record.name,
-                date=record.date,
-                time=record.time
-            )
-            self.db.add(new_record)
-        self.db.commit()
-        self.load_database()
-        QMessageBox.information(self, "Обновление ID", "ID успешно пересчитаны!")
+        self.run_maintenance(renumber_ids)
+
+    def archive_history(self):
+        months = self.retention_months_spin.value()
+        answer = QMessageBox.question(
+            self, "Архивация", f"Перенести в архив записи старше {months} мес.?"
+        )
+        if answer == QMessageBox.StandardButton.Yes:
+            self.run_maintenance(archive, months=months, to=self.archive_target_combo.currentData())
+
+    def load_export_users(self):
+        try:
+            users = self.db.query(User.id, User.name).order_by(User.name).all()
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            print(f"Could not load users: {e}")
+            return
+        selected = self.export_user_combo.currentData()
+        self.export_user_combo.clear()
+        self.export_user_combo.addItem("Все", None)
+        for user_id, name in users:
+            self.export_user_combo.addItem(name, user_id)
+        # Keep the chosen user selected across refreshes, unless it was deleted
+        self.export_user_combo.setCurrentIndex(max(self.export_user_combo.findData(selected), 0))
+
+    def start_export(self, fmt, file_filter):
+        if self.export_worker is not None:
+            return
+        file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить как", "", file_filter)
+        if not file_path:
+            return
+        date_from = date_to = None
+        if self.export_date_check.isChecked():
+            date_from = self.export_date_from.date().toString("yyyy-MM-dd")
+            date_to = self.export_date_to.date().toString("yyyy-MM-dd")
+
+        # Rows are streamed from the database in chunks on a background thread
+        self.export_worker = ExportWorker(file_path, fmt, date_from, date_to, self.export_user_combo.currentData())
+        self.export_worker.progress.connect(self.on_export_progress)
+        self.export_worker.finished_export.connect(self.on_export_finished)
+        self.export_worker.failed.connect(self.on_export_failed)
+        self.export_worker.cancelled.connect(self.on_export_cancelled)
+        self.export_progress.setValue(0)
+        self.export_progress.setVisible(True)
+        self.cancel_export_button.setVisible(True)
+        for button in self.export_buttons:
+            button.setEnabled(False)
+        self.export_worker.start()
 
     def export_to_excel(self):
-        records = self.db.query(Attendance).all()
-        df = pd.DataFrame([(r.id, r.name, r.date, r.time) for r in records],
-                         columns=['ID', 'Имя', 'Дата', 'Время'])
-        file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить как", "", "Excel Files (*.xlsx)")
-        if file_path:
-            df.to_excel(file_path, index=False)
+        self.start_export("xlsx", "Excel Files (*.xlsx)")
 
     def export_to_word(self):
-        records = self.db.query(Attendance).all()
-        doc = Document()
-        doc.add_heading("История посещений", level=1)
-        for record in records:
-            doc.add_paragraph(f"ID: {record.id}, Имя: {record.name}, Дата: {record.date}, Время: {record.time}")
-        file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить как", "", "Word Files (*.docx)")
-        if file_path:
-            doc.save(file_path)
+        self.start_export("docx", "Word Files (*.docx)")
 
     def export_to_pdf(self):
-        records = self.db.query(Attendance).all()
-        pdf = FPDF()
-        pdf.add_page()
-        pdf.set_font("Arial", size=12)
-        pdf.cell(200, 10, "История посещений", ln=True, align='C')
-        pdf.ln(10)
-        for record in records:
-            pdf.cell(200, 10, f"ID: {record.id}, Имя: {record.name}, Дата: {record.date}, Время: {record.time}", ln=True)
-        file_path, _ = QFileDialog.getSaveFileName(self, "Сохранить как", "", "PDF Files (*.pdf)")
-        if file_path:
-            pdf.output(file_path)
+        self.start_export("pdf", "PDF Files (*.pdf)")
+
+    def export_to_csv(self):
+        self.start_export("csv", "CSV Files (*.csv)")
+
+    def export_to_parquet(self):
+        self.start_export("parquet", "Parquet Files (*.parquet)")
+
+    def cancel_export(self):
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+
+    def on_export_progress(self, done, total):
+        self.export_progress.setMaximum(max(total, 1))
+        self.export_progress.setValue(done)
+
+    def finish_export(self):
+        self.export_worker.wait()
+        self.export_worker = None
+        self.export_progress.setVisible(False)
+        self.cancel_export_button.setVisible(False)
+        for button in self.export_buttons:
+            button.setEnabled(True)
+
+    def on_export_finished(self, path, rows):
+        self.finish_export()
+        QMessageBox.information(self, "Экспорт", f"Экспортировано записей: {rows}\n{path}")
+
+    def on_export_failed(self, error):
+        self.finish_export()
+        QMessageBox.warning(self, "Ошибка", f"Не удалось экспортировать данные: {error}")
+
+    def on_export_cancelled(self):
+        self.finish_export()
 
     def load_users(self):
-        self.user_list.clear()
-        users = self.db.query(User).all()
-        for user in users:
-            item = QListWidgetItem(user.name)
-            if user.photo:
-                pixmap = QPixmap()
-                pixmap.loadFromData(user.photo)
-                icon = QIcon(pixmap.scaled(50, 50, Qt.AspectRatioMode.KeepAspectRatio))
-                item.setIcon(icon)
-            self.user_list.addItem(item)
+        """Refresh every view of the user list: the Users tab and the export filter"""
+        self.user_model.refresh()
+        self.load_export_users()
 
     def add_user(self):
         while True:
@@ -371,173 +657,261 @@ class FaceIDApp(QMainWindow):
         with open(file_path, 'rb') as f:
             photo_data = f.read()
         new_user = User(name=name, photo=photo_data)
+        update_user_encoding(new_user)
+        if new_user.encoding is None:
+            QMessageBox.warning(self, "Ошибка", "На фото не найдено лицо!")
+            return
+        new_user.thumbnail = make_thumbnail(photo_data)
         self.db.add(new_user)
         self.db.commit()
+        self.update_gallery({new_user.id: (name, [encoding_from_bytes(new_user.encoding)])})
         self.load_users()
 
+    def add_user_photo(self):
+        """Add another photo of the selected user (other lighting or angle) as an extra template"""
+        index = self.user_list.currentIndex()
+        if not index.isValid():
+            return
+        file_path, _ = QFileDialog.getOpenFileName(self, "Выберите фото", "", "Images (*.png *.jpg *.jpeg)")
+        if not file_path:
+            return
+        with open(file_path, 'rb') as f:
+            photo_data = f.read()
+        user_id = index.data(UserListModel.UserIdRole)
+        template = UserEmbedding(user_id=user_id, photo=photo_data)
+        update_user_encoding(template)
+        if template.encoding is None:
+            QMessageBox.warning(self, "Ошибка", "На фото не найдено лицо!")
+            return
+        self.db.add(template)
+        self.db.commit()
+        encodings = user_encodings(self.db, user_id)
+        if len(encodings):
+            self.update_gallery({user_id: (index.data(Qt.ItemDataRole.DisplayRole), encodings)})
+        QMessageBox.information(self, "Пользователи", "Фото добавлено!")
+
     def delete_user(self):
-        selected_item = self.user_list.currentItem()
-        if selected_item:
-            name = selected_item.text()
-            self.db.query(User).filter(User.name == name).delete()
+        index = self.user_list.currentIndex()
+        if index.isValid():
+            user_id = index.data(UserListModel.UserIdRole)
+            self.db.query(User).filter(User.id == user_id).delete()
             self.db.commit()
+            self.update_gallery({}, {user_id})
+            self.user_model.forget(user_id)
             self.load_users()
 
     def start_camera(self):
-        # Try to open the built-in camera (usually index 0)
-        self.cap = cv2.VideoCapture(0, cv2.CAP_AVFOUNDATION)  # Use AVFoundation for macOS
-        
-        if not self.cap.isOpened():
-            QMessageBox.warning(self, "Error", "Could not open the built-in camera!")
+        # Camera source and backend come from settings (FACEID_CAMERA_SOURCE / FACEID_CAMERA_BACKEND)
+        self.capture = CaptureThread()
+        if not self.capture.open():
+            QMessageBox.warning(self, "Error", f"Could not open camera {self.capture.source!r}!")
+            self.capture = None
             return
+        self.capture.start()
+        self.last_frame_index = 0
 
-        # Set camera properties for better performance
-        self.cap.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        self.cap.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        self.cap.set(cv2.CAP_PROP_FPS, 30)
-        self.cap.set(cv2.CAP_PROP_BUFFERSIZE, 1)  # Minimize buffer size
-        self.cap.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc('M', 'J', 'P', 'G'))  # Use MJPEG for better performance
-
-        # Initialize frame processing variables
-        self.frame_count = 0
-        self.last_processed_time = datetime.now()
-        self.processing_interval = timedelta(milliseconds=100)  # Process every 100ms
-        self.known_face_encodings = []
-        self.known_face_names = []
         self.load_known_faces()  # Pre-load face encodings
 
+        # Recognition runs on its own thread and always takes the newest frame
+        self.face_results = []
+        self.recognition_worker = RecognitionWorker(self.gallery, tolerance=0.6)
+        self.recognition_worker.results_ready.connect(self.process_face_recognition)
+        self.recognition_worker.stats_updated.connect(self.update_recognition_stats)
+        self.recognition_worker.unknown_faces.connect(self.process_unknown_faces)
+        self.recognition_worker.start()
+
+        if settings.GALLERY_POLL_INTERVAL > 0:
+            self.gallery_poll_timer.start(int(settings.GALLERY_POLL_INTERVAL * 1000))
+
         # Create timer with shorter interval for smoother video
         self.timer = QTimer(self)
         self.timer.timeout.connect(self.update_camera)
         self.timer.start(16)  # ~60 FPS (1000ms/16ms)
 
     def load_known_faces(self):
-        """Pre-load all known face encodings for faster recognition"""
-        users = self.db.query(User).all()
-        self.known_face_encodings = []
-        self.known_face_names = []
-
-        for user in users:
-            try:
-                np_array = np.frombuffer(user.photo, dtype=np.uint8)
-                image = cv2.imdecode(np_array, cv2.IMREAD_COLOR)
-                encodings = face_recognition.face_encodings(image)
-                if encodings:
-                    self.known_face_encodings.append(encodings[0])
-                    self.known_face_names.append(user.name)
-            except Exception as e:
-                print(f"Error loading image for {user.name}: {e}")
-
-    def update_camera(self):
-        if not hasattr(self, 'cap') or not self.cap.isOpened():
+        """Start from the local gallery cache and sync it with the central database in the
+        background; the first start with an empty cache waits for the sync"""
+        if cached_user_count():
+            self.gallery = create_gallery(*load_cached_gallery())
+            self.sync_gallery()
+        else:
+            self.gallery = open_gallery(self.db)
+
+    def sync_gallery(self):
+        """Pick up users added, changed or deleted elsewhere (other kiosks, bulk enrollment)"""
+        if self.gallery_sync_worker is not None and not self.gallery_sync_worker.isFinished():
             return
+        self.gallery_sync_worker = GallerySyncWorker()
+        self.gallery_sync_worker.synced.connect(self.update_gallery)
+        self.gallery_sync_worker.start()
 
-        # Skip frames if we're falling behind
-        for _ in range(2):
-            self.cap.grab()
+    def update_gallery(self, identities, removed=()):
+        """Apply {user_id: (name, encodings)} and removed user ids to the running matcher in place"""
+        # Without a running camera the next start reads the synced cache
+        if self.recognition_worker is not None:
+            self.recognition_worker.update_identities(identities, removed)
 
-        ret, frame = self.cap.read()
-        if not ret:
+    def update_camera(self):
+        if self.capture is None:
             return
 
-        # Resize frame for better performance
-        frame = cv2.resize(frame, (640, 480))
-        frame = cv2.flip(frame, 1)
-        
-        # Convert to RGB for face recognition
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        
-        # Process face recognition at fixed intervals
-        current_time = datetime.now()
-        if current_time - self.last_processed_time >= self.processing_interval:
-            self.last_processed_time = current_time
-            self.process_face_recognition(rgb_frame)
-
-        # Convert to QImage for display
-        h, w, ch = rgb_frame.shape
-        bytes_per_line = ch * w
-        qt_img = QImage(rgb_frame.data, w, h, bytes_per_line, QImage.Format.Format_RGB888)
-
-        # Scale image to fit label while preserving aspect ratio
-        pixmap = QPixmap.fromImage(qt_img)
-        scaled_pixmap = pixmap.scaled(
-            self.camera_label.width(),
-            self.camera_label.height(),
-            Qt.AspectRatioMode.KeepAspectRatio,
-            Qt.TransformationMode.FastTransformation
+        # Only the newest captured frame is shown; older ones are skipped
+        captured = self.capture.latest()
+        if captured is None or captured.index == self.last_frame_index:
+            return
+        if self.last_frame_index:
+            metrics.incr("display_skipped_frames", captured.index - self.last_frame_index - 1)
+        self.last_frame_index = captured.index
+        metrics.observe("frame_age", (time.time() - captured.timestamp) * 1000)
+        frame = captured.image
+
+        # Hand a mirrored RGB frame to the recognition worker in a pooled buffer; stale frames are dropped there
+        if self.recognition_worker is not None:
+            with metrics.timer("preprocess"):
+                width, height = self.frame_pipeline.recognition_size
+                rgb_frame = self.recognition_worker.frame_pool.acquire((height, width, 3))
+                self.frame_pipeline.recognition_frame(frame, rgb_frame)
+            with metrics.timer("submit"):
+                self.recognition_worker.submit(rgb_frame, captured.timestamp)
+
+        with metrics.timer("display"):
+            # Mirror and scale straight into the display buffer; the widget paints it without a copy
+            image = self.frame_pipeline.display_image(frame, self.camera_view.display_size())
+            self.camera_view.set_faces(self.face_results)
+            if self.metrics_overlay_check.isChecked():
+                self.update_metrics_overlay()
+            else:
+                self.camera_view.set_overlay_lines([])
+                self.overlay_updated = 0.0
+            self.camera_view.set_image(image)
+        metrics.set_gauge("capture_fps", self.capture.measured_fps)
+
+    def update_metrics_overlay(self):
+        """Stage latencies and counters in the corner of the frame, refreshed twice a second"""
+        now = time.monotonic()
+        if now - self.overlay_updated > 0.5:
+            self.camera_view.set_overlay_lines(metrics.overlay_lines())
+            self.overlay_updated = now
+
+    def update_recognition_stats(self, stats):
+        rejected = {key[len("rejected_"):]: value for key, value in stats.items()
+                    if key.startswith("rejected_") and value}
+        quality = ""
+        if "quality_passed" in stats:
+            quality = (f" | quality passed {stats['quality_passed']}, rejected "
+                       + (", ".join(f"{reason} {count}" for reason, count in rejected.items()) or "0"))
+        self.recognition_stats_label.setText(
+            f"Recognition: {stats['fps']:.1f} fps, {stats['latency_ms']:.0f} ms/frame, "
+            f"processed {stats['processed']}, dropped {stats['dropped']} of {stats['submitted']} frames, "
+            f"{stats['tracks']} tracks, {stats['detections']} detections, {stats['encodings']} encodings | "
+            f"detect {stats['avg_detect_ms']:.0f} ms at {stats['scale']:.2f}x, encode {stats['encode_ms']:.0f} ms | "
+            f"camera {self.capture.measured_fps if self.capture else 0:.1f} fps{quality}"
         )
 
-        self.camera_label.setPixmap(scaled_pixmap)
+    def process_face_recognition(self, results, captured_at):
+        """Handle results from the recognition worker; runs on the UI thread"""
+        metrics.observe("end_to_end", (time.time() - captured_at) * 1000)
+        self.face_results = results
+        for result in results:
+            # Tracked faces keep their identity; act only on freshly encoded ones
+            if not result.encoded:
+                continue
+            if result.name:
+                print(f"Recognized: {result.name} ({result.distance:.3f})")
+                
+                seen_at = datetime.fromtimestamp(captured_at)
+                last_seen = self.last_seen.get(result.user_id)
+                if last_seen is None or seen_at - last_seen > timedelta(minutes=1):
+                    self.last_seen[result.user_id] = seen_at
+                    self.save_attendance(result.user_id, result.name, seen_at)
+
+    def process_unknown_faces(self, faces):
+        """Group unknown faces by person; each new stranger gets one entry in the panel"""
+        for cluster_id in self.unknown_clusterer.expire():
+            self.unknown_panel.remove_cluster(cluster_id)
+        for face in faces:
+            cluster, is_new = self.unknown_clusterer.add(face)
+            if is_new:
+                metrics.incr("unknown_strangers")
+                self.unknown_panel.add_cluster(cluster)
+            else:
+                self.unknown_panel.update_cluster(cluster)
+
+    def enroll_unknown_face(self, cluster_id):
+        """Register a stranger from the crops and encodings captured by the camera"""
+        cluster = self.unknown_clusterer.clusters.get(cluster_id)
+        if cluster is None:
+            return
+        while True:
+            name, ok = QInputDialog.getText(self, "Регистрация неизвестного", "Введите имя:")
+            if not ok or not name:
+                return
+            if any(char.isdigit() for char in name):
+                QMessageBox.warning(self, "Ошибка", "Имя не должно содержать цифр!")
+                continue
+            break
 
-    def process_face_recognition(self, frame):
-        """Process face recognition separately to avoid blocking the UI"""
-        face_locations = face_recognition.face_locations(frame, model="hog")  # Use HOG for better performance
-        if not face_locations:
+        try:
+            enrolled = enroll_cluster(self.db, cluster, name)
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            QMessageBox.warning(self, "Ошибка", f"Не удалось сохранить пользователя: {e}")
+            return
+        if enrolled is None:
+            QMessageBox.warning(self, "Ошибка", "Не удалось сохранить фотографии этого лица")
             return
+        user, encodings = enrolled
+        self.update_gallery({user.id: (name, encodings)})
+        self.dismiss_unknown_face(cluster_id)
+        self.load_users()
 
-        face_encodings = face_recognition.face_encodings(frame, face_locations)
-        
-        for face_encoding in face_encodings:
-            matches = face_recognition.compare_faces(self.known_face_encodings, face_encoding, tolerance=0.6)
-            name = "Неизвестный"
-
-            if True in matches:
-                first_match_index = matches.index(True)
-                name = self.known_face_names[first_match_index]
-                print(f"Recognized: {name}")
-                
-                now = datetime.now()
-                if name not in self.last_seen or now - self.last_seen[name] > timedelta(minutes=1):
-                    self.last_seen[name] = now
-                    self.save_attendance(name)
-                    self.load_database()
-            else:
-                self.show_unrecognized_face_warning()
-
-    def show_unrecognized_face_warning(self):
-        msg = QMessageBox()
-        msg.setIcon(QMessageBox.Icon.Warning)
-        msg.setWindowTitle("Face Not Recognized")
-        msg.setText("Face not found in database. Please register!")
-        msg.setStyleSheet("""
-            QMessageBox {
-                background-color: white;
-            }
-            QPushButton {
-                background-color: #2196F3;
-                color: white;
-                border: none;
-                padding: 5px 15px;
-                border-radius: 3px;
-            }
-            QPushButton:hover {
-                background-color: #1976D2;
-            }
-        """)
-        msg.exec()
-
-    def save_attendance(self, name):
-        now = datetime.now()
-        date = now.strftime("%Y-%m-%d")
-        time = now.strftime("%H:%M:%S")
-        new_attendance = Attendance(name=name, date=date, time=time)
-        self.db.add(new_attendance)
-        self.db.commit()
-        print(f"{name} записан в базу на {date} {time}")
+    def dismiss_unknown_face(self, cluster_id):
+        self.unknown_clusterer.remove(cluster_id)
+        self.unknown_panel.remove_cluster(cluster_id)
+
+    def save_attendance(self, user_id, name, seen_at=None):
+        """Queue the event; the write-behind writer stores it in the background"""
+        seen_at = seen_at or datetime.now()
+        with metrics.timer("attendance_submit"):
+            self.attendance_writer.submit(user_id, name, seen_at)
+        metrics.set_gauge("attendance_queue_depth", self.attendance_writer.pending)
+        print(f"{name} отмечен в {seen_at:%Y-%m-%d %H:%M:%S}")
+
+    def on_attendance_flushed(self, rows):
+        """Runs on the UI thread after the writer stored a batch"""
+        self.attendance_model.append_records(rows)
 
     def stop_camera(self):
         if hasattr(self, 'timer'):
             self.timer.stop()
-        if hasattr(self, 'cap') and self.cap.isOpened():
-            self.cap.release()
-        self.camera_label.clear()
+        self.gallery_poll_timer.stop()
+        if self.recognition_worker is not None:
+            self.recognition_worker.stop()
+            self.recognition_worker = None
+        self.unknown_clusterer.forget_tracks()
+        self.face_results = []
+        self.recognition_stats_label.clear()
+        if self.capture is not None:
+            self.capture.stop()
+            self.capture = None
+        self.camera_view.clear()
         # Clear face recognition data
-        self.known_face_encodings = []
-        self.known_face_names = []
-        if hasattr(self, 'frame_count'):
-            delattr(self, 'frame_count')
-        if hasattr(self, 'last_processed_time'):
-            delattr(self, 'last_processed_time')
+        self.gallery = None
+
+    def closeEvent(self, event):
+        self.stop_camera()
+        if self.export_worker is not None:
+            self.export_worker.cancel()
+            self.export_worker.wait()
+        if self.maintenance_worker is not None:
+            self.maintenance_worker.wait()
+        self.user_model.stop()
+        if self.gallery_sync_worker is not None:
+            self.gallery_sync_worker.wait()
+        if self.metrics_exporter is not None:
+            self.metrics_exporter.stop()
+        self.attendance_writer.stop()
+        super().closeEvent(event)
 
     def __del__(self):
         self.db.close()
@@ -545,6 +919,19 @@ class FaceIDApp(QMainWindow):
 # Запуск приложения
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+
+    # A kiosk without the central database would record attendance to a file nobody reads
+    if settings.DATABASE_URL_IS_DEFAULT and not settings.DEV:
+        QMessageBox.critical(None, "Ошибка", "Не задан адрес базы данных FACEID_DATABASE_URL.\n"
+                             "Для работы с локальным файлом faceid.db задайте FACEID_DEV=1.")
+        sys.exit(1)
+
+    # Existing installs are converted to the current schema before any table is read; without the
+    # central server recognition still starts from the local gallery cache
+    try:
+        upgrade()
+    except SQLAlchemyError as e:
+        print(f"Could not upgrade the database schema: {e}")
     
     # Set application-wide font
     font = QFont("Inter", 10)
@@ -0,0 +1,141 @@
+import argparse
+import http.client
+import json
+import threading
+import time
+from urllib.parse import urlparse
+import cv2
+import numpy as np
+from benchmark import metadata, synthetic_frames
+from detection import crop_face
+
+CONCURRENCY_LEVELS = [1, 2, 4, 8, 16, 32]
+REQUESTS_PER_CLIENT = 20
+JPEG_QUALITY = 90
+
+
+def encode_images(frames, mode):
+    """JPEG bodies to send; crop mode sends a face-sized crop from the middle of each frame"""
+    bodies = []
+    for frame in frames:
+        if mode == "crop":
+            height, width = frame.shape[:2]
+            side = min(height, width) // 3
+            top, left = (height - side) // 2, (width - side) // 2
+            frame, _ = crop_face(frame, (top, left + side, top + side, left))
+        ok, data = cv2.imencode(".jpg", cv2.cvtColor(frame, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        bodies.append(data.tobytes())
+    return bodies
+
+
+def client(url, mode, bodies, count, offset, latencies, batch_sizes, errors, start):
+    """One kiosk: a keep-alive connection sending count requests back to back"""
+    conn = http.client.HTTPConnection(url.hostname, url.port, timeout=60)
+    start.wait()
+    for i in range(count):
+        body = bodies[(offset + i) % len(bodies)]
+        started = time.perf_counter()
+        try:
+            conn.request("POST", f"/recognize?mode={mode}", body, {"Content-Type": "image/jpeg"})
+            response = conn.getresponse()
+            payload = json.loads(response.read())
+        except (OSError, http.client.HTTPException, ValueError) as e:
+            errors.append(str(e))
+            conn.close()
+            conn = http.client.HTTPConnection(url.hostname, url.port, timeout=60)
+            continue
+        latencies.append((time.perf_counter() - started) * 1000)
+        if response.status == 200:
+            batch_sizes.append(payload["batch_size"])
+        else:
+            errors.append(payload.get("error", str(response.status)))
+    conn.close()
+
+
+def run_level(url, mode, bodies, concurrency, requests_per_client):
+    """Throughput and latency percentiles with concurrency clients sending at once"""
+    latencies, batch_sizes, errors = [], [], []
+    start = threading.Event()
+    threads = [
+        threading.Thread(target=client, args=(url, mode, bodies, requests_per_client, i, latencies,
+                                              batch_sizes, errors, start))
+        for i in range(concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    started = time.perf_counter()
+    start.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0.0, 0.0, 0.0)
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": len(errors),
+        "throughput_rps": len(latencies) / elapsed,
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "avg_batch_size": float(np.mean(batch_sizes)) if batch_sizes else 0.0,
+    }
+
+
+def local_server(gallery_size, max_batch, wait_ms):
+    """Recognition server on a free localhost port with a synthetic gallery, so the test needs
+    neither a database nor enrolled users"""
+    from ann_index import synthetic_gallery
+    from recognition_server import create_server
+    from templates import create_gallery
+    vectors = synthetic_gallery(gallery_size)
+    gallery = create_gallery(list(range(1, gallery_size + 1)), [f"user{i}" for i in range(1, gallery_size + 1)],
+                             vectors, [], np.empty((0, vectors.shape[1]), dtype=np.float32))
+    server = create_server(gallery, "127.0.0.1", 0, max_batch=max_batch, wait_ms=wait_ms)
+    threading.Thread(target=server.serve_forever, name="recognition-server", daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test of the recognition server at increasing concurrency")
+    parser.add_argument("--url", default=None, help="server to test, e.g. http://127.0.0.1:8765 "
+                                                   "(default: start one in this process)")
+    parser.add_argument("--mode", choices=["frame", "crop"], default="frame")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY_LEVELS)
+    parser.add_argument("--requests", type=int, default=REQUESTS_PER_CLIENT, help="requests per client")
+    parser.add_argument("--frames", help="directory of frames to send instead of synthetic ones")
+    parser.add_argument("--gallery-size", type=int, default=10000, help="identities of the in-process server")
+    parser.add_argument("--max-batch", type=int, default=None, help="batch size of the in-process server")
+    parser.add_argument("--wait-ms", type=float, default=None, help="batch wait of the in-process server")
+    parser.add_argument("--output", help="also write the results to this JSON file")
+    args = parser.parse_args()
+
+    server = None
+    if args.url is None:
+        server = local_server(args.gallery_size, args.max_batch, args.wait_ms)
+        args.url = f"http://127.0.0.1:{server.server_address[1]}"
+    url = urlparse(args.url)
+    bodies = encode_images(synthetic_frames(8, args.frames), args.mode)
+
+    print(f"{args.url}, mode {args.mode}, {args.requests} requests per client")
+    print("clients   req/s     p50     p95     p99 ms   batch  errors")
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            level = run_level(url, args.mode, bodies, concurrency, args.requests)
+            results.append(level)
+            print(f"{concurrency:>7} {level['throughput_rps']:7.1f} {level['p50_ms']:7.1f} {level['p95_ms']:7.1f} "
+                  f"{level['p99_ms']:7.1f}    {level['avg_batch_size']:5.1f} {level['errors']:>7}")
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+            server.batcher.stop()
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"meta": metadata(), "url": args.url, "mode": args.mode, "results": results}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
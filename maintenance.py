@@ -0,0 +1,253 @@
+import argparse
+import csv
+import gzip
+import os
+from datetime import datetime
+from sqlalchemy import (Column, DateTime, Integer, MetaData, String, Table, delete, func, insert,
+                        select, text, update)
+from PyQt6.QtCore import QThread, pyqtSignal
+import settings
+from db_config import engine
+from models import Attendance
+from attendance_queries import day_start
+from reports import delete_summaries, rebuild_daily_summary
+
+ARCHIVE_TABLE_PREFIX = "attendance_archive_"
+ARCHIVE_COLUMNS = ["id", "user_id", "ts", "name"]
+
+
+def month_start(year, month):
+    """Local midnight of the first day of a month; month may run past 1..12"""
+    year, month = year + (month - 1) // 12, (month - 1) % 12 + 1
+    return day_start(datetime(year, month, 1).date())
+
+
+def retention_cutoff(months, now=None):
+    """Start of the oldest month kept when keeping the current month plus `months` before it"""
+    now = (now or datetime.now()).astimezone()
+    return month_start(now.year, now.month - months)
+
+
+def archive_table(year, month, metadata=None):
+    """Per-month archive table with the attendance columns; ids are kept as they were"""
+    return Table(
+        f"{ARCHIVE_TABLE_PREFIX}{year:04d}_{month:02d}",
+        metadata if metadata is not None else MetaData(),
+        Column("id", Integer, primary_key=True, autoincrement=False),
+        Column("user_id", Integer, index=True),
+        Column("ts", DateTime(timezone=True), nullable=False),
+        Column("name", String),
+    )
+
+
+def _months_before(conn, cutoff):
+    """(year, month) of every month from the oldest row up to the cutoff"""
+    oldest = conn.execute(select(func.min(Attendance.ts)).where(Attendance.ts < cutoff)).scalar()
+    if oldest is None:
+        return []
+    oldest = oldest.astimezone() if oldest.tzinfo is not None else oldest
+    months = []
+    year, month = oldest.year, oldest.month
+    while month_start(year, month) < cutoff:
+        months.append((year, month))
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months
+
+
+def _chunk_upper_id(conn, conditions, chunk_size):
+    """Largest id among the first chunk_size rows matching conditions, or None when none match"""
+    chunk = select(Attendance.id).where(*conditions).order_by(Attendance.id).limit(chunk_size).subquery()
+    return conn.execute(select(func.max(chunk.c.id))).scalar()
+
+
+def delete_in_chunks(conditions=(), chunk_size=None, bind=engine, log=print):
+    """Delete matching attendance rows, chunk_size rows per transaction. Returns the count."""
+    chunk_size = chunk_size or settings.MAINTENANCE_CHUNK_SIZE
+    conditions = list(conditions)
+    deleted = 0
+    while True:
+        with bind.begin() as conn:
+            chunk = select(Attendance.id).where(*conditions).order_by(Attendance.id).limit(chunk_size)
+            count = conn.execute(delete(Attendance).where(Attendance.id.in_(chunk))).rowcount
+        if not count:
+            break
+        deleted += count
+        log(f"Удалено записей: {deleted}")
+    return deleted
+
+
+def purge(before=None, chunk_size=None, bind=engine, log=print):
+    """Delete attendance before a local date ('YYYY-MM-DD'), or all of it when before is None,
+    with the daily summaries of those days. Archiving keeps the summaries."""
+    conditions = [Attendance.ts < day_start(before)] if before else []
+    deleted = delete_in_chunks(conditions, chunk_size, bind, log)
+    delete_summaries(before, bind)
+    return deleted
+
+
+def reset_sequence(bind=engine):
+    """Point the id sequence just past the largest id, so new rows continue from there"""
+    with bind.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            conn.execute(text(
+                "SELECT setval(pg_get_serial_sequence('attendance', 'id'), "
+                "COALESCE(MAX(id), 0) + 1, false) FROM attendance"
+            ))
+        # SQLite without AUTOINCREMENT already continues from MAX(rowid) + 1
+
+
+def renumber_ids(bind=engine, log=print):
+    """Renumber attendance ids as 1..N in id order, in SQL, then reset the sequence.
+
+    Ids are first moved to their negated new value and then flipped back, so no
+    intermediate row collides with an id that is not renumbered yet.
+    """
+    numbered = select(
+        Attendance.id, func.row_number().over(order_by=Attendance.id).label("new_id")
+    ).subquery()
+    with bind.begin() as conn:
+        if conn.dialect.name == "postgresql":
+            # Keeps the attendance writer from inserting between the two updates
+            conn.execute(text("LOCK TABLE attendance IN EXCLUSIVE MODE"))
+        count = conn.execute(
+            update(Attendance).where(Attendance.id == numbered.c.id).values(id=-numbered.c.new_id)
+        ).rowcount
+        conn.execute(update(Attendance).where(Attendance.id < 0).values(id=-Attendance.id))
+    reset_sequence(bind)
+    log(f"Пересчитано ID: {count}")
+    return count
+
+
+def _archive_month_to_table(bind, year, month, conditions, chunk_size, log):
+    table = archive_table(year, month)
+    with bind.begin() as conn:
+        table.create(conn, checkfirst=True)
+    columns = [Attendance.id, Attendance.user_id, Attendance.ts, Attendance.name]
+    moved = 0
+    while True:
+        # Copy and delete one id range per transaction, without pulling rows into Python
+        with bind.begin() as conn:
+            upper = _chunk_upper_id(conn, conditions, chunk_size)
+            if upper is None:
+                break
+            chunk = conditions + [Attendance.id <= upper]
+            conn.execute(insert(table).from_select(ARCHIVE_COLUMNS, select(*columns).where(*chunk)))
+            moved += conn.execute(delete(Attendance).where(*chunk)).rowcount
+        log(f"{table.name}: перенесено {moved}")
+    return moved
+
+
+def _archive_month_to_file(bind, year, month, conditions, chunk_size, archive_dir, log):
+    os.makedirs(archive_dir, exist_ok=True)
+    path = os.path.join(archive_dir, f"attendance_{year:04d}_{month:02d}.csv.gz")
+    new_file = not os.path.exists(path)
+    moved = 0
+    while True:
+        with bind.connect() as conn:
+            rows = conn.execute(
+                select(Attendance.id, Attendance.user_id, Attendance.ts, Attendance.name)
+                .where(*conditions)
+                .order_by(Attendance.id)
+                .limit(chunk_size)
+            ).all()
+        if not rows:
+            break
+        # Rows reach the disk before they are deleted; an interrupted run repeats at most one chunk
+        with gzip.open(path, "at", encoding="utf-8", newline="") as f:
+            writer = csv.writer(f)
+            if new_file:
+                writer.writerow(ARCHIVE_COLUMNS)
+                new_file = False
+            writer.writerows((row.id, row.user_id, row.ts.isoformat(), row.name) for row in rows)
+        with open(path, "rb+") as f:
+            os.fsync(f.fileno())
+        with bind.begin() as conn:
+            moved += conn.execute(delete(Attendance).where(*conditions, Attendance.id <= rows[-1].id)).rowcount
+        log(f"{path}: перенесено {moved}")
+    return moved
+
+
+def archive(months=None, to="table", archive_dir=None, chunk_size=None, bind=engine, log=print):
+    """Move attendance older than the last `months` whole months into per-month archives.
+
+    to="table" copies rows into attendance_archive_YYYY_MM tables in the same database,
+    to="file" appends them to gzip-compressed CSV files in archive_dir. Each chunk is
+    moved in its own short transaction. Returns the number of rows archived.
+    """
+    months = settings.RETENTION_MONTHS if months is None else months
+    archive_dir = archive_dir or settings.ARCHIVE_DIR
+    chunk_size = chunk_size or settings.MAINTENANCE_CHUNK_SIZE
+    cutoff = retention_cutoff(months)
+    with bind.connect() as conn:
+        pending = _months_before(conn, cutoff)
+
+    moved = 0
+    for year, month in pending:
+        conditions = [Attendance.ts >= month_start(year, month), Attendance.ts < month_start(year, month + 1)]
+        if to == "file":
+            moved += _archive_month_to_file(bind, year, month, conditions, chunk_size, archive_dir, log)
+        else:
+            moved += _archive_month_to_table(bind, year, month, conditions, chunk_size, log)
+    return moved
+
+
+class MaintenanceWorker(QThread):
+    """Runs one maintenance function off the UI thread, forwarding its log lines"""
+
+    message = pyqtSignal(str)
+    finished_task = pyqtSignal(int)  # rows affected
+    failed = pyqtSignal(str)
+
+    def __init__(self, task, parent=None, **kwargs):
+        super().__init__(parent)
+        self.task = task
+        self.kwargs = kwargs
+
+    def run(self):
+        try:
+            self.finished_task.emit(self.task(log=self.message.emit, **self.kwargs))
+        except Exception as e:
+            self.failed.emit(str(e))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attendance history maintenance")
+    parser.add_argument("--chunk-size", type=int, default=None,
+                        help=f"rows per transaction (default {settings.MAINTENANCE_CHUNK_SIZE})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    commands.add_parser("renumber", help="renumber ids as 1..N and reset the sequence")
+    commands.add_parser("reset-sequence", help="continue ids after the current maximum")
+
+    archive_parser = commands.add_parser("archive", help="move old months into archives")
+    archive_parser.add_argument("--months", type=int, default=settings.RETENTION_MONTHS,
+                                help="whole months to keep besides the current one")
+    archive_parser.add_argument("--to", choices=["table", "file"], default="table",
+                                help="per-month archive tables or compressed CSV files")
+    archive_parser.add_argument("--dir", default=settings.ARCHIVE_DIR, help="directory for archive files")
+
+    purge_parser = commands.add_parser("purge", help="delete attendance in chunks")
+    scope = purge_parser.add_mutually_exclusive_group(required=True)
+    scope.add_argument("--before", help="delete rows before this date (YYYY-MM-DD)")
+    scope.add_argument("--all", action="store_true", help="delete the whole history")
+
+    commands.add_parser("rebuild-summary", help="recompute the daily summaries from the attendance table")
+
+    args = parser.parse_args()
+    if args.command == "renumber":
+        renumber_ids()
+    elif args.command == "reset-sequence":
+        reset_sequence()
+        print("Последовательность ID обновлена")
+    elif args.command == "archive":
+        moved = archive(args.months, args.to, args.dir, args.chunk_size)
+        print(f"Архивировано записей: {moved}")
+    elif args.command == "purge":
+        deleted = purge(None if args.all else args.before, args.chunk_size)
+        print(f"Удалено записей: {deleted}")
+    elif args.command == "rebuild-summary":
+        print(f"Сводок по дням: {rebuild_daily_summary()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+import collections
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+import numpy as np
+import settings
+
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class StageHistogram:
+    """Rolling window of the latest latency samples (ms) plus lifetime count and sum"""
+
+    def __init__(self, window):
+        self.samples = collections.deque(maxlen=window)
+        self.count = 0
+        self.total_ms = 0.0
+
+    def observe(self, ms):
+        self.samples.append(ms)
+        self.count += 1
+        self.total_ms += ms
+
+    def quantiles(self):
+        if not self.samples:
+            return {q: 0.0 for q in QUANTILES}
+        values = np.percentile(np.fromiter(self.samples, dtype=np.float64), [q * 100 for q in QUANTILES])
+        return dict(zip(QUANTILES, values.tolist()))
+
+
+class Metrics:
+    """Thread-safe per-stage latency histograms, counters and gauges.
+
+    Recording a sample is an append under a lock; percentiles are only computed when a
+    snapshot is taken for the overlay or an export.
+    """
+
+    def __init__(self, window=None):
+        self.window = settings.METRICS_WINDOW if window is None else window
+        self._lock = threading.Lock()
+        self.stages = {}
+        self.counters = collections.Counter()
+        self.gauges = {}
+
+    def observe(self, stage, ms):
+        with self._lock:
+            histogram = self.stages.get(stage)
+            if histogram is None:
+                histogram = self.stages[stage] = StageHistogram(self.window)
+            histogram.observe(ms)
+
+    @contextmanager
+    def timer(self, stage):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, (time.perf_counter() - started) * 1000)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self.gauges[name] = value
+
+    def snapshot(self):
+        with self._lock:
+            stages = {
+                stage: {"count": h.count, "sum_ms": h.total_ms,
+                        **{f"p{int(q * 100)}_ms": v for q, v in h.quantiles().items()}}
+                for stage, h in self.stages.items()
+            }
+            return {"timestamp": time.time(), "stages": stages,
+                    "counters": dict(self.counters), "gauges": dict(self.gauges)}
+
+    def to_json(self):
+        return json.dumps(self.snapshot(), indent=2)
+
+    def to_prometheus(self):
+        """Prometheus text exposition format: stage latencies as summaries in seconds"""
+        snap = self.snapshot()
+        lines = [
+            "# HELP faceid_stage_latency_seconds Latency of each pipeline stage over the recent window",
+            "# TYPE faceid_stage_latency_seconds summary",
+        ]
+        for stage, values in sorted(snap["stages"].items()):
+            for q in QUANTILES:
+                lines.append(f'faceid_stage_latency_seconds{{stage="{stage}",quantile="{q}"}} '
+                             f'{values[f"p{int(q * 100)}_ms"] / 1000:.6f}')
+            lines.append(f'faceid_stage_latency_seconds_sum{{stage="{stage}"}} {values["sum_ms"] / 1000:.6f}')
+            lines.append(f'faceid_stage_latency_seconds_count{{stage="{stage}"}} {values["count"]}')
+        for name, value in sorted(snap["counters"].items()):
+            lines.append(f"# TYPE faceid_{name}_total counter")
+            lines.append(f"faceid_{name}_total {value}")
+        for name, value in sorted(snap["gauges"].items()):
+            lines.append(f"# TYPE faceid_{name} gauge")
+            lines.append(f"faceid_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    def overlay_lines(self):
+        """Short text lines for the on-video overlay"""
+        snap = self.snapshot()
+        lines = [
+            f"{stage:<12} {v['p50_ms']:6.1f} {v['p95_ms']:6.1f} {v['p99_ms']:6.1f} ms"
+            for stage, v in sorted(snap["stages"].items())
+        ]
+        lines += [f"{name}: {value}" for name, value in sorted(snap["counters"].items())]
+        lines += [f"{name}: {value:.1f}" if isinstance(value, float) else f"{name}: {value}"
+                  for name, value in sorted(snap["gauges"].items())]
+        return ["stage          p50    p95    p99"] + lines
+
+
+class MetricsExporter(threading.Thread):
+    """Periodically writes the metrics to a file: Prometheus text for *.prom, JSON otherwise.
+    The file is replaced atomically, so a scraper or node_exporter never reads half of it."""
+
+    def __init__(self, registry, path=None, interval=None):
+        super().__init__(name="metrics-exporter", daemon=True)
+        self.registry = registry
+        self.path = path or settings.METRICS_PATH
+        self.interval = settings.METRICS_EXPORT_INTERVAL if interval is None else interval
+        self._stopping = threading.Event()
+
+    def write(self):
+        text = self.registry.to_prometheus() if self.path.endswith(".prom") else self.registry.to_json()
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.replace(tmp_path, self.path)
+
+    def run(self):
+        while not self._stopping.wait(self.interval):
+            try:
+                self.write()
+            except OSError as e:
+                print(f"Could not write metrics to {self.path}: {e}")
+        self.write()
+
+    def stop(self):
+        self._stopping.set()
+        if self.is_alive():
+            self.join(timeout=2)
+
+
+# Shared by the capture thread, the recognition worker, the attendance writer and the GUI
+metrics = Metrics()
@@ -0,0 +1,152 @@
+from datetime import datetime
+from sqlalchemy import DateTime, bindparam, func, inspect, select, text, update
+from sqlalchemy import column as sql_column, table as sql_table
+from db_config import engine, Base
+import models  # noqa: F401  (registers the tables on Base.metadata)
+from reports import rebuild_daily_summary
+
+MIGRATION_BATCH_SIZE = 5000
+
+# The attendance table before user_id/ts existed, with name/date/time strings
+legacy_attendance = sql_table(
+    "attendance",
+    *(sql_column(name) for name in ("id", "name", "date", "time", "user_id")),
+    sql_column("ts", DateTime(timezone=True)),
+)
+# Legacy rows whose date/time strings cannot be parsed are moved here instead of stopping the conversion
+invalid_attendance = sql_table("attendance_invalid", *(sql_column(name) for name in ("id", "name", "date", "time")))
+
+
+def add_missing_columns(conn, table):
+    """Add columns declared on the model but missing in the database (new columns must be nullable)"""
+    existing = {column["name"] for column in inspect(conn).get_columns(table.name)}
+    for column in table.columns:
+        if column.name in existing:
+            continue
+        column_type = column.type.compile(dialect=conn.dialect)
+        conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}"))
+        print(f"Добавлен столбец {table.name}.{column.name}")
+
+
+def create_missing_indexes(conn, table):
+    for index in table.indexes:
+        index.create(conn, checkfirst=True)
+
+
+def convert_legacy_attendance(bind, batch_size=MIGRATION_BATCH_SIZE):
+    """Fill user_id and ts from the old name/date/time strings in batches, then drop the strings.
+
+    Each batch is its own transaction, so the conversion can be interrupted and resumed:
+    rows that already have ts are skipped. Rows with malformed strings are moved to
+    attendance_invalid.
+    """
+    with bind.connect() as conn:
+        users = conn.execute(text("SELECT id, name FROM users ORDER BY id DESC")).all()
+    # Oldest user wins when several share a name
+    user_ids = {name: user_id for user_id, name in users}
+    update_stmt = (
+        update(legacy_attendance)
+        .where(legacy_attendance.c.id == bindparam("row_id"))
+        .values(user_id=bindparam("new_user_id"), ts=bindparam("new_ts"))
+    )
+
+    with bind.begin() as conn:
+        conn.execute(text("CREATE TABLE IF NOT EXISTS attendance_invalid "
+                          "(id INTEGER PRIMARY KEY, name VARCHAR, date VARCHAR, time VARCHAR)"))
+
+    converted = 0
+    invalid = 0
+    last_id = 0
+    while True:
+        with bind.begin() as conn:
+            rows = conn.execute(
+                select(legacy_attendance.c.id, legacy_attendance.c.name,
+                       legacy_attendance.c.date, legacy_attendance.c.time)
+                .where(legacy_attendance.c.id > last_id, legacy_attendance.c.ts.is_(None))
+                .order_by(legacy_attendance.c.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            params = []
+            bad_rows = []
+            for row in rows:
+                try:
+                    # Legacy strings are local wall-clock time
+                    ts = datetime.strptime(f"{row.date} {row.time}", "%Y-%m-%d %H:%M:%S").astimezone()
+                except (TypeError, ValueError):
+                    print(f"Attendance row {row.id} has an invalid date/time {row.date!r} {row.time!r}, "
+                          f"moved to attendance_invalid")
+                    bad_rows.append(dict(row._mapping))
+                    continue
+                params.append({"row_id": row.id, "new_user_id": user_ids.get(row.name), "new_ts": ts})
+            if params:
+                conn.execute(update_stmt, params)
+            if bad_rows:
+                conn.execute(invalid_attendance.insert(), bad_rows)
+                conn.execute(legacy_attendance.delete().where(
+                    legacy_attendance.c.id.in_([row["id"] for row in bad_rows])))
+        converted += len(params)
+        invalid += len(bad_rows)
+        last_id = rows[-1].id
+        print(f"Перенесено записей посещаемости: {converted}")
+    if invalid:
+        print(f"Записей с неверной датой перенесено в attendance_invalid: {invalid}")
+
+    with bind.begin() as conn:
+        if conn.dialect.name == "sqlite":
+            rebuild_sqlite_attendance(conn)
+            return converted
+        conn.execute(text("ALTER TABLE attendance DROP COLUMN date"))
+        conn.execute(text("ALTER TABLE attendance DROP COLUMN time"))
+        if conn.dialect.name == "postgresql":
+            conn.execute(text("ALTER TABLE attendance ALTER COLUMN ts SET NOT NULL"))
+            conn.execute(text(
+                "ALTER TABLE attendance ADD CONSTRAINT attendance_user_id_fkey "
+                "FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE SET NULL"
+            ))
+    return converted
+
+
+def rebuild_sqlite_attendance(conn):
+    """SQLite cannot add NOT NULL or a foreign key to an existing table, so attendance is
+    recreated from the model and the converted rows are copied over"""
+    for index in inspect(conn).get_indexes("attendance"):
+        conn.execute(text(f"DROP INDEX {index['name']}"))
+    conn.execute(text("ALTER TABLE attendance RENAME TO attendance_legacy"))
+    models.Attendance.__table__.create(conn)
+    conn.execute(text("INSERT INTO attendance (id, user_id, ts, name) "
+                      "SELECT id, user_id, ts, name FROM attendance_legacy"))
+    conn.execute(text("DROP TABLE attendance_legacy"))
+
+
+def upgrade(bind=engine):
+    """Create missing tables and bring existing ones up to the current models"""
+    had_summary = inspect(bind).has_table(models.AttendanceDaily.__tablename__)
+    Base.metadata.create_all(bind=bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            add_missing_columns(conn, table)
+
+    # Rows that existed before updated_at count as changed now, so caches pick them up once
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if "updated_at" in table.columns:
+                conn.execute(update(table).where(table.c.updated_at.is_(None)).values(updated_at=func.now()))
+
+    attendance_columns = {column["name"] for column in inspect(bind).get_columns("attendance")}
+    if "date" in attendance_columns:
+        convert_legacy_attendance(bind)
+
+    # Daily summaries are maintained on write from now on; fill them once from the history
+    if not had_summary:
+        print(f"Сводок по дням: {rebuild_daily_summary(bind)}")
+
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            create_missing_indexes(conn, table)
+
+
+if __name__ == "__main__":
+    upgrade()
+    print("Схема базы данных обновлена!")
@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, LargeBinary
+from sqlalchemy import Column, Integer, String, Date, DateTime, LargeBinary, ForeignKey, Index, func
+from sqlalchemy.orm import deferred, relationship
 from db_config import Base
 from datetime import datetime
 
@@ -7,12 +8,66 @@ class User(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, nullable=False)
-    photo = Column(LargeBinary, nullable=False)
+    # Full-resolution photo, loaded only when accessed (or with undefer)
+    photo = deferred(Column(LargeBinary, nullable=False))
+    # Small JPEG for the Users tab, see thumbnails.py
+    thumbnail = deferred(Column(LargeBinary))
+    # Precomputed face embedding, see embeddings.py
+    photo_hash = Column(String(64))
+    encoding = Column(LargeBinary)
+    encoding_model = Column(String)
+    # Server time of the last change; local gallery caches sync rows changed since their last sync.
+    # default= as well as server_default=, since upgrade() adds the column without a default
+    updated_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now(),
+                        onupdate=func.now(), index=True)
+
+class UserEmbedding(Base):
+    """Additional enrollment photo of a user; the photo in users is the first template"""
+    __tablename__ = "user_embeddings"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    photo = deferred(Column(LargeBinary, nullable=False))
+    photo_hash = Column(String(64))
+    encoding = Column(LargeBinary)
+    encoding_model = Column(String)
+    # See User.updated_at
+    updated_at = Column(DateTime(timezone=True), default=func.now(), server_default=func.now(),
+                        onupdate=func.now(), index=True)
+
+    user = relationship("User")
 
 class Attendance(Base):
     __tablename__ = "attendance"
+    __table_args__ = (
+        Index("ix_attendance_user_id_ts", "user_id", "ts"),
+        Index("ix_attendance_ts", "ts"),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="SET NULL"))
+    # Capture time, timezone-aware
+    ts = Column(DateTime(timezone=True), nullable=False)
+    # Name at capture time; shown only once the user has been deleted
+    name = Column(String, nullable=False)
+
+    user = relationship("User")
+
+class AttendanceDaily(Base):
+    """One row per user and local day, updated by the attendance writer (see reports.py).
+    Kept when the raw rows are archived, so reports cover the whole history."""
+    __tablename__ = "attendance_daily"
+    __table_args__ = (
+        Index("ix_attendance_daily_day_first", "day", "first_seconds"),
+    )
+
+    # No foreign key: like attendance.name, summaries outlive deleted users
+    user_id = Column(Integer, primary_key=True, autoincrement=False)
+    day = Column(Date, primary_key=True)
     name = Column(String, nullable=False)
-    date = Column(String, nullable=False)
-    time = Column(String, nullable=False) 
\ No newline at end of file
+    first_ts = Column(DateTime(timezone=True), nullable=False)
+    last_ts = Column(DateTime(timezone=True), nullable=False)
+    # Local seconds since midnight of first_ts/last_ts: lateness and hours without date functions
+    first_seconds = Column(Integer, nullable=False)
+    last_seconds = Column(Integer, nullable=False)
+    count = Column(Integer, nullable=False)
@@ -0,0 +1,256 @@
+import argparse
+import collections
+import json
+import math
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
+import cv2
+import settings
+from capture import open_video_capture, parse_source
+from detection import FaceDetector
+from gallery import DEFAULT_TOLERANCE
+
+# Frames decoded ahead of the detection stage, per worker process
+FRAMES_IN_FLIGHT_PER_WORKER = 2
+# Same person is recorded again only after this long (matches the GUI)
+ATTENDANCE_INTERVAL = timedelta(minutes=1)
+
+_detector = None
+
+
+def _init_worker(min_face_size):
+    global _detector
+    # Offline footage favours accuracy over latency: keep the detection scale fixed
+    _detector = FaceDetector(min_face_size=min_face_size, time_budget_ms=float("inf"))
+
+
+def detect_and_encode(image):
+    """Runs in a worker process: face boxes and encodings of one BGR frame"""
+    rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    boxes = _detector.detect(rgb)
+    return boxes, _detector.encode(rgb, boxes)
+
+
+def is_file_source(source):
+    return isinstance(source, str) and "://" not in source
+
+
+def file_start_time(path, cap):
+    """Recording start guessed as the file's modification time minus its duration"""
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    duration = frames / fps if fps > 0 and frames > 0 else 0.0
+    return datetime.fromtimestamp(os.path.getmtime(path) - duration)
+
+
+def read_frames(cap, sample_fps, start_time, live, duration, frames_out, stop):
+    """Decode stage: put (frame index, capture time, image) of sampled frames on frames_out"""
+    interval = 1.0 / sample_fps if sample_fps > 0 else 0.0
+    next_due = 0.0
+    started = time.monotonic()
+    index = 0
+    try:
+        while not stop.is_set():
+            # grab() without retrieve() skips the colour conversion of frames that are not sampled
+            if not cap.grab():
+                break
+            index += 1
+            if live:
+                offset = time.monotonic() - started
+                when = datetime.now()
+            else:
+                offset = cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0
+                when = start_time + timedelta(seconds=offset)
+            if duration and offset > duration:
+                break
+            if offset < next_due:
+                continue
+            next_due = offset + interval
+            ok, image = cap.retrieve()
+            if ok:
+                frames_out.put((index, when, image))
+    finally:
+        frames_out.put(None)
+
+
+class VideoJob:
+    """One input processed as a pipeline: a decode thread, detection and encoding in the
+    shared process pool, then matching, attendance and outputs on the calling thread."""
+
+    def __init__(self, source, gallery, pool, workers, args, writer=None):
+        self.source = parse_source(source)
+        self.gallery = gallery
+        self.pool = pool
+        self.in_flight = max(1, workers * FRAMES_IN_FLIGHT_PER_WORKER)
+        self.args = args
+        self.writer = writer
+        self.last_seen = {}
+        self.stats = collections.Counter()
+
+    def _output_path(self, suffix):
+        stem = os.path.splitext(os.path.basename(str(self.source)))[0] or "stream"
+        stem = "".join(c if c.isalnum() or c in "-_." else "_" for c in stem)
+        return os.path.join(self.args.output_dir, stem + suffix)
+
+    def _record(self, user_id, name, when):
+        last = self.last_seen.get(user_id)
+        if last is not None and when - last <= ATTENDANCE_INTERVAL:
+            return
+        self.last_seen[user_id] = when
+        self.stats["attendance"] += 1
+        if self.writer is not None:
+            self.writer.submit(user_id, name, when)
+
+    def _annotate(self, image, faces):
+        for face in faces:
+            top, right, bottom, left = face["box"]
+            color = (0, 255, 0) if face["name"] else (0, 0, 255)
+            cv2.rectangle(image, (left, top), (right, bottom), color, 2)
+            cv2.putText(image, face["name"] or "Неизвестный", (left, max(top - 10, 15)),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, color, 2)
+
+    def run(self):
+        cap = open_video_capture(self.source, "auto")
+        if not cap.isOpened():
+            raise IOError(f"Could not open video source {self.source!r}")
+        live = not is_file_source(self.source)
+        start_time = datetime.now() if live else file_start_time(self.source, cap)
+        if self.args.start:
+            start_time = datetime.fromisoformat(self.args.start)
+
+        jsonl = video = None
+        if self.args.jsonl:
+            jsonl = open(self._output_path(".jsonl"), "w", encoding="utf-8")
+        frames = queue.Queue(maxsize=self.in_flight)
+        stop = threading.Event()
+        reader = threading.Thread(
+            target=read_frames, daemon=True,
+            args=(cap, self.args.sample_fps, start_time, live, self.args.duration, frames, stop),
+        )
+        started = time.perf_counter()
+        reader.start()
+        pending = collections.deque()
+        decoded_all = False
+        try:
+            while True:
+                # Keep the worker processes busy with frames decoded ahead of the one being matched
+                while not decoded_all and len(pending) < self.in_flight:
+                    item = frames.get()
+                    if item is None:
+                        decoded_all = True
+                        break
+                    index, when, image = item
+                    pending.append((index, when, image, self.pool.submit(detect_and_encode, image)))
+                if not pending:
+                    break
+                index, when, image, future = pending.popleft()
+                boxes, encodings = future.result()
+                faces = []
+                for box, match in zip(boxes, self.gallery.match(encodings, tolerance=self.args.tolerance)):
+                    faces.append({"box": list(box), "name": match.name, "user_id": match.user_id,
+                                  # No candidate (e.g. an empty gallery) is inf, which JSON cannot hold
+                                  "distance": round(match.distance, 4) if math.isfinite(match.distance) else None})
+                    if match.is_known:
+                        self.stats["recognized"] += 1
+                        self._record(match.user_id, match.name, when)
+                self.stats["frames"] += 1
+                self.stats["faces"] += len(faces)
+
+                if jsonl is not None:
+                    jsonl.write(json.dumps({"frame": index, "ts": when.isoformat(), "faces": faces},
+                                           ensure_ascii=False) + "\n")
+                if self.args.annotate:
+                    if video is None:
+                        height, width = image.shape[:2]
+                        video = cv2.VideoWriter(self._output_path(".annotated.mp4"),
+                                                cv2.VideoWriter_fourcc(*"mp4v"),
+                                                self.args.sample_fps or 25, (width, height))
+                    self._annotate(image, faces)
+                    video.write(image)
+        finally:
+            stop.set()
+            # Unblock the reader if it is waiting on a full queue
+            while reader.is_alive():
+                try:
+                    frames.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+            cap.release()
+            if jsonl is not None:
+                jsonl.close()
+            if video is not None:
+                video.release()
+
+        elapsed = time.perf_counter() - started
+        self.stats["seconds"] = elapsed
+        self.stats["fps"] = self.stats["frames"] / elapsed if elapsed > 0 else 0.0
+        return self.stats
+
+
+def process_sources(sources, gallery, args, writer=None):
+    """Process several inputs concurrently over one shared pool of detection processes.
+    Returns {source: stats}."""
+    workers = args.workers or os.cpu_count()
+    results = {}
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                             initargs=(args.min_face_size,)) as pool:
+        with ThreadPoolExecutor(max_workers=args.jobs) as jobs:
+            futures = {
+                source: jobs.submit(VideoJob(source, gallery, pool, workers, args, writer).run)
+                for source in sources
+            }
+            for source, future in futures.items():
+                try:
+                    results[source] = future.result()
+                except Exception as e:
+                    print(f"{source}: ошибка: {e}")
+                    results[source] = None
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognize faces in video files or streams without a display")
+    parser.add_argument("sources", nargs="+", help="video files or stream URLs (rtsp://...)")
+    parser.add_argument("--sample-fps", type=float, default=5.0,
+                        help="frames per second of video that are analysed (0 = every frame)")
+    parser.add_argument("--workers", type=int, default=None, help="detection processes (default: all cores)")
+    parser.add_argument("--jobs", type=int, default=2, help="inputs processed at the same time")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--min-face-size", type=int, default=settings.MIN_FACE_SIZE)
+    parser.add_argument("--start", help="recording start time of the files (ISO, default: from file time)")
+    parser.add_argument("--duration", type=float, default=None, help="stop each input after this many seconds")
+    parser.add_argument("--no-attendance", action="store_true", help="do not write attendance")
+    parser.add_argument("--jsonl", action="store_true", help="write detections to <name>.jsonl")
+    parser.add_argument("--annotate", action="store_true", help="write <name>.annotated.mp4 with boxes")
+    parser.add_argument("--output-dir", default=".", help="where JSONL and annotated videos are written")
+    args = parser.parse_args()
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    from face_recognition_module import load_known_faces
+    from attendance_writer import AttendanceWriter
+    gallery = load_known_faces()
+    writer = None
+    if not args.no_attendance:
+        writer = AttendanceWriter()
+        writer.start()
+    try:
+        results = process_sources(args.sources, gallery, args, writer)
+    finally:
+        if writer is not None:
+            writer.stop()
+
+    for source, stats in results.items():
+        if stats is None:
+            continue
+        print(
+            f"{source}: {stats['frames']} кадров за {stats['seconds']:.1f} с ({stats['fps']:.1f} fps), "
+            f"лиц {stats['faces']}, распознано {stats['recognized']}, отметок {stats['attendance']}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+import collections
+import math
+import cv2
+import face_recognition
+import numpy as np
+import settings
+from detection import crop_face
+
+# Faces are scored on a grey crop of this width, so sharpness does not depend on face size
+QUALITY_CROP_WIDTH = 64
+REASONS = ("too_small", "too_dark", "too_bright", "blurry", "off_angle")
+
+
+def sharpness(gray):
+    """Variance of the Laplacian: low for motion-blurred or out-of-focus faces"""
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def pose(landmarks):
+    """(yaw, roll) from the 5-point landmarks: yaw is the nose offset from the eyes' midpoint
+    in inter-eye distances (0 frontal, about 0.5 in profile), roll the eye line angle in degrees"""
+    left = np.mean(landmarks["left_eye"], axis=0)
+    right = np.mean(landmarks["right_eye"], axis=0)
+    nose = np.asarray(landmarks["nose_tip"][0], dtype=np.float64)
+    eye_distance = float(np.linalg.norm(right - left))
+    if eye_distance == 0:
+        return float("inf"), 0.0
+    yaw = abs(float(nose[0] - (left[0] + right[0]) / 2)) / eye_distance
+    roll = math.degrees(math.atan2(abs(right[1] - left[1]), abs(right[0] - left[0])))
+    return yaw, roll
+
+
+class FaceQualityGate:
+    """Cheap checks that keep blurry, tiny, badly lit and off-angle faces away from the
+    128-d encoder. Checks run cheapest first (box size, then brightness and sharpness of a
+    small grey crop, then the 5-point landmark pose), and the first failure is the reason.
+    """
+
+    def __init__(self, min_face_size=None, min_sharpness=None, min_brightness=None, max_brightness=None,
+                 max_yaw=None, max_roll=None, check_pose=None):
+        self.min_face_size = settings.QUALITY_MIN_FACE_SIZE if min_face_size is None else min_face_size
+        self.min_sharpness = settings.QUALITY_MIN_SHARPNESS if min_sharpness is None else min_sharpness
+        self.min_brightness = settings.QUALITY_MIN_BRIGHTNESS if min_brightness is None else min_brightness
+        self.max_brightness = settings.QUALITY_MAX_BRIGHTNESS if max_brightness is None else max_brightness
+        self.max_yaw = settings.QUALITY_MAX_YAW if max_yaw is None else max_yaw
+        self.max_roll = settings.QUALITY_MAX_ROLL if max_roll is None else max_roll
+        self.check_pose = settings.QUALITY_CHECK_POSE if check_pose is None else check_pose
+        self.passed = 0
+        self.rejected = collections.Counter()
+
+    def reject_reason(self, rgb_frame, box):
+        """Why the face in box should not be encoded, or None if it is good enough"""
+        top, right, bottom, left = box
+        if min(right - left, bottom - top) < self.min_face_size:
+            return "too_small"
+
+        face = rgb_frame[max(0, top):bottom, max(0, left):right]
+        if face.size == 0:
+            return "too_small"
+        height = max(1, round(face.shape[0] * QUALITY_CROP_WIDTH / face.shape[1]))
+        gray = cv2.cvtColor(cv2.resize(face, (QUALITY_CROP_WIDTH, height), interpolation=cv2.INTER_AREA),
+                            cv2.COLOR_RGB2GRAY)
+        brightness = float(gray.mean())
+        if brightness < self.min_brightness:
+            return "too_dark"
+        if brightness > self.max_brightness:
+            return "too_bright"
+        if sharpness(gray) < self.min_sharpness:
+            return "blurry"
+
+        if self.check_pose:
+            crop, local = crop_face(rgb_frame, box)
+            landmarks = face_recognition.face_landmarks(crop, [local], model="small")
+            if not landmarks:
+                return "off_angle"
+            yaw, roll = pose(landmarks[0])
+            if yaw > self.max_yaw or roll > self.max_roll:
+                return "off_angle"
+        return None
+
+    def filter(self, rgb_frame, boxes):
+        """(indices of boxes that pass, reasons of the rejected ones)"""
+        passed = []
+        reasons = []
+        for i, box in enumerate(boxes):
+            reason = self.reject_reason(rgb_frame, box)
+            if reason is None:
+                passed.append(i)
+            else:
+                reasons.append(reason)
+                self.rejected[reason] += 1
+        self.passed += len(passed)
+        return passed, reasons
+
+    def stats(self):
+        return {"quality_passed": self.passed, **{f"rejected_{r}": self.rejected[r] for r in REASONS}}
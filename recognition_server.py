@@ -0,0 +1,312 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import cv2
+import numpy as np
+import settings
+from db_config import SessionLocal
+from detection import CROP_MARGIN, FaceDetector
+from gallery import DEFAULT_TOLERANCE
+from gallery_cache import open_gallery, sync_changes
+from metrics import metrics
+from templates import update_identity
+
+MODES = ("frame", "crop")
+# A request not answered within this many seconds gets 503 instead of waiting forever
+REQUEST_TIMEOUT = 30.0
+
+
+def crop_box(crop):
+    """Face box of a crop made like detection.crop_face: the face with CROP_MARGIN on every side"""
+    height, width = crop.shape[:2]
+    pad_x = int(round(width * CROP_MARGIN / (1 + 2 * CROP_MARGIN)))
+    pad_y = int(round(height * CROP_MARGIN / (1 + 2 * CROP_MARGIN)))
+    return pad_y, width - pad_x, height - pad_y, pad_x
+
+
+def decode_image(data):
+    """RGB array of an encoded JPEG/PNG image, or None if it cannot be decoded"""
+    bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    return None if bgr is None else cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+
+
+class RecognitionRequest:
+    """One client image waiting for the batcher; done is set once faces or error is filled in"""
+
+    def __init__(self, image, mode):
+        self.image = image
+        self.mode = mode
+        self.submitted_at = time.perf_counter()
+        self.done = threading.Event()
+        self.faces = None
+        self.error = None
+        self.batch_size = 0
+
+
+class RecognitionBatcher(threading.Thread):
+    """Single thread that owns the detector and the shared gallery and serves every client.
+
+    Requests queued by the HTTP threads are taken in micro-batches: the first request opens a
+    batch, which is closed when it holds max_batch images or wait_ms have passed. Faces of all
+    images in a batch are matched against the gallery in one matrix pass. Gallery updates are
+    applied between batches, so matching never sees a half-applied update.
+    """
+
+    def __init__(self, gallery, tolerance=DEFAULT_TOLERANCE, max_batch=None, wait_ms=None):
+        super().__init__(name="recognition-batcher", daemon=True)
+        self.gallery = gallery
+        self.tolerance = tolerance
+        self.max_batch = max_batch or settings.SERVER_MAX_BATCH
+        self.wait = (settings.SERVER_BATCH_WAIT_MS if wait_ms is None else wait_ms) / 1000
+        # Frames from many cameras differ in face size: keep the detection scale fixed
+        self.detector = FaceDetector(time_budget_ms=float("inf"))
+        self.requests = queue.Queue()
+        self.gallery_updates = queue.Queue()
+        self._running = True
+        self.batches = 0
+        self.processed = 0
+
+    def submit(self, image, mode="frame"):
+        request = RecognitionRequest(image, mode)
+        self.requests.put(request)
+        metrics.set_gauge("server_queue_depth", self.requests.qsize())
+        return request
+
+    def update_identities(self, identities, removed=()):
+        """Queue {user_id: (name, encodings)} to add or replace and user ids to remove"""
+        self.gallery_updates.put((identities, set(removed)))
+
+    def _apply_gallery_updates(self):
+        while True:
+            try:
+                identities, removed = self.gallery_updates.get_nowait()
+            except queue.Empty:
+                return
+            for user_id in removed:
+                self.gallery.remove(user_id)
+            for user_id, (name, encodings) in identities.items():
+                self.gallery = update_identity(self.gallery, user_id, name, encodings)
+            metrics.incr("gallery_updates", len(removed | identities.keys()))
+
+    def _collect(self):
+        """Block for the first request, then take more until the batch is full or wait has passed"""
+        try:
+            batch = [self.requests.get(timeout=0.5)]
+        except queue.Empty:
+            return []
+        deadline = time.perf_counter() + self.wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            try:
+                batch.append(self.requests.get(timeout=remaining) if remaining > 0 else self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def process(self, batch):
+        """Fill in faces of every request: boxes, then encodings, then one match over all of them"""
+        boxes = []
+        for request in batch:
+            if request.mode == "crop":
+                # The client already found and cropped the face: no detection pass
+                boxes.append([crop_box(request.image)])
+            else:
+                with metrics.timer("detect"):
+                    boxes.append(self.detector.detect(request.image))
+
+        encodings = []
+        with metrics.timer("encode"):
+            for request, image_boxes in zip(batch, boxes):
+                encodings.extend(self.detector.encode(request.image, image_boxes))
+        with metrics.timer("match"):
+            matches = iter(self.gallery.match(encodings, tolerance=self.tolerance))
+
+        for request, image_boxes in zip(batch, boxes):
+            request.faces = []
+            for box in image_boxes:
+                match = next(matches)
+                request.faces.append({
+                    "box": list(box),
+                    "user_id": match.user_id,
+                    "name": match.name,
+                    "distance": match.distance if np.isfinite(match.distance) else None,
+                })
+
+    def run(self):
+        while self._running:
+            self._apply_gallery_updates()
+            batch = self._collect()
+            if not batch:
+                continue
+            started = time.perf_counter()
+            for request in batch:
+                metrics.observe("server_queue_wait", (started - request.submitted_at) * 1000)
+            try:
+                self.process(batch)
+            except Exception as e:
+                print(f"Recognition error: {e}")
+                for request in batch:
+                    request.error = str(e)
+            metrics.observe("server_batch", (time.perf_counter() - started) * 1000)
+            metrics.set_gauge("server_batch_size", len(batch))
+            self.batches += 1
+            self.processed += len(batch)
+            for request in batch:
+                request.batch_size = len(batch)
+                request.done.set()
+
+    def stop(self):
+        self._running = False
+        self.join(timeout=2)
+
+    def stats(self):
+        return {
+            "gallery_size": len(self.gallery),
+            "queue_depth": self.requests.qsize(),
+            "batches": self.batches,
+            "processed": self.processed,
+            "avg_batch_size": self.processed / self.batches if self.batches else 0.0,
+        }
+
+
+class GallerySyncThread(threading.Thread):
+    """Polls the central database and passes changed identities to the batcher, like the GUI's
+    gallery poll timer"""
+
+    def __init__(self, batcher, interval=None):
+        super().__init__(name="gallery-sync", daemon=True)
+        self.batcher = batcher
+        self.interval = settings.GALLERY_POLL_INTERVAL if interval is None else interval
+        self._stopping = threading.Event()
+
+    def run(self):
+        while not self._stopping.wait(self.interval):
+            changes = sync_changes()
+            if changes is not None:
+                self.batcher.update_identities(*changes)
+
+    def stop(self):
+        self._stopping.set()
+
+
+class RecognitionHandler(BaseHTTPRequestHandler):
+    """POST /recognize?mode=frame|crop with a JPEG/PNG body; GET /health and GET /metrics"""
+
+    # Keep-alive, so a client reuses its connection for every request
+    protocol_version = "HTTP/1.1"
+
+    def _send(self, status, body, content_type="application/json"):
+        data = body.encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload, ensure_ascii=False))
+
+    def do_GET(self):
+        path = urlparse(self.path).path
+        if path == "/health":
+            self._send_json(200, {"status": "ok", **self.server.batcher.stats()})
+        elif path == "/metrics":
+            self._send(200, metrics.to_prometheus(), "text/plain; version=0.0.4")
+        else:
+            self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/recognize":
+            self._send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > settings.SERVER_MAX_IMAGE_BYTES:
+            self.close_connection = True
+            self._send_json(413 if length > 0 else 400, {"error": "image body required"})
+            return
+        body = self.rfile.read(length)
+        mode = parse_qs(url.query).get("mode", ["frame"])[0]
+        if mode not in MODES:
+            self._send_json(400, {"error": f"mode must be one of {', '.join(MODES)}"})
+            return
+
+        started = time.perf_counter()
+        # Decoding runs on the request thread; cv2 releases the GIL, so clients decode in parallel
+        image = decode_image(body)
+        if image is None:
+            self._send_json(400, {"error": "could not decode image"})
+            return
+        request = self.server.batcher.submit(image, mode)
+        if not request.done.wait(REQUEST_TIMEOUT):
+            self._send_json(503, {"error": "recognition timed out"})
+            return
+        if request.error is not None:
+            self._send_json(500, {"error": request.error})
+            return
+        server_ms = (time.perf_counter() - started) * 1000
+        metrics.observe("server_request", server_ms)
+        self._send_json(200, {"faces": request.faces, "batch_size": request.batch_size, "server_ms": server_ms})
+
+    def log_message(self, format, *args):
+        # One line per request would dominate the console under load
+        pass
+
+
+class RecognitionHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 makes a burst of connecting kiosks wait for SYN retries
+    request_queue_size = 128
+
+
+def create_server(gallery, host=None, port=None, tolerance=DEFAULT_TOLERANCE, max_batch=None, wait_ms=None):
+    """HTTP server with its batcher started; call serve_forever(), then shutdown() and batcher.stop()"""
+    batcher = RecognitionBatcher(gallery, tolerance, max_batch, wait_ms)
+    batcher.start()
+    server = RecognitionHTTPServer((host or settings.SERVER_HOST, settings.SERVER_PORT if port is None else port),
+                                   RecognitionHandler)
+    server.batcher = batcher
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless face recognition server for many clients")
+    parser.add_argument("--host", default=settings.SERVER_HOST)
+    parser.add_argument("--port", type=int, default=settings.SERVER_PORT)
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--max-batch", type=int, default=settings.SERVER_MAX_BATCH,
+                        help="images encoded and matched in one pass")
+    parser.add_argument("--wait-ms", type=float, default=settings.SERVER_BATCH_WAIT_MS,
+                        help="longest wait for a batch to fill")
+    args = parser.parse_args()
+
+    # Same start as the kiosk: the local gallery cache, synced when the central database is reachable
+    db = SessionLocal()
+    try:
+        gallery = open_gallery(db)
+    finally:
+        db.close()
+    server = create_server(gallery, args.host, args.port, args.tolerance, args.max_batch, args.wait_ms)
+    sync_thread = None
+    if settings.GALLERY_POLL_INTERVAL > 0:
+        sync_thread = GallerySyncThread(server.batcher)
+        sync_thread.start()
+    print(f"Recognition server on http://{args.host}:{server.server_address[1]}, "
+          f"{len(gallery)} identities, batches of up to {args.max_batch}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if sync_thread is not None:
+            sync_thread.stop()
+        server.batcher.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,252 @@
+import queue
+import threading
+import time
+from typing import NamedTuple, Optional, Tuple
+import numpy as np
+import settings
+from PyQt6.QtCore import QThread, pyqtSignal
+from detection import FaceDetector, crop_face
+from quality import FaceQualityGate
+from tracker import FaceTracker
+from metrics import metrics
+from templates import update_identity
+from unknown_faces import UnknownFace
+
+STATS_INTERVAL = 1.0  # seconds between stats_updated signals
+
+
+class FaceResult(NamedTuple):
+    box: Tuple[int, int, int, int]  # (top, right, bottom, left) in frame coordinates
+    name: Optional[str]
+    distance: float
+    user_id: Optional[int]
+    track_id: int
+    # True when the identity was (re)computed from this frame, False when carried by the tracker
+    encoded: bool
+    # False until the track has been encoded at least once (e.g. while the quality gate rejects it)
+    identified: bool
+
+
+class LatestFrameSlot:
+    """Single-slot queue: put() replaces a frame that was not taken yet and counts it as dropped"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._item = None
+        self._closed = False
+        self.submitted = 0
+        self.dropped = 0
+
+    def put(self, item):
+        """Store item; returns the item it replaced, or None"""
+        with self._cond:
+            replaced = self._item
+            if replaced is not None:
+                self.dropped += 1
+            self._item = item
+            self.submitted += 1
+            self._cond.notify()
+            return replaced
+
+    @property
+    def pending(self):
+        """Frames waiting for the worker (0 or 1)"""
+        return int(self._item is not None)
+
+    def take(self, timeout=None):
+        """Return the newest item, waiting up to timeout; None if closed or timed out"""
+        with self._cond:
+            if self._item is None and not self._closed:
+                self._cond.wait(timeout)
+            item, self._item = self._item, None
+            return item
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._item = None
+            self._cond.notify_all()
+
+
+class FramePool:
+    """Reusable frame buffers, so submitting a frame does not allocate one. A buffer goes
+    back to the pool once the worker has processed or dropped it."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._free = []
+
+    def acquire(self, shape):
+        with self._lock:
+            while self._free:
+                buffer = self._free.pop()
+                if buffer.shape == shape:
+                    return buffer
+        return np.empty(shape, dtype=np.uint8)
+
+    def release(self, buffer):
+        with self._lock:
+            self._free.append(buffer)
+
+
+class RecognitionWorker(QThread):
+    """Runs detection, encoding and matching off the UI thread, always on the newest frame"""
+
+    results_ready = pyqtSignal(list, float)  # list of FaceResult, capture time of the frame
+    stats_updated = pyqtSignal(dict)
+    unknown_faces = pyqtSignal(list)  # list of UnknownFace, freshly encoded faces with no match
+
+    def __init__(self, gallery, tolerance=0.6, detection_interval=None, parent=None):
+        super().__init__(parent)
+        self.gallery = gallery
+        self.tolerance = tolerance
+        self.detection_interval = settings.DETECTION_INTERVAL if detection_interval is None else detection_interval
+        self.detector = FaceDetector()
+        self.quality = FaceQualityGate() if settings.QUALITY_GATE else None
+        self.tracker = FaceTracker()
+        self.last_detection = 0.0
+        self.slot = LatestFrameSlot()
+        self.frame_pool = FramePool()
+        # (identities, removed ids) applied to the gallery on this thread between frames
+        self.gallery_updates = queue.Queue()
+        self._running = True
+        self.processed = 0
+        self.detections = 0
+        self.encodings = 0
+
+    def submit(self, rgb_frame, captured_at):
+        """Hand a frame and its capture time.time() to the worker; the caller must not modify it
+        afterwards. Frames taken from frame_pool are returned to it when no longer needed."""
+        replaced = self.slot.put((rgb_frame, captured_at))
+        if replaced is not None:
+            self.frame_pool.release(replaced[0])
+
+    def set_gallery(self, gallery):
+        self.gallery = gallery
+        # Identities were matched against the old gallery; re-encode every track
+        for track in self.tracker.tracks:
+            track.encoded_at = None
+
+    def update_identities(self, identities, removed=()):
+        """Queue live gallery changes: {user_id: (name, encodings)} to add or replace and user
+        ids to remove. Matching never sees a half-applied update, as both run on this thread."""
+        self.gallery_updates.put((identities, set(removed)))
+
+    def _apply_gallery_updates(self):
+        touched = set()
+        added = False
+        while True:
+            try:
+                identities, removed = self.gallery_updates.get_nowait()
+            except queue.Empty:
+                break
+            for user_id in removed:
+                self.gallery.remove(user_id)
+            for user_id, (name, encodings) in identities.items():
+                self.gallery = update_identity(self.gallery, user_id, name, encodings)
+            touched |= removed | identities.keys()
+            added = added or bool(identities)
+        if not touched:
+            return
+        metrics.incr("gallery_updates", len(touched))
+        # Re-encode faces shown as a changed identity, and unknown faces if someone was added
+        for track in self.tracker.tracks:
+            if track.user_id in touched or (added and track.user_id is None):
+                track.encoded_at = None
+
+    def stop(self):
+        self._running = False
+        self.slot.close()
+        self.wait()
+
+    def process(self, frame):
+        """Detect faces every detection_interval, track them in between and encode only new
+        or re-verified tracks. Returns the FaceResults and the UnknownFaces encoded this frame."""
+        now = time.monotonic()
+        if now - self.last_detection < self.detection_interval:
+            return [self._result(track, now, encoded=False) for track in self.tracker.tracks], []
+
+        self.last_detection = now
+        with metrics.timer("detect"):
+            face_locations = self.detector.detect(frame)
+        self.detections += 1
+        with metrics.timer("track"):
+            to_encode = self.tracker.update(face_locations, now)
+        if to_encode and self.quality is not None:
+            # Faces that fail stay unencoded and are checked again on the next detection pass
+            with metrics.timer("quality"):
+                passed, reasons = self.quality.filter(frame, [track.int_box() for track in to_encode])
+            to_encode = [to_encode[i] for i in passed]
+            metrics.incr("quality_passed", len(passed))
+            for reason in reasons:
+                metrics.incr(f"quality_rejected_{reason}")
+        if to_encode:
+            boxes = [track.int_box() for track in to_encode]
+            with metrics.timer("encode"):
+                face_encodings = self.detector.encode(frame, boxes)
+            self.encodings += len(face_encodings)
+            with metrics.timer("match"):
+                matches = self.gallery.match(face_encodings, tolerance=self.tolerance)
+            for track, match in zip(to_encode, matches):
+                track.set_identity(match, now)
+            # The frame is a pooled buffer, so unknown faces keep a copy of their crop
+            captured_at = time.time()
+            unknown = [UnknownFace(track.id, encoding, crop_face(frame, box)[0].copy(), captured_at)
+                       for track, box, encoding, match in zip(to_encode, boxes, face_encodings, matches)
+                       if not match.is_known]
+        else:
+            unknown = []
+
+        encoded_ids = {track.id for track in to_encode}
+        results = [self._result(track, now, encoded=track.id in encoded_ids) for track in self.tracker.tracks]
+        return results, unknown
+
+    @staticmethod
+    def _result(track, now, encoded):
+        return FaceResult(track.int_box(now), track.name, track.distance, track.user_id, track.id, encoded,
+                          track.identified)
+
+    def run(self):
+        window_start = time.perf_counter()
+        window_processed = 0
+        window_busy = 0.0
+        while self._running:
+            item = self.slot.take(timeout=0.5)
+            self._apply_gallery_updates()
+            if item is not None:
+                frame, captured_at = item
+                started = time.perf_counter()
+                try:
+                    results, unknown = self.process(frame)
+                except Exception as e:
+                    print(f"Recognition error: {e}")
+                    results, unknown = [], []
+                self.frame_pool.release(frame)
+                busy = time.perf_counter() - started
+                metrics.observe("recognition", busy * 1000)
+                window_busy += busy
+                window_processed += 1
+                self.processed += 1
+                metrics.set_gauge("recognition_queue_depth", self.slot.pending)
+                metrics.set_gauge("recognition_dropped_frames", self.slot.dropped)
+                self.results_ready.emit(results, captured_at)
+                if unknown:
+                    self.unknown_faces.emit(unknown)
+
+            elapsed = time.perf_counter() - window_start
+            if elapsed >= STATS_INTERVAL:
+                self.stats_updated.emit({
+                    "fps": window_processed / elapsed,
+                    "latency_ms": window_busy / window_processed * 1000 if window_processed else 0.0,
+                    "processed": self.processed,
+                    "submitted": self.slot.submitted,
+                    "dropped": self.slot.dropped,
+                    "detections": self.detections,
+                    "encodings": self.encodings,
+                    "tracks": len(self.tracker.tracks),
+                    **self.detector.stats(),
+                    **(self.quality.stats() if self.quality is not None else {}),
+                })
+                window_start = time.perf_counter()
+                window_processed = 0
+                window_busy = 0.0
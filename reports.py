@@ -0,0 +1,177 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, delete, exists, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+import settings
+from db_config import engine
+from models import Attendance, AttendanceDaily, User
+from attendance_queries import local_time
+
+REBUILD_BATCH_SIZE = 5000
+
+# Current user name, or the last name stored in the summaries once the user was deleted
+summary_name = func.coalesce(User.name, AttendanceDaily.name)
+
+
+def as_date(day):
+    """date of a date, datetime or 'YYYY-MM-DD' string"""
+    if isinstance(day, str):
+        return datetime.strptime(day, "%Y-%m-%d").date()
+    return day.date() if isinstance(day, datetime) else day
+
+
+def clock_seconds(value):
+    """Seconds since midnight of a time, datetime or 'HH:MM' string"""
+    if isinstance(value, str):
+        value = datetime.strptime(value, "%H:%M").time()
+    return value.hour * 3600 + value.minute * 60 + value.second
+
+
+def summarize(rows):
+    """Daily summary rows of attendance rows (dicts with user_id, name, ts); rows without a
+    user are left out"""
+    summaries = {}
+    for row in rows:
+        if row["user_id"] is None:
+            continue
+        ts = local_time(row["ts"])
+        seconds = clock_seconds(ts)
+        key = (row["user_id"], ts.date())
+        summary = summaries.get(key)
+        if summary is None:
+            summaries[key] = {"user_id": row["user_id"], "day": ts.date(), "name": row["name"],
+                              "first_ts": ts, "last_ts": ts, "first_seconds": seconds,
+                              "last_seconds": seconds, "count": 1}
+            continue
+        if ts < summary["first_ts"]:
+            summary.update(first_ts=ts, first_seconds=seconds)
+        if ts >= summary["last_ts"]:
+            summary.update(last_ts=ts, last_seconds=seconds, name=row["name"])
+        summary["count"] += 1
+    return list(summaries.values())
+
+
+def upsert_daily(db, rows):
+    """Merge attendance rows into the daily summaries in the caller's transaction (db is a
+    Session or a Connection). Returns the number of summary rows touched."""
+    summaries = summarize(rows)
+    if not summaries:
+        return 0
+    bind = db.get_bind() if hasattr(db, "get_bind") else db
+    if bind.dialect.name == "sqlite":
+        insert, smaller, larger = sqlite_insert, func.min, func.max
+    else:
+        insert, smaller, larger = pg_insert, func.least, func.greatest
+    stmt = insert(AttendanceDaily)
+    current = AttendanceDaily.__table__.c
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["user_id", "day"],
+        set_={
+            "name": stmt.excluded.name,
+            "first_ts": smaller(current.first_ts, stmt.excluded.first_ts),
+            "last_ts": larger(current.last_ts, stmt.excluded.last_ts),
+            "first_seconds": smaller(current.first_seconds, stmt.excluded.first_seconds),
+            "last_seconds": larger(current.last_seconds, stmt.excluded.last_seconds),
+            "count": current.count + stmt.excluded.count,
+        },
+    )
+    db.execute(stmt, summaries)
+    return len(summaries)
+
+
+def rebuild_daily_summary(bind=engine, batch_size=REBUILD_BATCH_SIZE, log=print):
+    """Recompute every summary from the attendance table in one transaction. Summaries of
+    days whose raw rows were archived are dropped. Returns the number of summary rows."""
+    with bind.begin() as conn:
+        conn.execute(delete(AttendanceDaily))
+        last_id = 0
+        read = 0
+        while True:
+            rows = [dict(row._mapping) for row in conn.execute(
+                select(Attendance.id, Attendance.user_id, Attendance.name, Attendance.ts)
+                .where(Attendance.id > last_id).order_by(Attendance.id).limit(batch_size)
+            )]
+            if not rows:
+                break
+            upsert_daily(conn, rows)
+            last_id = rows[-1]["id"]
+            read += len(rows)
+            log(f"Обработано записей посещаемости: {read}")
+        return conn.execute(select(func.count()).select_from(AttendanceDaily)).scalar()
+
+
+def delete_summaries(before=None, bind=engine):
+    """Drop summaries of days before a local date, or all of them when before is None"""
+    stmt = delete(AttendanceDaily)
+    if before:
+        stmt = stmt.where(AttendanceDaily.day < as_date(before))
+    with bind.begin() as conn:
+        return conn.execute(stmt).rowcount
+
+
+def range_report(db, date_from, date_to):
+    """Per user over an inclusive date range: days present, visits, hours on site (last-out
+    minus first-in, summed over days) and the average first-in time in seconds"""
+    stmt = (
+        select(
+            AttendanceDaily.user_id,
+            func.max(summary_name).label("name"),
+            func.count().label("days"),
+            func.sum(AttendanceDaily.count).label("visits"),
+            func.sum(AttendanceDaily.last_seconds - AttendanceDaily.first_seconds).label("seconds"),
+            func.avg(AttendanceDaily.first_seconds).label("avg_first_seconds"),
+        )
+        .outerjoin(User, User.id == AttendanceDaily.user_id)
+        .where(AttendanceDaily.day.between(as_date(date_from), as_date(date_to)))
+        .group_by(AttendanceDaily.user_id)
+        .order_by(func.max(summary_name))
+    )
+    return db.execute(stmt).all()
+
+
+def late_arrivals(db, date_from, date_to, start=None):
+    """Days in the range whose first-in is after start ('HH:MM', default the configured
+    work day start), with the delay in seconds; served by the (day, first_seconds) index"""
+    start_seconds = clock_seconds(start or settings.REPORT_WORKDAY_START)
+    stmt = (
+        select(
+            AttendanceDaily.day,
+            AttendanceDaily.user_id,
+            summary_name.label("name"),
+            AttendanceDaily.first_ts,
+            (AttendanceDaily.first_seconds - start_seconds).label("late_seconds"),
+        )
+        .outerjoin(User, User.id == AttendanceDaily.user_id)
+        .where(AttendanceDaily.day.between(as_date(date_from), as_date(date_to)),
+               AttendanceDaily.first_seconds > start_seconds)
+        .order_by(AttendanceDaily.day, AttendanceDaily.first_seconds)
+    )
+    return db.execute(stmt).all()
+
+
+def absentees(db, date_from, date_to=None):
+    """Current users with no attendance in the inclusive range, with the last day they were
+    present before it (None if never)"""
+    date_from = as_date(date_from)
+    date_to = as_date(date_to) if date_to else date_from
+    present = exists().where(
+        and_(AttendanceDaily.user_id == User.id, AttendanceDaily.day.between(date_from, date_to))
+    )
+    last_day = (
+        select(func.max(AttendanceDaily.day))
+        .where(AttendanceDaily.user_id == User.id, AttendanceDaily.day < date_from)
+        .scalar_subquery()
+    )
+    stmt = select(User.id, User.name, last_day.label("last_day")).where(~present).order_by(User.name, User.id)
+    return db.execute(stmt).all()
+
+
+def format_duration(seconds):
+    """'H:MM' of a number of seconds"""
+    minutes = int(round(seconds or 0)) // 60
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+
+def format_clock(seconds):
+    """'HH:MM' of seconds since midnight"""
+    return (datetime.min + timedelta(seconds=int(round(seconds)))).strftime("%H:%M")
@@ -0,0 +1,151 @@
+from typing import List
+import numpy as np
+import settings
+from gallery import DEFAULT_TOLERANCE, ENCODING_DIM, Match, create_index
+
+
+class TemplateIndex:
+    """Identities with several enrollment encodings (templates).
+
+    Each identity is summarised by the centroid of its templates and their spread (largest
+    template distance from the centroid). A face is first searched against the centroids
+    only, with the same matcher as single-template galleries, and just the `candidates`
+    nearest identities are re-scored against their full template sets. Per-frame cost
+    therefore grows with the number of identities, not with the number of photos.
+    """
+
+    def __init__(self, ids, names, encodings, template_ids=(), template_encodings=None, candidates=None):
+        self.ids = list(ids)
+        self.names = list(names)
+        self.candidates = candidates or settings.TEMPLATE_CANDIDATES
+        self.slot = slot = {user_id: i for i, user_id in enumerate(self.ids)}
+
+        # Templates of every identity as one contiguous slice, the primary encoding first
+        encodings = np.asarray(encodings, dtype=np.float32).reshape(len(self.ids), ENCODING_DIM)
+        template_encodings = np.asarray(
+            template_encodings if template_encodings is not None else np.empty((0, ENCODING_DIM)),
+            dtype=np.float32,
+        ).reshape(-1, ENCODING_DIM)
+        owners = np.array([slot.get(user_id, -1) for user_id in template_ids], dtype=np.int64)
+        known = owners >= 0  # templates of users without a usable primary encoding are ignored
+        owners = np.concatenate([np.arange(len(self.ids)), owners[known]])
+        order = np.argsort(owners, kind="stable")
+        self.templates = np.ascontiguousarray(np.concatenate([encodings, template_encodings[known]])[order])
+        counts = np.bincount(owners, minlength=len(self.ids))
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+
+        sums = np.add.reduceat(self.templates, self.offsets[:-1], axis=0) if len(self.ids) else encodings
+        self.centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+        owner_rows = np.repeat(np.arange(len(self.ids)), counts)
+        deviation = np.linalg.norm(self.templates - self.centroids[owner_rows], axis=1)
+        self.spread = np.zeros(len(self.ids), dtype=np.float32)
+        np.maximum.at(self.spread, owner_rows, deviation)
+
+        # The first pass indexes slots, so its rows can move on live updates
+        self.first_pass = create_index(list(range(len(self.ids))), self.names, self.centroids)
+        # Template sets of identities changed after the build, by slot
+        self.changed = {}
+
+    def __len__(self):
+        return len(self.slot)
+
+    @property
+    def template_count(self):
+        return sum(len(self._templates(s)) for s in self.slot.values())
+
+    def _templates(self, s):
+        rows = self.changed.get(s)
+        return rows if rows is not None else self.templates[self.offsets[s]:self.offsets[s + 1]]
+
+    def add(self, user_id, name, encodings):
+        """Insert or replace an identity with all of its encodings, primary first"""
+        encodings = np.ascontiguousarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        s = self.slot.get(user_id)
+        if s is None:
+            s = self.slot[user_id] = len(self.ids)
+            self.ids.append(user_id)
+            self.names.append(name)
+            if s == len(self.spread):
+                self.spread = np.resize(self.spread, max(16, 2 * len(self.spread)))
+        self.names[s] = name
+        self.changed[s] = encodings
+        centroid = encodings.mean(axis=0)
+        self.spread[s] = np.max(np.linalg.norm(encodings - centroid, axis=1))
+        self.first_pass.add(s, name, centroid)
+
+    def remove(self, user_id):
+        """Drop an identity; its slot stays unused until the next full load"""
+        s = self.slot.pop(user_id, None)
+        if s is None:
+            return False
+        self.first_pass.remove(s)
+        self.changed.pop(s, None)
+        self.ids[s] = self.names[s] = None
+        return True
+
+    def _rescore(self, query, slots, centroid_distances, k):
+        """(slot, distance) of the candidates' nearest templates, nearest first.
+
+        A template is never closer than (centroid distance - spread), so candidates whose
+        bound already exceeds the current k-th best distance are not re-scored.
+        """
+        bounds = centroid_distances - self.spread[slots]
+        scored = []
+        for i in np.argsort(bounds):
+            if len(scored) >= k and bounds[i] > scored[k - 1][1]:
+                break
+            s = slots[i]
+            rows = self._templates(s)
+            scored.append((s, float(np.sqrt(np.min(np.sum((rows - query) ** 2, axis=1))))))
+            scored.sort(key=lambda item: item[1])
+        return scored
+
+    def match(self, face_encodings, tolerance=DEFAULT_TOLERANCE, k=1) -> List[Match]:
+        """Same contract as GalleryIndex.match, with distances to each identity's nearest template"""
+        if len(face_encodings) == 0:
+            return []
+        queries = np.asarray(face_encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+        k = max(k, 1)
+        indices, distances = self.first_pass.search(queries, k=max(self.candidates, k))
+        results = []
+        for query, row_idx, row_dist in zip(queries, indices, distances):
+            valid = row_idx >= 0
+            slots = np.array([self.first_pass.ids[i] for i in row_idx[valid]], dtype=np.int64)
+            scored = self._rescore(query, slots, row_dist[valid], k)
+            candidates = [(self.ids[s], self.names[s], d) for s, d in scored[:k]]
+            if candidates and candidates[0][2] <= tolerance:
+                user_id, name, distance = candidates[0]
+            else:
+                user_id, name = None, None
+                distance = candidates[0][2] if candidates else float("inf")
+            results.append(Match(user_id, name, distance, candidates))
+        return results
+
+
+def create_gallery(ids, names, encodings, template_ids=(), template_encodings=None):
+    """The plain matcher when every identity has one encoding, a TemplateIndex otherwise"""
+    if len(template_ids) == 0:
+        return create_index(ids, names, encodings)
+    return TemplateIndex(ids, names, encodings, template_ids, template_encodings)
+
+
+def update_identity(gallery, user_id, name, encodings):
+    """Add or replace one identity in a live matcher. A plain index is switched to a
+    TemplateIndex the first time an identity has more than one encoding. Returns the matcher."""
+    encodings = np.asarray(encodings, dtype=np.float32).reshape(-1, ENCODING_DIM)
+    if isinstance(gallery, TemplateIndex):
+        gallery.add(user_id, name, encodings)
+    elif len(encodings) == 1:
+        gallery.add(user_id, name, encodings[0])
+    else:
+        live = [row for row, other in enumerate(gallery.ids) if other is not None]
+        gallery = TemplateIndex([gallery.ids[row] for row in live], [gallery.names[row] for row in live],
+                                gallery.encodings[live])
+        gallery.add(user_id, name, encodings)
+    return gallery
+
+
+def load_index(db):
+    """Matcher over every stored encoding, primary photos and additional templates"""
+    from embeddings import load_gallery, load_templates
+    return create_gallery(*load_gallery(db), *load_templates(db))
@@ -0,0 +1,51 @@
+import numpy as np
+from ann_index import IVFIndex, synthetic_gallery, synthetic_queries
+from gallery import GalleryIndex
+
+SIZE = 3000
+
+
+def _indexes():
+    vectors = synthetic_gallery(SIZE)
+    ids = list(range(SIZE))
+    names = [str(i) for i in ids]
+    return vectors, GalleryIndex(ids, names, vectors), IVFIndex(ids, names, vectors, nlist=32, nprobe=4)
+
+
+def _nearest_ids(index, queries, **kwargs):
+    indices, _ = index.search(queries, k=1, **kwargs)
+    return np.where(indices[:, 0] >= 0, np.asarray(index.ids, dtype=object)[indices[:, 0]], None)
+
+
+def test_recall_against_brute_force():
+    vectors, exact, ivf = _indexes()
+    queries = synthetic_queries(vectors, 300)
+    truth = _nearest_ids(exact, queries)
+
+    assert np.mean(_nearest_ids(ivf, queries) == truth) >= 0.95
+    # Probing every list is exact search
+    assert np.array_equal(_nearest_ids(ivf, queries, nprobe=ivf.nlist), truth)
+    indices, distances = ivf.search(queries, k=5, nprobe=ivf.nlist)
+    assert np.allclose(distances, exact.search(queries, k=5)[1], atol=1e-4)
+
+
+def test_removed_rows_leave_holes_that_are_never_returned():
+    vectors, exact, ivf = _indexes()
+    removed = list(range(0, SIZE, 3))
+    for user_id in removed:
+        assert ivf.remove(user_id)
+        exact.remove(user_id)
+    assert not ivf.remove(removed[0])
+    assert len(ivf) == len(exact) == SIZE - len(removed)
+
+    # Queries aimed at removed identities fall through to the remaining ones
+    queries = vectors[removed[:200]]
+    found = _nearest_ids(ivf, queries, nprobe=ivf.nlist)
+    assert not set(found) & set(removed)
+    assert not set(_nearest_ids(ivf, queries)) & set(removed)
+    assert np.array_equal(found, _nearest_ids(exact, queries))
+
+    # A re-added identity lives in the unclustered tail and is still found
+    ivf.add(removed[0], "back", vectors[removed[0]])
+    (match,) = ivf.match(vectors[removed[0]][None, :])
+    assert (match.user_id, match.name) == (removed[0], "back")
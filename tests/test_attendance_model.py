@@ -0,0 +1,22 @@
+import random
+from datetime import datetime, timedelta
+import pytest
+from attendance_model import AttendanceTableModel
+
+
+@pytest.mark.parametrize("column", [0, 1, 2])
+@pytest.mark.parametrize("descending", [False, True])
+def test_appended_records_keep_the_sort_order(column, descending):
+    rng = random.Random(column)
+    start = datetime(2026, 10, 1, 9, 0).astimezone()
+    records = [{"id": i, "name": rng.choice("АБВГ"), "ts": start + timedelta(minutes=rng.randrange(60))}
+               for i in range(1, 41)]
+    model = AttendanceTableModel(db=None)
+    model.sort_column, model.descending, model.has_more = column, descending, False
+    model.rows = sorted(((r["id"], r["name"], r["ts"]) for r in records[:20]), key=model._sort_key,
+                        reverse=descending)
+
+    model.append_records(records[20:])
+
+    expected = sorted(((r["id"], r["name"], r["ts"]) for r in records), key=model._sort_key, reverse=descending)
+    assert model.rows == expected
@@ -0,0 +1,28 @@
+import json
+from datetime import datetime
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.orm import sessionmaker
+from attendance_writer import AttendanceWriter
+from db_config import Base
+from models import Attendance
+
+
+def test_truncated_spool_line_does_not_stop_the_writer(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'faceid.db'}")
+    Base.metadata.create_all(engine)
+    spool = tmp_path / "spool.jsonl"
+    good = json.dumps({"user_id": None, "name": "Анна", "ts": datetime(2026, 10, 1, 9, 0).astimezone().isoformat()})
+    # Power lost while the second event was being appended
+    spool.write_text(good + "\n" + '{"user_id": null, "name": "Бор', encoding="utf-8")
+
+    writer = AttendanceWriter(session_factory=sessionmaker(bind=engine), spool_path=str(spool),
+                              flush_interval=0.05)
+    writer.start()
+    writer.submit(None, "Вера")
+    writer.stop()
+
+    with engine.connect() as conn:
+        assert conn.execute(select(func.count()).select_from(Attendance)).scalar() == 2
+    assert writer.pending == 0
+    assert not spool.exists()
+    assert (tmp_path / "spool.jsonl.bad").read_text(encoding="utf-8") == '{"user_id": null, "name": "Бор\n'
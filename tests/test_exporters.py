@@ -0,0 +1,21 @@
+from datetime import datetime
+import pytest
+from exporters import PdfExporter, find_pdf_font
+
+
+def test_pdf_keeps_cyrillic_names(tmp_path):
+    try:
+        find_pdf_font()
+    except FileNotFoundError:
+        pytest.skip("no TrueType font with Cyrillic installed")
+    path = tmp_path / "attendance.pdf"
+    exporter = PdfExporter(str(path))
+    exporter.write([(1, "Анна", datetime(2026, 10, 1, 9, 0).astimezone())])
+    exporter.close()
+
+    data = path.read_bytes()
+    assert data.startswith(b"%PDF-1.4") and data.rstrip().endswith(b"%%EOF")
+    assert b"/FontFile2" in data and b"/Identity-H" in data
+    # The ToUnicode map lets viewers copy and search the names as written
+    for char in "АннаИмя":
+        assert char.encode("utf-16-be").hex().upper().encode() in data
@@ -0,0 +1,66 @@
+import numpy as np
+import gallery
+from gallery import GalleryIndex
+
+
+def _gallery(size, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(scale=0.1, size=(size, 128)).astype(np.float32)
+
+
+def _brute_force(encodings, queries, k):
+    distances = np.linalg.norm(queries[:, None, :] - encodings[None, :, :], axis=2)
+    order = np.argsort(distances, axis=1)[:, :k]
+    return order, np.take_along_axis(distances, order, axis=1)
+
+
+def test_search_matches_brute_force_across_blocks(monkeypatch):
+    monkeypatch.setattr(gallery, "SEARCH_BLOCK_SIZE", 7)
+    encodings = _gallery(50)
+    queries = _gallery(6, seed=1)
+    index = GalleryIndex(range(50), [str(i) for i in range(50)], encodings)
+
+    indices, distances = index.search(queries, k=5)
+
+    expected_idx, expected_dist = _brute_force(encodings, queries, 5)
+    assert np.array_equal(indices, expected_idx)
+    assert np.allclose(distances, expected_dist, atol=1e-4)
+
+
+def test_match_applies_the_tolerance():
+    encodings = _gallery(3)
+    index = GalleryIndex([10, 20, 30], ["a", "b", "c"], encodings)
+    offset = np.zeros(128, dtype=np.float32)
+    offset[0] = 0.8
+    near, far = index.match(np.stack([encodings[1] + 0.001, encodings[1] + offset]), tolerance=0.6, k=2)
+
+    assert (near.user_id, near.name) == (20, "b") and near.is_known
+    assert near.candidates[0][0] == 20 and len(near.candidates) == 2
+    assert far.user_id is None and np.isclose(far.distance, 0.8) and far.candidates[0][0] == 20
+    (empty,) = GalleryIndex([], [], np.empty((0, 128))).match(encodings[:1])
+    assert empty.user_id is None and empty.distance == float("inf") and empty.candidates == []
+
+
+def test_add_and_remove_keep_rows_consistent():
+    encodings = _gallery(20)
+    original = encodings.copy()
+    index = GalleryIndex(range(20), [str(i) for i in range(20)], encodings)
+
+    assert index.remove(5) and not index.remove(5)
+    replacement = _gallery(1, seed=2)[0]
+    index.add(7, "seven", replacement)
+    extra = _gallery(30, seed=3)
+    for i, encoding in enumerate(extra):
+        index.add(100 + i, f"new{i}", encoding)
+
+    assert len(index) == 49 and 5 not in index.ids
+    assert np.array_equal(encodings, original)  # the caller's matrix is never written
+    # Every row still holds its own identity's encoding and norm
+    expected = {i: original[i] for i in range(20) if i != 5}
+    expected[7] = replacement
+    expected.update({100 + i: encoding for i, encoding in enumerate(extra)})
+    for row, user_id in enumerate(index.ids):
+        assert np.array_equal(index.encodings[row], expected[user_id])
+        assert np.isclose(index.sq_norms[row], expected[user_id] @ expected[user_id], rtol=1e-5)
+    (match,) = index.match(replacement[None, :])
+    assert (match.user_id, match.name) == (7, "seven")
@@ -0,0 +1,66 @@
+import numpy as np
+from sqlalchemy import create_engine, event, func, select, update
+from sqlalchemy.orm import sessionmaker
+import gallery_cache
+from db_config import Base
+from gallery_cache import cache_engine, cached_user_count, cached_users, sync
+from models import User
+
+
+def _central(tmp_path, count):
+    engine = create_engine(f"sqlite:///{tmp_path / 'faceid.db'}")
+    Base.metadata.create_all(engine)
+    session = sessionmaker(bind=engine)()
+    rng = np.random.default_rng(0)
+    session.add_all(User(name=f"user{i}", photo=b"jpeg", encoding=rng.normal(size=128).astype("<f4").tobytes(),
+                         encoding_model="test") for i in range(count))
+    session.commit()
+    session.close()
+    return engine
+
+
+def test_rows_sharing_one_timestamp_are_all_synced(tmp_path, monkeypatch):
+    monkeypatch.setattr(gallery_cache, "SYNC_BATCH_SIZE", 5)
+    central = _central(tmp_path, 12)
+    # What upgrade() does to rows that existed before updated_at: one CURRENT_TIMESTAMP for all
+    with central.begin() as conn:
+        conn.execute(update(User).values(updated_at=func.now()))
+    cache = cache_engine(tmp_path / "cache.db")
+
+    result = sync(central, cache)
+    assert len(result.changed) == 12
+    assert cached_user_count(cache) == 12
+
+    # Nothing changed since: the next poll reports nothing
+    assert sync(central, cache) == (set(), set())
+
+
+def test_changes_and_deletions_reach_the_cache(tmp_path):
+    central = _central(tmp_path, 3)
+    cache = cache_engine(tmp_path / "cache.db")
+    sync(central, cache)
+
+    with central.begin() as conn:
+        first, second, third = conn.execute(select(User.id).order_by(User.id)).scalars()
+        conn.execute(update(User).where(User.id == first).values(name="renamed"))
+        conn.execute(User.__table__.delete().where(User.id == third))
+
+    result = sync(central, cache)
+    assert result.changed == {first}
+    assert result.removed == {third}
+    with cache.connect() as conn:
+        assert dict(conn.execute(select(cached_users.c.id, cached_users.c.name)).all()) == {
+            first: "renamed", second: "user1"}
+
+
+def test_poll_without_deletions_does_not_fetch_central_ids(tmp_path):
+    central = _central(tmp_path, 3)
+    cache = cache_engine(tmp_path / "cache.db")
+    sync(central, cache)
+
+    statements = []
+    event.listen(central, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+    sync(central, cache)
+    id_scans = [statement for statement in statements
+                if statement.split("FROM")[0].strip() in ("SELECT users.id", "SELECT user_embeddings.id")]
+    assert statements and not id_scans
@@ -0,0 +1,49 @@
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, insert, inspect, select
+from db_config import Base
+from maintenance import archive, archive_table, purge, renumber_ids
+from models import Attendance
+
+
+def _database(tmp_path, rows):
+    engine = create_engine(f"sqlite:///{tmp_path / 'faceid.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(Attendance), [{"id": row_id, "name": name, "ts": ts} for row_id, name, ts in rows])
+    return engine
+
+
+def _rows(engine):
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute(select(Attendance.id, Attendance.name).order_by(Attendance.id))]
+
+
+def test_renumber_ids_keeps_the_order_and_continues_after_the_last_id(tmp_path):
+    ts = datetime(2026, 10, 1, 9, 0).astimezone()
+    engine = _database(tmp_path, [(3, "a", ts), (7, "b", ts), (8, "c", ts), (20, "d", ts)])
+
+    assert renumber_ids(engine, log=lambda message: None) == 4
+    assert _rows(engine) == [(1, "a"), (2, "b"), (3, "c"), (4, "d")]
+    with engine.begin() as conn:
+        conn.execute(insert(Attendance).values(name="e", ts=ts))
+    assert _rows(engine)[-1] == (5, "e")
+
+
+def test_archive_and_purge_move_rows_in_chunks(tmp_path):
+    now = datetime.now().astimezone()
+    old = (now.replace(day=1) - timedelta(days=100)).replace(day=10)
+    rows = [(i, f"old{i}", old + timedelta(minutes=i)) for i in range(1, 8)]
+    rows += [(100 + i, f"new{i}", now - timedelta(minutes=i)) for i in range(3)]
+    engine = _database(tmp_path, rows)
+    log = []
+
+    assert archive(months=1, chunk_size=3, bind=engine, log=log.append) == 7
+    assert [row_id for row_id, _ in _rows(engine)] == [100, 101, 102]
+    table = archive_table(old.year, old.month)
+    assert inspect(engine).has_table(table.name)
+    with engine.connect() as conn:
+        assert [row.id for row in conn.execute(select(table.c.id).order_by(table.c.id))] == list(range(1, 8))
+    assert len(log) == 3  # one transaction per chunk of 3 rows
+
+    assert purge(chunk_size=2, bind=engine, log=lambda message: None) == 3
+    assert _rows(engine) == []
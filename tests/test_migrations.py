@@ -0,0 +1,29 @@
+from sqlalchemy import create_engine, inspect, text
+from migrations import upgrade
+from models import User
+
+
+def test_legacy_attendance_is_converted_and_bad_rows_are_kept_aside(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'faceid.db'}")
+    User.__table__.create(engine)
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE attendance (id INTEGER PRIMARY KEY, name VARCHAR, date VARCHAR, time VARCHAR)"))
+        conn.execute(text("CREATE INDEX ix_attendance_id ON attendance (id)"))
+        conn.execute(text("INSERT INTO users (id, name, photo) VALUES (1, 'Анна', x'00')"))
+        conn.execute(text("INSERT INTO attendance (id, name, date, time) VALUES "
+                          "(1, 'Анна', '2024-03-01', '09:00:00'), "
+                          "(2, 'Гость', '2024-03-01', '09:05:00'), "
+                          "(3, 'Анна', '01.03.2024', '9:10')"))
+
+    upgrade(engine)
+
+    with engine.connect() as conn:
+        rows = conn.execute(text("SELECT id, user_id, name FROM attendance ORDER BY id")).all()
+        invalid = conn.execute(text("SELECT id, date, time FROM attendance_invalid")).all()
+    assert [tuple(row) for row in rows] == [(1, 1, "Анна"), (2, None, "Гость")]
+    assert [tuple(row) for row in invalid] == [(3, "01.03.2024", "9:10")]
+
+    columns = {column["name"]: column for column in inspect(engine).get_columns("attendance")}
+    assert "date" not in columns and "time" not in columns
+    assert not columns["ts"]["nullable"]
+    assert inspect(engine).get_foreign_keys("attendance")[0]["referred_table"] == "users"
@@ -0,0 +1,25 @@
+from datetime import datetime
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import sessionmaker
+from db_config import Base
+from models import Attendance, User, UserEmbedding
+
+
+def test_deleting_a_user_removes_templates_and_keeps_attendance(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'faceid.db'}")
+    Base.metadata.create_all(engine)
+    db = sessionmaker(bind=engine)()
+    user = User(name="Анна", photo=b"jpeg")
+    db.add(user)
+    db.flush()
+    db.add_all([UserEmbedding(user_id=user.id, photo=b"jpeg"),
+                Attendance(user_id=user.id, ts=datetime(2026, 10, 1, 9, 0).astimezone(), name="Анна")])
+    db.commit()
+
+    # Same query as the Users tab's delete button
+    db.query(User).filter(User.id == user.id).delete()
+    db.commit()
+
+    assert db.execute(select(UserEmbedding)).all() == []
+    assert db.execute(select(Attendance.user_id, Attendance.name)).all() == [(None, "Анна")]
+    db.close()
@@ -0,0 +1,69 @@
+import random
+from datetime import date, datetime, timedelta
+from sqlalchemy import create_engine, insert, select
+from db_config import Base
+from models import Attendance, AttendanceDaily, User
+from reports import absentees, late_arrivals, range_report, rebuild_daily_summary, upsert_daily
+
+SUMMARY_COLUMNS = [AttendanceDaily.user_id, AttendanceDaily.day, AttendanceDaily.name, AttendanceDaily.first_seconds,
+                   AttendanceDaily.last_seconds, AttendanceDaily.count]
+
+
+def _database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'faceid.db'}")
+    Base.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(User), [{"id": 1, "name": "Анна", "photo": b"x"}, {"id": 2, "name": "Борис", "photo": b"x"},
+                                    {"id": 3, "name": "Вера", "photo": b"x"}])
+    return engine
+
+
+def _summaries(conn):
+    return [tuple(row) for row in conn.execute(
+        select(*SUMMARY_COLUMNS).order_by(AttendanceDaily.user_id, AttendanceDaily.day))]
+
+
+def test_incremental_upserts_equal_a_full_rebuild(tmp_path):
+    engine = _database(tmp_path)
+    rng = random.Random(0)
+    rows = [{"id": i, "user_id": rng.choice([1, 2, None]), "name": "x",
+             "ts": datetime(2026, 10, rng.randint(1, 5), rng.randint(7, 19), rng.randrange(60)).astimezone()}
+            for i in range(1, 301)]
+    for row in rows:
+        row["name"] = {1: "Анна", 2: "Борис", None: "Неизвестный"}[row["user_id"]]
+
+    # The writer upserts each flushed batch; batches arrive in any time order
+    with engine.begin() as conn:
+        conn.execute(insert(Attendance), rows)
+        for start in range(0, len(rows), 37):
+            upsert_daily(conn, rows[start:start + 37])
+        incremental = _summaries(conn)
+
+    rebuild_daily_summary(engine, batch_size=50, log=lambda message: None)
+    with engine.connect() as conn:
+        assert _summaries(conn) == incremental
+    assert {user_id for user_id, *_ in incremental} == {1, 2}  # unknown faces have no summary
+    assert sum(count for *_, count in incremental) == sum(row["user_id"] is not None for row in rows)
+
+
+def test_reports_read_the_summaries(tmp_path):
+    engine = _database(tmp_path)
+    events = [(1, datetime(2026, 10, 1, 8, 50)), (1, datetime(2026, 10, 1, 17, 20)),
+              (2, datetime(2026, 10, 1, 9, 40)), (2, datetime(2026, 10, 2, 8, 30)),
+              (2, datetime(2026, 10, 2, 12, 30))]
+    rows = [{"id": i, "user_id": user_id, "name": "", "ts": ts.astimezone()}
+            for i, (user_id, ts) in enumerate(events, 1)]
+    with engine.begin() as conn:
+        upsert_daily(conn, rows)
+
+    with engine.connect() as conn:
+        report = {row.user_id: row for row in range_report(conn, "2026-10-01", "2026-10-31")}
+        assert (report[1].days, report[1].visits, report[1].seconds) == (1, 2, 8 * 3600 + 30 * 60)
+        assert (report[2].days, report[2].visits, report[2].seconds) == (2, 3, 4 * 3600)
+        assert report[1].name == "Анна"  # the current name, not the one stored with the event
+
+        late = late_arrivals(conn, "2026-10-01", "2026-10-02", start="09:00")
+        assert [(row.day, row.user_id, row.late_seconds) for row in late] == [(date(2026, 10, 1), 2, 40 * 60)]
+
+        assert [(row.id, row.last_day) for row in absentees(conn, "2026-10-02")] == [
+            (1, date(2026, 10, 1)), (3, None)]
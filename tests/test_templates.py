@@ -0,0 +1,59 @@
+import numpy as np
+from gallery import GalleryIndex
+from templates import TemplateIndex, update_identity
+
+IDENTITIES = 60
+
+
+def _templates(seed=0):
+    """Several photos per identity, a few identities with just the primary one"""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(scale=0.08, size=(IDENTITIES, 128)).astype(np.float32)
+    primary = centers + rng.normal(scale=0.03, size=centers.shape).astype(np.float32)
+    owners = np.repeat(np.arange(IDENTITIES), rng.integers(0, 5, size=IDENTITIES))
+    extra = centers[owners] + rng.normal(scale=0.03, size=(len(owners), 128)).astype(np.float32)
+    return primary, owners, extra
+
+
+def _nearest_templates(primary, owners, extra, query):
+    """Brute force: (user_id, distance) of every identity's nearest template, nearest first"""
+    best = {user_id: float(np.linalg.norm(primary[user_id] - query)) for user_id in range(IDENTITIES)}
+    for user_id, encoding in zip(owners, extra):
+        best[user_id] = min(best[user_id], float(np.linalg.norm(encoding - query)))
+    return sorted(best.items(), key=lambda item: item[1])
+
+
+def test_spread_covers_every_template():
+    primary, owners, extra = _templates()
+    index = TemplateIndex(range(IDENTITIES), [str(i) for i in range(IDENTITIES)], primary, owners, extra)
+    for s in range(IDENTITIES):
+        rows = index._templates(s)
+        assert len(rows) == 1 + np.sum(owners == s)
+        assert np.all(np.linalg.norm(rows - index.centroids[s], axis=1) <= index.spread[s] + 1e-6)
+
+
+def test_pruned_rescoring_matches_brute_force():
+    primary, owners, extra = _templates()
+    # Every identity is a candidate, so only the spread bound decides what is re-scored
+    index = TemplateIndex(range(IDENTITIES), [str(i) for i in range(IDENTITIES)], primary, owners, extra,
+                          candidates=IDENTITIES)
+    queries = extra[:40] + np.random.default_rng(1).normal(scale=0.02, size=(40, 128)).astype(np.float32)
+    for query, match in zip(queries, index.match(queries, tolerance=10.0, k=3)):
+        expected = _nearest_templates(primary, owners, extra, query)[:3]
+        assert [user_id for user_id, _, _ in match.candidates] == [user_id for user_id, _ in expected]
+        assert np.allclose([d for _, _, d in match.candidates], [d for _, d in expected], atol=1e-4)
+
+
+def test_live_updates_switch_to_templates_and_remove():
+    primary, owners, extra = _templates()
+    gallery = GalleryIndex(range(IDENTITIES), [str(i) for i in range(IDENTITIES)], primary)
+    # A returning visitor enrolled again under a new id, with the extra photos of an existing identity
+    photos = extra[owners == owners[0]]
+    gallery = update_identity(gallery, 999, "new", photos)
+    assert isinstance(gallery, TemplateIndex)
+
+    (match,) = gallery.match(photos[:1], tolerance=0.01)
+    assert (match.user_id, match.name) == (999, "new") and match.distance < 1e-4
+    assert gallery.remove(999) and not gallery.remove(999)
+    (match,) = gallery.match(photos[:1], k=2)
+    assert 999 not in [user_id for user_id, _, _ in match.candidates]
@@ -0,0 +1,19 @@
+from gallery import Match
+from tracker import FaceTracker
+
+
+def test_zero_reverify_interval_encodes_every_detection():
+    tracker = FaceTracker(reverify_interval=0)
+    box = (10, 60, 60, 10)
+    (track,) = tracker.update([box], now=0.0)
+    track.set_identity(Match(1, "Анна", 0.3, []), now=0.0)
+    assert tracker.update([box], now=0.1) == [track]
+
+
+def test_track_keeps_its_identity_until_reverified():
+    tracker = FaceTracker(reverify_interval=1.0)
+    (track,) = tracker.update([(10, 60, 60, 10)], now=0.0)
+    track.set_identity(Match(1, "Анна", 0.3, []), now=0.0)
+    assert tracker.update([(12, 62, 62, 12)], now=0.5) == []
+    assert tracker.tracks == [track] and track.name == "Анна"
+    assert tracker.update([(12, 62, 62, 12)], now=1.0) == [track]
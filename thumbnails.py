@@ -0,0 +1,72 @@
+import cv2
+import numpy as np
+from sqlalchemy import select, update
+from db_config import SessionLocal
+from models import User
+
+# Longest side of a stored thumbnail; the Users tab shows 50x50 icons, this leaves room for HiDPI
+THUMBNAIL_SIZE = 96
+THUMBNAIL_QUALITY = 85
+BACKFILL_BATCH_SIZE = 50
+
+
+def make_thumbnail(photo, size=THUMBNAIL_SIZE):
+    """JPEG bytes of the photo scaled down to fit size x size, or None if it cannot be decoded"""
+    image = cv2.imdecode(np.frombuffer(photo, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return None
+    height, width = image.shape[:2]
+    scale = size / max(height, width)
+    if scale < 1.0:
+        image = cv2.resize(image, (max(1, int(width * scale)), max(1, int(height * scale))),
+                           interpolation=cv2.INTER_AREA)
+    ok, data = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    return data.tobytes() if ok else None
+
+
+def load_thumbnails(db, user_ids):
+    """{user_id: thumbnail bytes} for the given users.
+
+    Users enrolled before thumbnails existed get one made from their photo and stored,
+    so the full photo is read at most once per user.
+    """
+    rows = db.execute(select(User.id, User.thumbnail).where(User.id.in_(user_ids))).all()
+    thumbnails = {row.id: row.thumbnail for row in rows if row.thumbnail}
+    missing = [row.id for row in rows if not row.thumbnail]
+    if missing:
+        for user_id, photo in db.execute(select(User.id, User.photo).where(User.id.in_(missing))):
+            thumbnail = make_thumbnail(photo)
+            if thumbnail:
+                db.execute(update(User).where(User.id == user_id).values(thumbnail=thumbnail))
+                thumbnails[user_id] = thumbnail
+        db.commit()
+    return thumbnails
+
+
+def backfill():
+    """Make thumbnails for every user that has none, in small batches"""
+    db = SessionLocal()
+    try:
+        last_id = 0
+        made = 0
+        while True:
+            ids = db.execute(
+                select(User.id)
+                .where(User.id > last_id, User.thumbnail.is_(None))
+                .order_by(User.id)
+                .limit(BACKFILL_BATCH_SIZE)
+            ).scalars().all()
+            if not ids:
+                break
+            made += len(load_thumbnails(db, ids))
+            last_id = ids[-1]
+            print(f"Создано миниатюр: {made}")
+        return made
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    from migrations import upgrade
+    upgrade()
+    print(f"Готово: создано миниатюр {backfill()}")
@@ -0,0 +1,113 @@
+import itertools
+import numpy as np
+import settings
+
+# Boxes are extrapolated at most this many seconds past their last detection
+MAX_PREDICTION = 0.5
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Pairwise IoU of (top, right, bottom, left) boxes"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top = np.maximum(a[:, None, 0], b[None, :, 0])
+    right = np.minimum(a[:, None, 1], b[None, :, 1])
+    bottom = np.minimum(a[:, None, 2], b[None, :, 2])
+    left = np.maximum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    area_a = (a[:, 1] - a[:, 3]) * (a[:, 2] - a[:, 0])
+    area_b = (b[:, 1] - b[:, 3]) * (b[:, 2] - b[:, 0])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0.0)
+
+
+class Track:
+    """A face followed across frames, with the identity found when it was last encoded"""
+
+    def __init__(self, track_id, box, now):
+        self.id = track_id
+        self.box = np.asarray(box, dtype=np.float32)
+        self.velocity = np.zeros(4, dtype=np.float32)  # box change per second
+        self.updated_at = now
+        self.misses = 0
+        self.user_id = None
+        self.name = None
+        self.distance = float("inf")
+        self.encoded_at = None
+        self.identified = False  # True once the track has been matched against the gallery
+
+    def predict(self, now):
+        """Box extrapolated with constant velocity to time now"""
+        return self.box + self.velocity * min(now - self.updated_at, MAX_PREDICTION)
+
+    def update(self, box, now):
+        box = np.asarray(box, dtype=np.float32)
+        dt = now - self.updated_at
+        if dt > 0:
+            # Smoothed velocity keeps boxes moving between sparse detections
+            self.velocity = 0.5 * self.velocity + 0.5 * (box - self.box) / dt
+        self.box = box
+        self.updated_at = now
+        self.misses = 0
+
+    def needs_encoding(self, now, reverify_interval):
+        return self.encoded_at is None or now - self.encoded_at >= reverify_interval
+
+    def set_identity(self, match, now):
+        self.user_id = match.user_id
+        self.name = match.name
+        self.distance = match.distance
+        self.encoded_at = now
+        self.identified = True
+
+    def int_box(self, now=None):
+        box = self.box if now is None else self.predict(now)
+        return tuple(int(round(v)) for v in box)
+
+
+class FaceTracker:
+    """IoU tracker that carries face boxes and identities between sparse detection passes"""
+
+    def __init__(self, iou_threshold=None, max_misses=None, reverify_interval=None):
+        self.iou_threshold = settings.TRACK_IOU_THRESHOLD if iou_threshold is None else iou_threshold
+        self.max_misses = settings.TRACK_MAX_MISSES if max_misses is None else max_misses
+        self.reverify_interval = settings.TRACK_REVERIFY_INTERVAL if reverify_interval is None else reverify_interval
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, boxes, now):
+        """Associate detected boxes with tracks; returns the tracks that need encoding"""
+        boxes = list(boxes)
+        matched_tracks = set()
+        matched_boxes = set()
+        if self.tracks and boxes:
+            predicted = [track.predict(now) for track in self.tracks]
+            ious = iou_matrix(predicted, boxes)
+            # Greedy assignment, highest overlap first
+            for flat in np.argsort(ious, axis=None)[::-1]:
+                ti, bi = np.unravel_index(flat, ious.shape)
+                if ious[ti, bi] < self.iou_threshold:
+                    break
+                if ti in matched_tracks or bi in matched_boxes:
+                    continue
+                self.tracks[ti].update(boxes[bi], now)
+                matched_tracks.add(ti)
+                matched_boxes.add(bi)
+
+        survivors = []
+        for ti, track in enumerate(self.tracks):
+            if ti not in matched_tracks:
+                track.misses += 1
+                if track.misses > self.max_misses:
+                    continue
+            survivors.append(track)
+        for bi, box in enumerate(boxes):
+            if bi not in matched_boxes:
+                survivors.append(Track(next(self._ids), box, now))
+        self.tracks = survivors
+
+        return [track for track in self.tracks
+                if track.misses == 0 and track.needs_encoding(now, self.reverify_interval)]
+
+    def clear(self):
+        self.tracks = []
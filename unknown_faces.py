@@ -0,0 +1,208 @@
+import time
+from typing import NamedTuple
+import cv2
+import numpy as np
+from PyQt6.QtCore import QSize, Qt, pyqtSignal
+from PyQt6.QtGui import QIcon, QImage, QPixmap
+from PyQt6.QtWidgets import QGroupBox, QHBoxLayout, QListView, QListWidget, QListWidgetItem, QPushButton, QVBoxLayout
+import settings
+from embeddings import ENCODING_MODEL, encoding_to_bytes, photo_hash
+from models import User, UserEmbedding
+from thumbnails import make_thumbnail
+
+# Samples kept per stranger; they become the user's templates when the cluster is enrolled
+MAX_CLUSTER_SAMPLES = 5
+PHOTO_QUALITY = 95
+PANEL_ICON_SIZE = 72
+
+
+class UnknownFace(NamedTuple):
+    track_id: int
+    encoding: np.ndarray  # float32 (128,)
+    crop: np.ndarray  # RGB face crop, owned by the receiver
+    captured_at: float  # time.time() of the frame
+
+
+class UnknownCluster:
+    """Encodings and face crops of one stranger, merged over tracks and time"""
+
+    def __init__(self, cluster_id, face):
+        self.id = cluster_id
+        self.samples = [(face.encoding, face.crop)]
+        self.centroid = np.asarray(face.encoding, dtype=np.float32).copy()
+        self.count = 1
+        self.first_seen = self.last_seen = face.captured_at
+
+    def add(self, face):
+        self.count += 1
+        self.last_seen = face.captured_at
+        # Running mean over every sighting; only the newest samples are kept
+        self.centroid += (face.encoding - self.centroid) / self.count
+        self.samples.append((face.encoding, face.crop))
+        if len(self.samples) > MAX_CLUSTER_SAMPLES:
+            self.samples.pop(0)
+
+    def ordered_samples(self):
+        """Samples nearest the centroid first; the first one is the most typical photo"""
+        return sorted(self.samples, key=lambda sample: float(np.linalg.norm(sample[0] - self.centroid)))
+
+
+class UnknownFaceClusterer:
+    """Groups unknown faces so each stranger is reported once.
+
+    A track keeps its cluster, so re-verifications of the same face cost no distance
+    computation. A new track joins the nearest cluster within `distance` of its centroid,
+    otherwise it starts a new cluster. Clusters not seen for `ttl` seconds are forgotten.
+    """
+
+    def __init__(self, distance=None, ttl=None, max_clusters=None):
+        self.distance = settings.UNKNOWN_CLUSTER_DISTANCE if distance is None else distance
+        self.ttl = settings.UNKNOWN_CLUSTER_TTL if ttl is None else ttl
+        self.max_clusters = settings.UNKNOWN_MAX_CLUSTERS if max_clusters is None else max_clusters
+        self.clusters = {}
+        self.track_cluster = {}
+        self._next_id = 1
+
+    def add(self, face):
+        """Record one sighting; returns (cluster, True if it is a new stranger)"""
+        cluster = self.clusters.get(self.track_cluster.get(face.track_id))
+        if cluster is None and self.clusters:
+            ids = list(self.clusters)
+            centroids = np.stack([self.clusters[i].centroid for i in ids])
+            distances = np.linalg.norm(centroids - face.encoding, axis=1)
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= self.distance:
+                cluster = self.clusters[ids[nearest]]
+        if cluster is not None:
+            cluster.add(face)
+            self.track_cluster[face.track_id] = cluster.id
+            return cluster, False
+
+        cluster = UnknownCluster(self._next_id, face)
+        self._next_id += 1
+        self.clusters[cluster.id] = cluster
+        self.track_cluster[face.track_id] = cluster.id
+        return cluster, True
+
+    def expire(self, now=None):
+        """Forget clusters not seen within ttl (and the oldest beyond max_clusters); returns their ids"""
+        now = time.time() if now is None else now
+        expired = [c.id for c in self.clusters.values() if now - c.last_seen > self.ttl]
+        by_age = sorted((c for c in self.clusters.values() if c.id not in expired), key=lambda c: c.last_seen)
+        expired += [c.id for c in by_age[:max(0, len(by_age) - self.max_clusters)]]
+        for cluster_id in expired:
+            self.remove(cluster_id)
+        return expired
+
+    def forget_tracks(self):
+        """Track ids restart with every recognition worker; clusters are kept"""
+        self.track_cluster.clear()
+
+    def remove(self, cluster_id):
+        self.clusters.pop(cluster_id, None)
+        self.track_cluster = {t: c for t, c in self.track_cluster.items() if c != cluster_id}
+
+
+def crop_to_jpeg(crop):
+    ok, data = cv2.imencode(".jpg", cv2.cvtColor(crop, cv2.COLOR_RGB2BGR), [cv2.IMWRITE_JPEG_QUALITY, PHOTO_QUALITY])
+    return data.tobytes() if ok else None
+
+
+def enroll_cluster(db, cluster, name):
+    """Create a user from the cluster's crops and the encodings already computed for them:
+    the most typical sample is the main photo, the others become templates. Returns
+    (user, encodings matrix with the main encoding first), or None when no crop could be
+    encoded as JPEG."""
+    # Samples whose crop fails to encode are left out together with their encodings
+    samples = [(encoding, photo) for encoding, photo in
+               ((encoding, crop_to_jpeg(crop)) for encoding, crop in cluster.ordered_samples())
+               if photo is not None]
+    if not samples:
+        return None
+    (main_encoding, main_photo), templates = samples[0], samples[1:]
+    user = User(
+        name=name,
+        photo=main_photo,
+        photo_hash=photo_hash(main_photo),
+        thumbnail=make_thumbnail(main_photo),
+        encoding=encoding_to_bytes(main_encoding),
+        encoding_model=ENCODING_MODEL,
+    )
+    db.add(user)
+    db.flush()
+    for encoding, photo in templates:
+        db.add(UserEmbedding(user_id=user.id, photo=photo, photo_hash=photo_hash(photo),
+                             encoding=encoding_to_bytes(encoding), encoding_model=ENCODING_MODEL))
+    db.commit()
+    return user, np.array([encoding for encoding, _ in samples], dtype=np.float32)
+
+
+def crop_icon(crop, size=PANEL_ICON_SIZE):
+    height, width = crop.shape[:2]
+    image = QImage(crop.data, width, height, crop.strides[0], QImage.Format.Format_RGB888)
+    # QPixmap.fromImage copies the pixels, so the crop can be released afterwards
+    return QIcon(QPixmap.fromImage(image).scaled(size, size, Qt.AspectRatioMode.KeepAspectRatio,
+                                                 Qt.TransformationMode.SmoothTransformation))
+
+
+class UnknownFacesPanel(QGroupBox):
+    """Non-modal list of strangers seen by the camera, one entry per cluster"""
+
+    enroll_requested = pyqtSignal(int)  # cluster id
+    dismissed = pyqtSignal(int)  # cluster id
+
+    def __init__(self, parent=None):
+        super().__init__("Неизвестные лица", parent)
+        self.items = {}
+        self.list = QListWidget()
+        self.list.setViewMode(QListView.ViewMode.IconMode)
+        self.list.setFlow(QListView.Flow.LeftToRight)
+        self.list.setWrapping(False)
+        self.list.setIconSize(QSize(PANEL_ICON_SIZE, PANEL_ICON_SIZE))
+        self.list.setFixedHeight(PANEL_ICON_SIZE + 48)
+        self.enroll_button = QPushButton("➕ Зарегистрировать")
+        self.dismiss_button = QPushButton("✖ Скрыть")
+        self.enroll_button.clicked.connect(lambda: self._emit_selected(self.enroll_requested))
+        self.dismiss_button.clicked.connect(lambda: self._emit_selected(self.dismissed))
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(self.enroll_button)
+        buttons.addWidget(self.dismiss_button)
+        buttons.addStretch()
+        layout = QVBoxLayout()
+        layout.addWidget(self.list)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+        self.setVisible(False)
+
+    def _emit_selected(self, signal):
+        item = self.list.currentItem()
+        if item is not None:
+            signal.emit(item.data(Qt.ItemDataRole.UserRole))
+
+    @staticmethod
+    def _label(cluster):
+        return f"{time.strftime('%H:%M', time.localtime(cluster.first_seen))} ×{cluster.count}"
+
+    def add_cluster(self, cluster):
+        item = QListWidgetItem(crop_icon(cluster.samples[0][1]), self._label(cluster))
+        item.setData(Qt.ItemDataRole.UserRole, cluster.id)
+        self.list.insertItem(0, item)
+        self.items[cluster.id] = item
+        self.setVisible(True)
+
+    def update_cluster(self, cluster):
+        item = self.items.get(cluster.id)
+        if item is not None:
+            item.setText(self._label(cluster))
+
+    def remove_cluster(self, cluster_id):
+        item = self.items.pop(cluster_id, None)
+        if item is not None:
+            self.list.takeItem(self.list.row(item))
+        self.setVisible(bool(self.items))
+
+    def clear_clusters(self):
+        self.list.clear()
+        self.items.clear()
+        self.setVisible(False)
@@ -0,0 +1,167 @@
+import queue
+from collections import OrderedDict
+from PyQt6.QtCore import Qt, QAbstractListModel, QModelIndex, QThread, pyqtSignal
+from PyQt6.QtGui import QIcon, QImage, QPixmap
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from db_config import SessionLocal
+from models import User
+from thumbnails import load_thumbnails
+
+PAGE_SIZE = 100
+ICON_CACHE_SIZE = 500
+ICON_SIZE = 50
+# Thumbnails requested together are read in one query
+THUMBNAIL_BATCH_SIZE = 50
+
+
+class ThumbnailLoader(QThread):
+    """Reads thumbnails for requested user ids in batches and decodes them off the UI thread"""
+
+    loaded = pyqtSignal(int, QImage)
+
+    def __init__(self, session_factory=SessionLocal, parent=None):
+        super().__init__(parent)
+        self.session_factory = session_factory
+        self.requests = queue.Queue()
+        self._running = True
+
+    def request(self, user_id):
+        self.requests.put(user_id)
+
+    def stop(self):
+        self._running = False
+        self.requests.put(None)
+        self.wait()
+
+    def _next_batch(self):
+        batch = [self.requests.get()]
+        while len(batch) < THUMBNAIL_BATCH_SIZE:
+            try:
+                batch.append(self.requests.get_nowait())
+            except queue.Empty:
+                break
+        return [user_id for user_id in batch if user_id is not None]
+
+    def run(self):
+        db = self.session_factory()
+        try:
+            while self._running:
+                batch = self._next_batch()
+                if not batch or not self._running:
+                    continue
+                try:
+                    thumbnails = load_thumbnails(db, batch)
+                except Exception as e:
+                    db.rollback()
+                    print(f"Error loading thumbnails: {e}")
+                    continue
+                for user_id, data in thumbnails.items():
+                    image = QImage.fromData(data)
+                    if not image.isNull():
+                        self.loaded.emit(user_id, image.scaled(
+                            ICON_SIZE, ICON_SIZE, Qt.AspectRatioMode.KeepAspectRatio,
+                            Qt.TransformationMode.SmoothTransformation))
+        finally:
+            db.close()
+
+
+class UserListModel(QAbstractListModel):
+    """Users (id, name) fetched in pages while scrolling; the photo column is never read.
+
+    Icons are requested only for rows the view paints, loaded by a ThumbnailLoader and
+    kept in an LRU cache of ICON_CACHE_SIZE icons.
+    """
+
+    UserIdRole = Qt.ItemDataRole.UserRole
+
+    def __init__(self, db, page_size=PAGE_SIZE, cache_size=ICON_CACHE_SIZE, parent=None):
+        super().__init__(parent)
+        self.db = db
+        self.page_size = page_size
+        self.cache_size = cache_size
+        self.rows = []
+        self.row_of = {}
+        self.has_more = True
+        self.icons = OrderedDict()
+        self.requested = set()
+        self.loader = ThumbnailLoader()
+        self.loader.loaded.connect(self._on_thumbnail)
+        self.loader.start()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.ItemDataRole.DisplayRole):
+        if not index.isValid():
+            return None
+        user_id, name = self.rows[index.row()]
+        if role == Qt.ItemDataRole.DisplayRole:
+            return name
+        if role == self.UserIdRole:
+            return user_id
+        if role == Qt.ItemDataRole.DecorationRole:
+            return self._icon(user_id)
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and self.has_more
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid() or not self.has_more:
+            return
+        last_id = self.rows[-1][0] if self.rows else 0
+        try:
+            page = [tuple(row) for row in self.db.execute(
+                select(User.id, User.name).where(User.id > last_id).order_by(User.id).limit(self.page_size)
+            )]
+        except SQLAlchemyError as e:
+            # Central database unreachable (offline kiosk): show what is loaded
+            self.db.rollback()
+            self.has_more = False
+            print(f"Could not load users: {e}")
+            return
+        self.has_more = len(page) == self.page_size
+        if page:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+            for row in page:
+                self.row_of[row[0]] = len(self.rows)
+                self.rows.append(row)
+            self.endInsertRows()
+
+    def refresh(self):
+        """Drop loaded rows and read the first page again; cached icons are kept"""
+        self.beginResetModel()
+        self.rows = []
+        self.row_of = {}
+        self.has_more = True
+        self.endResetModel()
+        self.fetchMore()
+
+    def forget(self, user_id):
+        """Drop the cached icon of a deleted or changed user"""
+        self.icons.pop(user_id, None)
+        self.requested.discard(user_id)
+
+    def stop(self):
+        self.loader.stop()
+
+    def _icon(self, user_id):
+        icon = self.icons.get(user_id)
+        if icon is not None:
+            self.icons.move_to_end(user_id)
+            return icon
+        if user_id not in self.requested:
+            self.requested.add(user_id)
+            self.loader.request(user_id)
+        return None
+
+    def _on_thumbnail(self, user_id, image):
+        self.requested.discard(user_id)
+        self.icons[user_id] = QIcon(QPixmap.fromImage(image))
+        while len(self.icons) > self.cache_size:
+            self.icons.popitem(last=False)
+        row = self.row_of.get(user_id)
+        if row is not None:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])